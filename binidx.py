@@ -0,0 +1,169 @@
+# Small array-backed container for the binary side indexes (*.idx).
+#
+# Layout: MAGIC, u32 header length, JSON header, padding to 8 bytes, then
+# the raw sections back to back. Sections are read through memoryview casts
+# over an mmap, so opening an index does not decode it.
+from array import array
+from pathlib import Path
+import json
+import mmap
+import os
+import struct
+import sys
+
+from manifests import file_sha256, read_hash_cache, write_hash_cache
+
+MAGIC = b"CNTBIN1\n"
+
+# sha256 of sources whose mtime no longer matches their stamp, by size and
+# mtime, so a copied or touched TSV is hashed once rather than on every open
+HASH_CACHE = ".source_hash_cache.tsv"
+
+def source_stamp(p: Path) -> dict:
+    st = p.stat()
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": file_sha256(p)}
+
+def source_stamps(sources, base: Path) -> dict:
+    # path relative to base (the directory of whatever records the stamps)
+    # -> source_stamp(), so a data root can be queried from anywhere
+    return {os.path.relpath(p, base): source_stamp(Path(p)) for p in sources}
+
+def sources_fresh(sources: dict, base: Path = Path(".")) -> bool:
+    # sources: source_stamps() taken when the index was built
+    cache = None
+    for name, want in sources.items():
+        p = Path(base) / name
+        try:
+            st = p.stat()
+        except OSError:
+            return False
+        if st.st_size != want["size"]:
+            return False
+        if st.st_mtime_ns == want["mtime_ns"]:
+            continue
+        # mtime differs after a checkout/copy; fall back to content hash,
+        # looked up in HASH_CACHE first
+        if cache is None:
+            cache = read_hash_cache(Path(base) / HASH_CACHE)
+        hit = cache.get(name)
+        if hit and hit[:2] == (st.st_size, st.st_mtime_ns):
+            digest = hit[2]
+        else:
+            digest = file_sha256(p)
+            cache[name] = (st.st_size, st.st_mtime_ns, digest)
+            try:
+                write_hash_cache(Path(base) / HASH_CACHE, cache)
+            except OSError:
+                pass    # read-only data root: hash again next time
+        if digest != want["sha256"]:
+            return False
+    return True
+
+def write(path: Path, kind: str, sections: dict, sources=(), meta=None) -> None:
+    layout = {}
+    blobs = []
+    pos = 0
+    for name, data in sections.items():
+        if isinstance(data, array):
+            code, count, raw = data.typecode, len(data), data.tobytes()
+        else:
+            raw = bytes(data)
+            code, count = "B", len(raw)
+        pad = (-pos) % 8
+        pos += pad
+        layout[name] = [code, pos, count]
+        blobs.append(b"\0" * pad + raw)
+        pos += len(raw)
+
+    header = json.dumps({
+        "kind": kind,
+        "byteorder": sys.byteorder,
+        "sources": source_stamps(sources, path.parent),
+        "meta": meta or {},
+        "sections": layout,
+    }, sort_keys=True).encode("utf-8")
+    head = MAGIC + struct.pack("<I", len(header)) + header
+    head += b"\0" * ((-len(head)) % 8)
+
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("wb") as g:
+        g.write(head)
+        for b in blobs:
+            g.write(b)
+    os.replace(tmp, path)
+
+class BinIndex:
+    def __init__(self, path: Path):
+        self.path = path
+        self._f = path.open("rb")
+        self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"Not a binary index: {path}")
+        n = struct.unpack_from("<I", self._mm, len(MAGIC))[0]
+        start = len(MAGIC) + 4
+        self.header = json.loads(self._mm[start:start + n].decode("utf-8"))
+        self._base = start + n + ((-(start + n)) % 8)
+        self._cache = {}
+
+    @property
+    def kind(self) -> str:
+        return self.header["kind"]
+
+    @property
+    def meta(self) -> dict:
+        return self.header["meta"]
+
+    def __getitem__(self, name: str) -> memoryview:
+        v = self._cache.get(name)
+        if v is None:
+            code, off, count = self.header["sections"][name]
+            size = struct.calcsize(code)
+            off += self._base
+            v = memoryview(self._mm)[off:off + count * size]
+            if code != "B":
+                v = v.cast(code)
+            self._cache[name] = v
+        return v
+
+    def fresh(self) -> bool:
+        if self.header["byteorder"] != sys.byteorder:
+            return False
+        return sources_fresh(self.header["sources"], self.path.parent)
+
+    def close(self) -> None:
+        for v in self._cache.values():
+            v.release()
+        self._cache.clear()
+        try:
+            self._mm.close()
+        except (BufferError, AttributeError):
+            pass
+        self._f.close()
+
+def load(path: Path, kind: str):
+    # Returns an open BinIndex, or None when missing, foreign or stale.
+    if not path.exists():
+        return None
+    try:
+        idx = BinIndex(path)
+    except (OSError, ValueError):
+        return None
+    if idx.kind != kind or not idx.fresh():
+        idx.close()
+        return None
+    return idx
+
+def heap_get(offs, heap, i: int) -> bytes:
+    return bytes(heap[offs[i]:offs[i + 1]])
+
+def lower_bound(offs, heap, key: bytes, lo: int = 0, hi: int = None) -> int:
+    if hi is None:
+        hi = len(offs) - 1
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if bytes(heap[offs[mid]:offs[mid + 1]]) < key:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
@@ -0,0 +1,65 @@
+# Shared --batch plumbing for the cnt_*.py query CLIs.
+#
+#   ./cnt_lookup.py --batch [FILE] [--jsonl]
+#
+# Queries are read one per line from FILE (or stdin when FILE is omitted or
+# "-"); blank lines and lines starting with "#" are skipped. The data files
+# are loaded once and results are streamed keyed by the input query.
+#
+# arg() and jobs_arg() are the option helpers the cnt_*.py and tools_*.py
+# scripts share.
+import json
+import os
+import sys
+
+def arg(argv, name: str, default: str) -> str:
+    if name in argv:
+        i = argv.index(name)
+        if i + 1 < len(argv):
+            return argv[i + 1]
+    return default
+
+def jobs_arg(argv) -> int:
+    # --jobs N (0 = one per CPU); default serial
+    if "--jobs" not in argv:
+        return 1
+    i = argv.index("--jobs")
+    try:
+        n = int(argv[i + 1])
+    except (IndexError, ValueError):
+        raise SystemExit("--jobs needs an integer")
+    return n if n > 0 else (os.cpu_count() or 1)
+
+
+def batch_args(argv):
+    # Returns (batch_path_or_None, remaining_args). "-" means stdin.
+    if "--batch" not in argv:
+        return None, list(argv)
+    i = argv.index("--batch")
+    rest = argv[:i] + argv[i + 1:]
+    path = "-"
+    if i + 1 < len(argv) and not argv[i + 1].startswith("--"):
+        path = argv[i + 1]
+        rest = argv[:i] + argv[i + 2:]
+    return path, rest
+
+def iter_queries(path: str):
+    f = sys.stdin if path == "-" else open(path, "r", encoding="utf-8")
+    try:
+        for line in f:
+            q = line.strip()
+            if not q or q.startswith("#"):
+                continue
+            yield q
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+def emit_tsv(fields) -> None:
+    sys.stdout.write("\t".join(str(x) for x in fields) + "\n")
+
+def emit_jsonl(obj) -> None:
+    sys.stdout.write(json.dumps(obj, ensure_ascii=False) + "\n")
+
+def report(n: int, missed: int) -> None:
+    print(f"OK: {n} queries, {missed} without hits", file=sys.stderr)
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# Co-citation neighbours: the lemmas that cite the same tab/entry as a lemma.
+#
+#   ./cnt_cocite.py CNT-IDX-0000123 [--limit N] [--min K]
+#   ./cnt_cocite.py <lemma>               (every row with that lemma_key)
+#   ./cnt_cocite.py --batch [FILE] [--jsonl]
+#
+# Two rows are neighbours when they share a REF or RANGE_START ref (the same
+# packed tab,entry key cnt_reverse.py searches on); neighbours are ranked by
+# the number of distinct refs they share, then lemma_key. Answers come from
+# index_cocite.idx (tools_make_cocite_index.py) when it is current, else the
+# graph is built from index_corpus.idx (tools_pack_corpus.py) or the TSVs.
+from collections import Counter
+from pathlib import Path
+import csv
+import sys
+
+import binidx
+import cnt_batch
+import cntpack
+import volumes
+from cnt_lookup import norm_key
+from cnt_reverse import load_rows, ref_key, unpack
+
+ROWS = volumes.path("index_rows_id.tsv")
+REFS = volumes.path("index_refs_norm.tsv")
+IDX = volumes.path("index_cocite.idx")
+IDX_KIND = "cocite-v1"
+
+COCITE_TYPES = ("REF", "RANGE_START")
+
+def load_keys(path: Path = REFS):
+    # cnt_idx -> sorted distinct packed keys of its REF / RANGE_START refs
+    keys = {}
+    with path.open("r", encoding="utf-8") as f:
+        for ref in csv.DictReader(f, delimiter="\t"):
+            if ref["ref_type"] not in COCITE_TYPES:
+                continue
+            k = ref_key(ref["ref_norm"])
+            if k is not None:
+                keys.setdefault(ref["cnt_idx"], set()).add(k)
+    return {c: sorted(ks) for c, ks in keys.items()}
+
+def pack_nodes(corpus):
+    # load_nodes() from the packed corpus, which has no refs without a row
+    rows, keys = {}, {}
+    for i in range(corpus.n_rows):
+        c = corpus.cnt_idx(i)
+        rows[c] = (corpus.lemma_key(i), corpus.lemma(i))
+        ks = {corpus.ref_key[j] for j in corpus.refs_of(i)
+              if corpus.ref_type(j) in COCITE_TYPES and corpus.ref_key[j] != cntpack.NO_KEY}
+        if ks:
+            keys[c] = sorted(ks)
+    return rows, keys
+
+def load_nodes(rows_path: Path = ROWS, refs_path: Path = REFS):
+    # (rows, keys): cnt_idx -> (lemma_key, lemma) for every row or ref owner,
+    # cnt_idx -> keys; read from index_corpus.idx when it is current
+    corpus = cntpack.load(rows_path.parent) if rows_path.parent == refs_path.parent else None
+    if corpus is not None:
+        try:
+            return pack_nodes(corpus)
+        finally:
+            corpus.close()
+    rows = {c: (r["lemma_key"], r["lemma"]) for c, r in load_rows(rows_path).items()}
+    keys = load_keys(refs_path)
+    for c in keys:
+        rows.setdefault(c, ("<?>", "<?>"))
+    return rows, keys
+
+def neighbours(rows, keys):
+    # cnt_idx -> [(shared, cnt_idx)], ranked
+    citing = {}
+    for c, ks in keys.items():
+        for k in ks:
+            citing.setdefault(k, []).append(c)
+    out = {}
+    for c, ks in keys.items():
+        shared = Counter(o for k in ks for o in citing[k])
+        del shared[c]
+        out[c] = sorted(((n, o) for o, n in shared.items()), key=lambda x: (-x[0], rows[x[1]][0], x[1]))
+    return out
+
+def is_cnt_idx(q: str) -> bool:
+    return q.startswith("CNT-IDX-")
+
+class MemGraph:
+    # The graph built from the TSVs; nodes are cnt_idx strings.
+    def __init__(self, root: Path = volumes.ROOT):
+        self.rows, self._keys = load_nodes(root / ROWS.name, root / REFS.name)
+        self.nbrs = neighbours(self.rows, self._keys)
+        self.by_key = {}
+        for c in sorted(self.rows):
+            self.by_key.setdefault(self.rows[c][0], []).append(c)
+
+    def find(self, q: str):
+        if is_cnt_idx(q):
+            return [q] if q in self.rows else []
+        return self.by_key.get(norm_key(q), [])
+
+    def row(self, c):
+        return (c,) + self.rows[c]
+
+    def keys(self, c):
+        return self._keys.get(c, [])
+
+    def neighbours(self, c):
+        return self.nbrs.get(c, [])
+
+    def close(self) -> None:
+        pass
+
+class IndexGraph:
+    # CSR adjacency in the mmapped index_cocite.idx; nodes are ints, in
+    # cnt_idx order.
+    def __init__(self, idx):
+        self.idx = idx
+
+    def find(self, q: str):
+        ix = self.idx
+        offs, heap = ix["cnt_off"], ix["cnt_heap"]
+        if is_cnt_idx(q):
+            i = binidx.lower_bound(offs, heap, q.encode("utf-8"))
+            return [i] if i < len(offs) - 1 and binidx.heap_get(offs, heap, i) == q.encode("utf-8") else []
+        # lk_order: nodes sorted by (lemma_key, cnt_idx)
+        key, order = norm_key(q).encode("utf-8"), ix["lk_order"]
+        lo, hi = 0, len(order)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.lemma_key(order[mid]) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        out = []
+        while lo < len(order) and self.lemma_key(order[lo]) == key:
+            out.append(order[lo])
+            lo += 1
+        return out
+
+    def lemma_key(self, i: int) -> bytes:
+        return binidx.heap_get(self.idx["lemma_off"], self.idx["lemma_heap"], i).split(b"\x1f", 1)[0]
+
+    def row(self, i: int):
+        ix = self.idx
+        lemma_key, lemma = binidx.heap_get(ix["lemma_off"], ix["lemma_heap"], i).decode("utf-8").split("\x1f")
+        return binidx.heap_get(ix["cnt_off"], ix["cnt_heap"], i).decode("utf-8"), lemma_key, lemma
+
+    def keys(self, i: int):
+        off = self.idx["key_off"]
+        return self.idx["keys"][off[i]:off[i + 1]].tolist()
+
+    def neighbours(self, i: int):
+        off = self.idx["nbr_off"]
+        lo, hi = off[i], off[i + 1]
+        return list(zip(self.idx["nbr_shared"][lo:hi].tolist(), self.idx["nbr"][lo:hi].tolist()))
+
+    def close(self) -> None:
+        self.idx.close()
+
+def open_graph(root: Path = volumes.ROOT):
+    idx = binidx.load(root / IDX.name, IDX_KIND)
+    return IndexGraph(idx) if idx is not None else MemGraph(root)
+
+def cocited(g, q: str, limit: int, min_shared: int):
+    # [(row, keys, neighbour count, [(shared, row, shared keys)])] for each
+    # row the query names
+    out = []
+    for node in g.find(q):
+        keys = g.keys(node)
+        mine = set(keys)
+        ranked = g.neighbours(node)
+        nbrs = []
+        for n, other in ranked:
+            if n < min_shared or (limit and len(nbrs) >= limit):
+                break
+            nbrs.append((n, g.row(other), [k for k in g.keys(other) if k in mine]))
+        out.append((g.row(node), keys, len(ranked), nbrs))
+    return out
+
+def fmt_refs(keys) -> str:
+    return "; ".join(unpack(k) for k in keys)
+
+def run_batch(path: str, jsonl: bool, limit: int, min_shared: int) -> int:
+    g = open_graph()
+    n = missed = 0
+    try:
+        for q in cnt_batch.iter_queries(path):
+            n += 1
+            found = cocited(g, q, limit, min_shared)
+            if not any(nbrs for _, _, _, nbrs in found):
+                missed += 1
+            if jsonl:
+                cnt_batch.emit_jsonl({"query": q, "rows": [{
+                    "cnt_idx": row[0], "lemma_key": row[1], "lemma": row[2],
+                    "refs": [unpack(k) for k in keys], "neighbour_count": total,
+                    "neighbours": [{"cnt_idx": o[0], "lemma_key": o[1], "lemma": o[2], "shared": s,
+                                    "refs": [unpack(k) for k in ks]} for s, o, ks in nbrs],
+                } for row, keys, total, nbrs in found]})
+            else:
+                for row, _, _, nbrs in found:
+                    for s, o, ks in nbrs:
+                        cnt_batch.emit_tsv([q, row[0], s, o[1], o[2], o[0], fmt_refs(ks)])
+    finally:
+        g.close()
+    cnt_batch.report(n, missed)
+    return 0
+
+def int_arg(args, name: str, default: int):
+    # (value, args without the option), value None when it is not a number
+    if name not in args:
+        return default, args
+    i = args.index(name)
+    if i + 1 >= len(args) or not args[i + 1].isdigit():
+        return None, args
+    return int(args[i + 1]), args[:i] + args[i + 2:]
+
+def main() -> int:
+    batch, args = cnt_batch.batch_args(sys.argv[1:])
+    jsonl = "--jsonl" in args
+    args = [a for a in args if a != "--jsonl"]
+    limit, args = int_arg(args, "--limit", 20)
+    min_shared, args = int_arg(args, "--min", 1)
+    if limit is None or min_shared is None:
+        print("--limit and --min need a number (--limit 0 lists every neighbour)", file=sys.stderr)
+        return 2
+
+    if batch is None and not args:
+        print("Usage: ./cnt_cocite.py CNT-IDX-0000123 [--limit N] [--min K]", file=sys.stderr)
+        print("   or: ./cnt_cocite.py <lemma> [--limit N] [--min K]", file=sys.stderr)
+        print("   or: ./cnt_cocite.py --batch [FILE] [--jsonl] [--limit N] [--min K]", file=sys.stderr)
+        return 2
+
+    if not ROWS.exists() or not REFS.exists():
+        print("Missing required TSVs. Need index_rows_id.tsv and index_refs_norm.tsv", file=sys.stderr)
+        return 2
+
+    if batch is not None:
+        return run_batch(batch, jsonl, limit, min_shared)
+
+    q = " ".join(args).strip()
+    g = open_graph()
+    try:
+        found = cocited(g, q, limit, min_shared)
+    finally:
+        g.close()
+    if not found:
+        print(f"Not found: {q}", file=sys.stderr)
+        return 1
+
+    for i, (row, keys, total, nbrs) in enumerate(found):
+        if i:
+            print("")
+        print(f"{row[0]}\t{row[1]}\t{row[2]}\trefs={len(keys)}\tneighbours={total}")
+        for s, o, ks in nbrs:
+            print(f"{s}\t{o[1]}\t{o[2]}\t{o[0]}\t({fmt_refs(ks)})")
+
+    if not any(nbrs for _, _, _, nbrs in found):
+        print(f"No co-cited lemmas for: {q}", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# Load test for cnt_server.py: p50/p99 latency per concurrency level.
+#
+#   ./cnt_server.py &
+#   ./cnt_loadtest.py [--url http://127.0.0.1:8765] [--requests 2000]
+#                     [--levels 1,8,64] [--json]
+#
+# Latencies and rps count only 2xx responses; the rest (and failed
+# connections) are errors, and a level where nothing succeeded reports its
+# percentiles as n/a (null with --json).
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, urlparse
+import csv
+import http.client
+import json
+import random
+import sys
+import threading
+import time
+
+import volumes
+from cnt_batch import arg
+
+ROWS = volumes.path("index_rows_id.tsv")
+REFS = volumes.path("index_refs_norm.tsv")
+
+def make_queries(n: int, seed: int = 1):
+    rnd = random.Random(seed)
+    with ROWS.open("r", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f, delimiter="\t"))
+    with REFS.open("r", encoding="utf-8") as f:
+        norms = [r["ref_norm"] for r in csv.DictReader(f, delimiter="\t") if r["ref_type"] == "REF"]
+
+    out = []
+    for i in range(n):
+        row = rnd.choice(rows)
+        kind = i % 4
+        if kind == 0:
+            out.append("/lookup?q=" + quote(row["lemma_key"]))
+        elif kind == 1:
+            out.append("/lookup?prefix=1&limit=50&q=" + quote(row["lemma_key"][:3]))
+        elif kind == 2:
+            out.append("/refs?cnt_idx=" + quote(row["cnt_idx"]))
+        else:
+            out.append("/reverse?ref=" + quote(rnd.choice(norms)))
+    return out
+
+def percentile(xs, p: float):
+    xs = sorted(xs)
+    if not xs:
+        return None
+    i = min(len(xs) - 1, max(0, int(round(p / 100.0 * len(xs) + 0.5)) - 1))
+    return xs[i]
+
+def run_level(url: str, queries, concurrency: int):
+    u = urlparse(url)
+    local = threading.local()
+    errors = []
+
+    def one(path):
+        conn = getattr(local, "conn", None)
+        if conn is None:
+            conn = local.conn = http.client.HTTPConnection(u.hostname, u.port or 80, timeout=30)
+        t0 = time.perf_counter()
+        try:
+            conn.request("GET", path)
+            resp = conn.getresponse()
+            resp.read()
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(str(e))
+            conn.close()
+            local.conn = None
+            return None
+        if not 200 <= resp.status < 300:
+            errors.append(resp.status)
+            return None
+        return time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as ex:
+        lat = [t for t in ex.map(one, queries) if t is not None]
+    wall = time.perf_counter() - t0
+    p50, p99 = percentile(lat, 50), percentile(lat, 99)
+    return {
+        "concurrency": concurrency,
+        "requests": len(queries),
+        "errors": len(errors),
+        "p50_ms": round(p50 * 1000, 3) if p50 is not None else None,
+        "p99_ms": round(p99 * 1000, 3) if p99 is not None else None,
+        "rps": round(len(lat) / wall, 1) if wall else 0.0,
+    }
+
+def main() -> int:
+    argv = sys.argv[1:]
+    url = arg(argv, "--url", "http://127.0.0.1:8765")
+    n = int(arg(argv, "--requests", "2000"))
+    levels = [int(x) for x in arg(argv, "--levels", "1,8,64").split(",") if x]
+
+    if not ROWS.exists() or not REFS.exists():
+        print("Missing required TSVs. Need index_rows_id.tsv and index_refs_norm.tsv", file=sys.stderr)
+        return 2
+
+    queries = make_queries(n)
+    run_level(url, queries[:50], 1)  # warm up
+
+    results = [run_level(url, queries, c) for c in levels]
+    if "--json" in argv:
+        print(json.dumps(results, indent=2))
+    else:
+        print("concurrency\trequests\terrors\tp50_ms\tp99_ms\trps")
+        for r in results:
+            p50, p99 = ("n/a" if r[k] is None else r[k] for k in ("p50_ms", "p99_ms"))
+            print(f"{r['concurrency']}\t{r['requests']}\t{r['errors']}\t{p50}\t{p99}\t{r['rps']}")
+    return 0 if not any(r["errors"] for r in results) else 1
+
+if __name__ == "__main__":
+    raise SystemExit(main())
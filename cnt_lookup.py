@@ -1,9 +1,20 @@
 #!/usr/bin/env python3
 import sys
 import re
+from bisect import bisect_left
+from heapq import merge
 from pathlib import Path
 
-TSV = Path("index_rows_keyed.tsv")
+import binidx
+import cnt_batch
+import cntpack
+import fuzzy
+import sqlitedb
+import volumes
+
+TSV = volumes.path("index_rows_keyed.tsv")
+IDX = volumes.path("index_rows_keyed.idx")
+IDX_KIND = "lookup-v1"
 
 def norm_key(q: str) -> str:
     q = q.strip().lower()
@@ -13,36 +24,281 @@ def norm_key(q: str) -> str:
     q = re.sub(r"\s+", " ", q).strip()
     return q
 
+def scan_tsv(key: str, prefix_mode: bool):
+    out = []
+    with TSV.open("r", encoding="utf-8") as f:
+        header = f.readline()
+        for line in f:
+            parts = line.rstrip("\n").split("\t")
+            if len(parts) < 5:
+                continue
+            lemma_key = parts[0]
+            ok = lemma_key.startswith(key) if prefix_mode else (lemma_key == key)
+            if ok:
+                out.append(parts[:5])
+    return out
+
+def key_bound(key: str, prefix_mode: bool) -> str:
+    # keys are plain ascii, so these sentinels bound the exact/prefix range
+    return key + ("\xff" if prefix_mode else "\x00")
+
+class IndexTable:
+    # Binary search over the mmapped index_rows_keyed.idx.
+    def __init__(self, idx, root: Path = volumes.ROOT):
+        self.idx = idx
+        self.f = (root / TSV.name).open("rb")
+
+    def find(self, key: str, prefix_mode: bool):
+        offs, heap, row_off = self.idx["key_off"], self.idx["key_heap"], self.idx["row_off"]
+        lo = binidx.lower_bound(offs, heap, key.encode("utf-8"))
+        hi = binidx.lower_bound(offs, heap, key_bound(key, prefix_mode).encode("latin-1"), lo)
+        out = []
+        for off in sorted(row_off[lo:hi]):
+            self.f.seek(off)
+            out.append(self.f.readline().decode("utf-8").rstrip("\n").split("\t")[:5])
+        return out
+
+    def close(self) -> None:
+        self.f.close()
+        self.idx.close()
+
+class PackTable:
+    # Binary search over the key_order of the packed corpus (cntpack.py),
+    # when its rows are those of index_rows_keyed.tsv.
+    def __init__(self, corpus):
+        self.corpus = corpus
+
+    def find(self, key: str, prefix_mode: bool):
+        c = self.corpus
+        lo, hi = c.key_range(key, prefix_mode)
+        return [[c.lemma_key(i), c.lemma(i), c.refs_raw(i), c.source_column(i), str(c.row_line[i])]
+                for i in sorted(c.key_order[lo:hi])]
+
+    def close(self) -> None:
+        self.corpus.close()
+
+def open_pack(root: Path = volumes.ROOT):
+    corpus = cntpack.load(root)
+    if corpus is not None and not corpus.keyed():
+        corpus.close()
+        corpus = None
+    return PackTable(corpus) if corpus is not None else None
+
+class MemTable:
+    # Same search over the TSV loaded once, for batch runs without an index.
+    def __init__(self, root: Path = volumes.ROOT):
+        rows = []
+        with (root / TSV.name).open("r", encoding="utf-8") as f:
+            f.readline()
+            for line in f:
+                parts = line.rstrip("\n").split("\t")
+                if len(parts) >= 5:
+                    rows.append((parts[0], len(rows), parts[:5]))
+        rows.sort(key=lambda x: (x[0], x[1]))
+        self.keys = [r[0] for r in rows]
+        self.rows = rows
+
+    def find(self, key: str, prefix_mode: bool):
+        lo = bisect_left(self.keys, key)
+        hi = bisect_left(self.keys, key_bound(key, prefix_mode), lo)
+        return [r[2] for r in sorted(self.rows[lo:hi], key=lambda x: x[1])]
+
+    def close(self) -> None:
+        pass
+
+class DbTable:
+    # Same search against the rows table of index.sqlite.
+    def __init__(self, root: Path = volumes.ROOT):
+        self.conn = sqlitedb.connect(root / sqlitedb.DB.name)
+
+    def find(self, key: str, prefix_mode: bool):
+        cur = self.conn.execute(
+            "SELECT lemma_key, lemma, refs_raw, source_column, line_no FROM rows"
+            " WHERE lemma_key >= ? AND lemma_key < ? ORDER BY rowid",
+            (key, key_bound(key, prefix_mode)))
+        return [[k, lemma, refs, src, str(ln)] for k, lemma, refs, src, ln in cur]
+
+    def close(self) -> None:
+        self.conn.close()
+
+def open_table(db: bool = False, root: Path = volumes.ROOT):
+    if db:
+        return DbTable(root)
+    idx = binidx.load(root / IDX.name, IDX_KIND)
+    if idx is not None:
+        return IndexTable(idx, root)
+    return open_pack(root) or MemTable(root)
+
+def lookup(key: str, prefix_mode: bool, db: bool = False):
+    # Binary search on the sorted key index or the packed corpus when either
+    # is current, else full scan.
+    if db:
+        t = DbTable()
+        try:
+            return t.find(key, prefix_mode)
+        finally:
+            t.close()
+    idx = binidx.load(IDX, IDX_KIND)
+    t = IndexTable(idx) if idx is not None else open_pack()
+    if t is None:
+        return scan_tsv(key, prefix_mode)
+    try:
+        return t.find(key, prefix_mode)
+    finally:
+        t.close()
+
+class FuzzyTable:
+    # Wraps a table: rows of the k nearest keys, each with its distance
+    # appended, closest first.
+    def __init__(self, table, k: int, root: Path = volumes.ROOT):
+        self.table = table
+        self.k = k
+        self.matcher, self.idx = fuzzy.open_index(lambda: MemTable(root).keys, root / fuzzy.IDX.name)
+
+    def find(self, key: str, prefix_mode: bool = False):
+        out = []
+        for cand, dist in self.matcher.search(key, self.k):
+            out.extend(row + [dist] for row in self.table.find(cand, False))
+        return out
+
+    def close(self) -> None:
+        if self.idx is not None:
+            self.idx.close()
+        self.table.close()
+
+class FederatedTable:
+    # The same find() over several volumes (volumes.py): each volume's table
+    # opens on first use, all volumes are searched at once and the rows are
+    # merged by lemma_key (by distance, then key, with fuzzy_k), keeping each
+    # volume's own order among equals. source_column comes back as
+    # "<volume>/<column>".
+    def __init__(self, vols, db: bool = False, fuzzy_k: int = 0):
+        self.fed = volumes.Federation(vols)
+        self.fuzzy_k = fuzzy_k
+        if fuzzy_k:
+            self.open = lambda root: FuzzyTable(open_table(db, root), fuzzy_k, root)
+            self.order = lambda row: (row[5], row[0])
+        else:
+            self.open = lambda root: open_table(db, root)
+            self.order = lambda row: row[0]
+
+    def find(self, key: str, prefix_mode: bool = False):
+        def one(v):
+            rows = v.get("lookup", self.open).find(key, prefix_mode)
+            return sorted((r[:3] + [f"{v.name}/{r[3]}"] + r[4:] for r in rows), key=self.order)
+
+        out = list(merge(*self.fed.map(one), key=self.order))
+        if self.fuzzy_k:
+            # the k nearest keys over all volumes
+            keep = set(list(dict.fromkeys(r[0] for r in out))[:self.fuzzy_k])
+            out = [r for r in out if r[0] in keep]
+        return out
+
+    def close(self) -> None:
+        self.fed.close()
+
+def run_batch(path: str, prefix_mode: bool, jsonl: bool, fuzzy_k: int = 0, db: bool = False, vols=None) -> int:
+    if vols:
+        table = FederatedTable(vols, db, fuzzy_k)
+    else:
+        table = open_table(db)
+        if fuzzy_k:
+            table = FuzzyTable(table, fuzzy_k)
+    n = missed = 0
+    try:
+        for q in cnt_batch.iter_queries(path):
+            n += 1
+            key = norm_key(q)
+            hits = table.find(key, prefix_mode) if key else []
+            if not hits:
+                missed += 1
+            if jsonl:
+                out = []
+                for h in hits:
+                    k, lemma, refs, src, ln = h[:5]
+                    hit = {"lemma_key": k, "lemma": lemma, "refs_raw": refs, "source_column": src, "line_no": int(ln)}
+                    if fuzzy_k:
+                        hit["distance"] = h[5]
+                    out.append(hit)
+                cnt_batch.emit_jsonl({"query": q, "key": key, "hits": out})
+            else:
+                for h in hits:
+                    cnt_batch.emit_tsv([q] + h)
+    finally:
+        table.close()
+    cnt_batch.report(n, missed)
+    return 0
+
 def main() -> int:
-    if len(sys.argv) < 2:
-        print("Usage: ./cnt_lookup.py <lemma or prefix> [--prefix]", file=sys.stderr)
-        return 2
+    batch, args = cnt_batch.batch_args(sys.argv[1:])
+    vols, args = volumes.volume_args(args)
+    prefix_mode = "--prefix" in args
+    jsonl = "--jsonl" in args
+    db = "--db" in args
+    fuzzy_k = 0
+    if "--fuzzy" in args:
+        fuzzy_k = 5
+        if "--k" in args:
+            i = args.index("--k")
+            if i + 1 >= len(args) or not args[i + 1].isdigit() or int(args[i + 1]) < 1:
+                print("--k needs a positive number", file=sys.stderr)
+                return 2
+            fuzzy_k = int(args[i + 1])
+            del args[i:i + 2]
+    args = [a for a in args if a not in ("--prefix", "--jsonl", "--fuzzy", "--db")]
 
-    q = " ".join(a for a in sys.argv[1:] if a != "--prefix")
-    prefix_mode = "--prefix" in sys.argv[1:]
+    if batch is None and not args:
+        print("Usage: ./cnt_lookup.py <lemma or prefix> [--prefix] [--db]", file=sys.stderr)
+        print("   or: ./cnt_lookup.py <lemma> --fuzzy [--k N] [--db]", file=sys.stderr)
+        print("   or: ./cnt_lookup.py --batch [FILE] [--prefix | --fuzzy [--k N]] [--jsonl] [--db]", file=sys.stderr)
+        print("   add --volumes ROOT[,ROOT...] to search several data roots at once", file=sys.stderr)
+        return 2
 
+    q = " ".join(args)
     key = norm_key(q)
-    if not key:
+    if batch is None and not key:
         print("Empty query after normalization.", file=sys.stderr)
         return 2
 
-    if not TSV.exists():
-        print(f"Missing {TSV}. Run tools_add_lemma_key.py first.", file=sys.stderr)
-        return 2
+    for root in ([v.root for v in vols] if vols else [volumes.ROOT]):
+        if not db and not (root / TSV.name).exists():
+            print(f"Missing {root / TSV.name}. Run tools_add_lemma_key.py first.", file=sys.stderr)
+            return 2
 
-    hits = 0
-    with TSV.open("r", encoding="utf-8") as f:
-        header = f.readline()
-        for line in f:
-            parts = line.rstrip("\n").split("\t")
-            if len(parts) < 5:
-                continue
-            lemma_key, lemma, refs, src, ln = parts[0], parts[1], parts[2], parts[3], parts[4]
+    if batch is not None:
+        return run_batch(batch, prefix_mode, jsonl, fuzzy_k, db, vols)
 
-            ok = lemma_key.startswith(key) if prefix_mode else (lemma_key == key)
-            if ok:
-                hits += 1
-                print(f"{lemma}\t{refs}\t({src}:{ln})")
+    if vols:
+        table = FederatedTable(vols, db, fuzzy_k)
+        try:
+            hits = table.find(key, prefix_mode)
+        finally:
+            table.close()
+        for h in hits:
+            print(f"{h[1]}\t{h[2]}\t({h[3]}:{h[4]})" + (f"\t~{h[5]}" if fuzzy_k else ""))
+        if not hits:
+            mode = "fuzzy" if fuzzy_k else "prefix" if prefix_mode else "exact"
+            print(f"No {mode} matches for: {q}  [key={key}]", file=sys.stderr)
+            return 1
+        return 0
+
+    if fuzzy_k:
+        table = FuzzyTable(open_table(db), fuzzy_k)
+        try:
+            hits = table.find(key)
+        finally:
+            table.close()
+        for lemma_key, lemma, refs, src, ln, dist in hits:
+            print(f"{lemma}\t{refs}\t({src}:{ln})\t~{dist}")
+        if not hits:
+            print(f"No fuzzy matches for: {q}  [key={key}]", file=sys.stderr)
+            return 1
+        return 0
+
+    hits = 0
+    for lemma_key, lemma, refs, src, ln in lookup(key, prefix_mode, db):
+        hits += 1
+        print(f"{lemma}\t{refs}\t({src}:{ln})")
 
     if hits == 0:
         mode = "prefix" if prefix_mode else "exact"
@@ -1,10 +1,14 @@
 #!/usr/bin/env python3
-from pathlib import Path
 import csv
 import sys
 
-ROWS = Path("index_rows_id.tsv")
-REFS = Path("index_refs_norm.tsv")
+import cnt_batch
+import cntpack
+import sqlitedb
+import volumes
+
+ROWS = volumes.path("index_rows_id.tsv")
+REFS = volumes.path("index_refs_norm.tsv")
 
 def load_row(cnt_idx: str):
     with ROWS.open("r", encoding="utf-8") as f:
@@ -26,6 +30,69 @@ def load_refs(cnt_idx: str):
     out.sort(key=lambda x: int(x["ref_no"]))
     return out
 
+def load_all():
+    # One pass over each TSV for batch runs: cnt_idx -> row, cnt_idx -> refs.
+    rows = {}
+    with ROWS.open("r", encoding="utf-8") as f:
+        for row in csv.DictReader(f, delimiter="\t"):
+            rows.setdefault(row["cnt_idx"], row)
+    refs = {}
+    with REFS.open("r", encoding="utf-8") as f:
+        for ref in csv.DictReader(f, delimiter="\t"):
+            refs.setdefault(ref["cnt_idx"], []).append(ref)
+    for lst in refs.values():
+        lst.sort(key=lambda x: int(x["ref_no"]))
+    return rows, refs
+
+class DbRefs:
+    # load_row/load_refs against index.sqlite (first row wins, like load_all).
+    def __init__(self):
+        self.conn = sqlitedb.connect()
+
+    def row(self, cnt_idx: str):
+        r = self.conn.execute(f"SELECT {sqlitedb.ROW_COLS} FROM rows WHERE cnt_idx = ? ORDER BY rowid LIMIT 1",
+                              (cnt_idx,)).fetchone()
+        return sqlitedb.as_text(r) if r else None
+
+    def refs(self, cnt_idx: str):
+        cur = self.conn.execute(f"SELECT {sqlitedb.REF_COLS} FROM refs WHERE cnt_idx = ? ORDER BY ref_no, rowid",
+                                (cnt_idx,))
+        return [sqlitedb.as_text(r) for r in cur]
+
+    def close(self) -> None:
+        self.conn.close()
+
+class PackRefs:
+    # load_row/load_refs against the packed corpus (cntpack.py).
+    def __init__(self, corpus):
+        self.corpus = corpus
+        self.last = (None, -1)
+
+    def find(self, cnt_idx: str) -> int:
+        # row() then refs() of the same cnt_idx look it up once
+        if self.last[0] != cnt_idx:
+            self.last = (cnt_idx, self.corpus.find(cnt_idx))
+        return self.last[1]
+
+    def row(self, cnt_idx: str):
+        i = self.find(cnt_idx)
+        return self.corpus.row(i) if i >= 0 else None
+
+    def refs(self, cnt_idx: str):
+        i = self.find(cnt_idx)
+        return [self.corpus.ref(j, i) for j in self.corpus.refs_of(i)] if i >= 0 else []
+
+    def close(self) -> None:
+        self.corpus.close()
+
+def open_refs(db: bool):
+    # DbRefs with db, else PackRefs when index_corpus.idx is current, else
+    # None (read the TSVs)
+    if db:
+        return DbRefs()
+    corpus = cntpack.load()
+    return PackRefs(corpus) if corpus is not None else None
+
 def fmt_ref(r):
     # REF / RANGE_START / SIGLA_ONLY / OTHER
     t = r["ref_type"]
@@ -46,24 +113,68 @@ def fmt_ref(r):
         s = f"{s} {marks}"
     return s.strip()
 
+def run_batch(path: str, jsonl: bool, db: bool = False) -> int:
+    dbr = open_refs(db)
+    if dbr is not None:
+        get_row, get_refs = dbr.row, dbr.refs
+    else:
+        rows, refs_by_idx = load_all()
+        get_row, get_refs = rows.get, lambda q: refs_by_idx.get(q, [])
+    n = missed = 0
+    try:
+        for q in cnt_batch.iter_queries(path):
+            n += 1
+            row = get_row(q)
+            refs = get_refs(q) if row else []
+            if not row:
+                missed += 1
+            if jsonl:
+                cnt_batch.emit_jsonl({"query": q, "row": row, "refs": refs})
+            elif row:
+                for r in refs or [None]:
+                    ref_fields = [r["ref_no"], fmt_ref(r), r["group_no"]] if r else ["", "", ""]
+                    cnt_batch.emit_tsv([q, row["lemma_key"], row["lemma"]] + ref_fields
+                                       + [f"{row['source_column']}:{row['line_no']}"])
+    finally:
+        if dbr is not None:
+            dbr.close()
+    cnt_batch.report(n, missed)
+    return 0
+
 def main() -> int:
-    if len(sys.argv) < 2:
-        print("Usage: ./cnt_refs.py CNT-IDX-0000123", file=sys.stderr)
-        return 2
+    batch, args = cnt_batch.batch_args(sys.argv[1:])
+    jsonl = "--jsonl" in args
+    db = "--db" in args
+    args = [a for a in args if a not in ("--jsonl", "--db")]
 
-    cnt_idx = sys.argv[1].strip()
+    if batch is None and not args:
+        print("Usage: ./cnt_refs.py CNT-IDX-0000123 [--db]", file=sys.stderr)
+        print("   or: ./cnt_refs.py --batch [FILE] [--jsonl] [--db]", file=sys.stderr)
+        return 2
 
-    if not ROWS.exists() or not REFS.exists():
+    if not db and (not ROWS.exists() or not REFS.exists()):
         print("Missing required TSVs. Need index_rows_id.tsv and index_refs_norm.tsv", file=sys.stderr)
         return 2
 
-    row = load_row(cnt_idx)
+    if batch is not None:
+        return run_batch(batch, jsonl, db)
+
+    cnt_idx = args[0].strip()
+
+    dbr = open_refs(db)
+    if dbr is not None:
+        try:
+            row = dbr.row(cnt_idx)
+            refs = dbr.refs(cnt_idx) if row else []
+        finally:
+            dbr.close()
+    else:
+        row = load_row(cnt_idx)
+        refs = load_refs(cnt_idx) if row else []
     if not row:
         print(f"Not found: {cnt_idx}", file=sys.stderr)
         return 1
 
-    refs = load_refs(cnt_idx)
-
     print(f"{cnt_idx}")
     print(f"lemma_key: {row['lemma_key']}")
     print(f"lemma:     {row['lemma']}")
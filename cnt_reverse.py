@@ -1,63 +1,410 @@
 #!/usr/bin/env python3
+from bisect import bisect_left, bisect_right
+from heapq import merge
 from pathlib import Path
 import csv
+import re
 import sys
 
-ROWS = Path("index_rows_id.tsv")
-REFS = Path("index_refs_norm.tsv")
+import binidx
+import cnt_batch
+import cntpack
+import sqlitedb
+import volumes
 
-def load_rows():
+ROWS = volumes.path("index_rows_id.tsv")
+REFS = volumes.path("index_refs_norm.tsv")
+IDX = volumes.path("index_refs_norm.idx")
+IDX_KIND = "refs-inverted-v1"
+
+REF_TYPES = ["REF", "RANGE_START", "SIGLA_ONLY", "OTHER"]
+
+RE_PAIR = re.compile(r"^(\d+),(\d+)$")
+RE_BARE = re.compile(r"^(\d+)$")
+RE_TAB = re.compile(r"^(\d+),\*$")
+RE_SPAN = re.compile(r"^(\d+),(\d+)\s*[-–]\s*(?:(\d+),)?(\d+)$")
+
+# (tab, entry) packed into one sortable int; a bare "121" sorts before 121,0
+ENT_MASK = 0xFFFFFFFF
+
+def pack(tab: int, ent=None) -> int:
+    return (tab << 32) | (0 if ent is None else ent + 1)
+
+def unpack(k: int) -> str:
+    # ref_norm text of a packed key
+    tab, ent = k >> 32, k & ENT_MASK
+    return f"{tab},{ent - 1}" if ent else f"{tab}"
+
+def ref_key(ref_norm: str):
+    m = RE_PAIR.match(ref_norm)
+    if m:
+        tab, ent = int(m.group(1)), int(m.group(2))
+        return pack(tab, ent) if tab < ENT_MASK and ent < ENT_MASK - 1 else None
+    m = RE_BARE.match(ref_norm)
+    if m and int(m.group(1)) < ENT_MASK:
+        return pack(int(m.group(1)))
+    return None
+
+def key_span(target: str):
+    # Inclusive packed-key range for numeric queries, None for plain strings.
+    #   121,98   121   121,*   121,90-121,110   121,90-110
+    k = ref_key(target)
+    if k is not None:
+        return k, k
+    m = RE_TAB.match(target)
+    if m:
+        tab = int(m.group(1))
+        return pack(tab), (tab << 32) | ENT_MASK
+    m = RE_SPAN.match(target)
+    if m:
+        t1, e1 = int(m.group(1)), int(m.group(2))
+        t2 = int(m.group(3)) if m.group(3) else t1
+        lo, hi = pack(t1, e1), pack(t2, int(m.group(4)))
+        return min(lo, hi), max(lo, hi)
+    return None
+
+def matches(ref, target: str, span) -> bool:
+    if span is None:
+        return ref["ref_norm"] == target
+    k = ref_key(ref["ref_norm"])
+    return k is not None and span[0] <= k <= span[1]
+
+def load_rows(path: Path = ROWS):
     m = {}
-    with ROWS.open("r", encoding="utf-8") as f:
+    with path.open("r", encoding="utf-8") as f:
         r = csv.DictReader(f, delimiter="\t")
         for row in r:
             m[row["cnt_idx"]] = row
     return m
 
-def main() -> int:
-    if len(sys.argv) < 2:
-        print("Usage: ./cnt_reverse.py 121,98", file=sys.stderr)
-        print("   or: ./cnt_reverse.py 121,98 --all (include OTHER/SIGLA_ONLY)", file=sys.stderr)
-        return 2
+def keep_ref(ref, include_all: bool) -> bool:
+    if ref["ref_type"] in ["SIGLA_ONLY", "OTHER"] and not include_all:
+        return False
+    return True
 
-    target = sys.argv[1].strip()
-    include_all = "--all" in sys.argv[2:]
+def make_hit(rows, ref):
+    cnt_idx = ref["cnt_idx"]
+    row = rows.get(cnt_idx)
+    lemma = row["lemma"] if row else "<?>"
+    lemma_key = row["lemma_key"] if row else "<?>"
+    return (lemma_key, lemma, cnt_idx, ref)
 
-    if not ROWS.exists() or not REFS.exists():
-        print("Missing required TSVs. Need index_rows_id.tsv and index_refs_norm.tsv", file=sys.stderr)
-        return 2
+def hit_order(hit):
+    return (hit[0], hit[2], int(hit[3]["ref_no"]))
 
-    rows = load_rows()
+def sort_hits(hits):
+    hits.sort(key=hit_order)
+    return hits
+
+def fmt_hit(hit) -> str:
+    lemma_key, lemma, cnt_idx, ref = hit
+    sig = (ref.get("sigla_prefix") or "").strip()
+    marks = (ref.get("marks") or "").strip()
+    extra = ""
+    if sig: extra += f" sigla={sig}"
+    if marks: extra += f" marks={marks}"
+    return f"{lemma_key}\t{lemma}\t{cnt_idx}\t({ref['source_column']}:{ref['line_no']} g{ref['group_no']} r{ref['ref_no']}){extra}"
 
+def scan(target: str, include_all: bool):
+    rows = load_rows()
+    span = key_span(target)
     hits = []
     with REFS.open("r", encoding="utf-8") as f:
         r = csv.DictReader(f, delimiter="\t")
         for ref in r:
-            if (ref["ref_type"] in ["SIGLA_ONLY"] and not include_all):
+            if not keep_ref(ref, include_all):
+                continue
+            if matches(ref, target, span):
+                hits.append(make_hit(rows, ref))
+    return sort_hits(hits)
+
+class IndexRefs:
+    # Posting-list lookups on index_refs_norm.idx; numeric queries only.
+    def __init__(self, idx, root: Path = volumes.ROOT):
+        self.idx = idx
+        self.rows_f = (root / ROWS.name).open("rb")
+        self.row_cache = {}
+
+    def row(self, c: int):
+        row = self.row_cache.get(c)
+        if row is None:
+            off = self.idx["cnt_row_off"][c]
+            if off == (1 << 64) - 1:
+                row = (binidx.heap_get(self.idx["cnt_off"], self.idx["cnt_heap"], c).decode("utf-8"), "<?>", "<?>")
+            else:
+                self.rows_f.seek(off)
+                parts = self.rows_f.readline().decode("utf-8").rstrip("\n").split("\t")
+                row = (parts[0], parts[1], parts[2])
+            self.row_cache[c] = row
+        return row
+
+    def find(self, span, include_all: bool):
+        ix = self.idx
+        keys, post_off = ix["keys"], ix["post_off"]
+        i = bisect_left(keys, span[0])
+        j = bisect_right(keys, span[1], i)
+        hits = []
+        for p in range(post_off[i], post_off[j]):
+            flags = ix["post_flags"][p]
+            ref_type = REF_TYPES[flags & 0x0F]
+            if ref_type in ["SIGLA_ONLY", "OTHER"] and not include_all:
                 continue
-            if (ref["ref_type"] == "OTHER" and not include_all):
+            cnt_idx, lemma_key, lemma = self.row(ix["post_cnt"][p])
+            ref_norm, sigla, marks, src = binidx.heap_get(ix["text_off"], ix["text_heap"], p).decode("utf-8").split("\x1f")
+            ref = {
+                "cnt_idx": cnt_idx,
+                "ref_no": str(ix["post_ref_no"][p]),
+                "ref_norm": ref_norm,
+                "ref_type": ref_type,
+                "sigla_prefix": sigla,
+                "marks": marks,
+                "attach_prev": str(flags >> 4),
+                "source_column": src,
+                "line_no": str(ix["post_line_no"][p]),
+                "group_no": str(ix["post_group_no"][p]),
+            }
+            hits.append((lemma_key, lemma, cnt_idx, ref))
+        return sort_hits(hits)
+
+    def close(self) -> None:
+        self.rows_f.close()
+        self.idx.close()
+
+class MemRefs:
+    # index_refs_norm.tsv loaded once: ref_norm dict plus sorted numeric keys.
+    def __init__(self, include_all: bool, root: Path = volumes.ROOT):
+        self.rows = load_rows(root / ROWS.name)
+        self.by_norm = {}
+        numeric = []
+        with (root / REFS.name).open("r", encoding="utf-8") as f:
+            for ref in csv.DictReader(f, delimiter="\t"):
+                if not keep_ref(ref, include_all):
+                    continue
+                self.by_norm.setdefault(ref["ref_norm"], []).append(ref)
+                k = ref_key(ref["ref_norm"])
+                if k is not None:
+                    numeric.append((k, len(numeric), ref))
+        numeric.sort(key=lambda x: (x[0], x[1]))
+        self.keys = [x[0] for x in numeric]
+        self.numeric = [x[2] for x in numeric]
+
+    def find(self, target: str):
+        span = key_span(target)
+        if span is None:
+            refs = self.by_norm.get(target, [])
+        else:
+            refs = self.numeric[bisect_left(self.keys, span[0]):bisect_right(self.keys, span[1])]
+        return sort_hits([make_hit(self.rows, ref) for ref in refs])
+
+class PackRefs:
+    # Every query kind on the packed corpus (cntpack.py): numeric ones through
+    # its ref_order, the rest on the refs whose ref_norm is stored as text,
+    # grouped by it on first use.
+    def __init__(self, corpus, include_all: bool):
+        self.corpus = corpus
+        self.include_all = include_all
+        self.by_norm = None
+
+    def find(self, target: str):
+        c = self.corpus
+        span = key_span(target)
+        if span is not None:
+            found = c.key_refs(*span)
+        else:
+            if self.by_norm is None:
+                self.by_norm = {}
+                off = c.ref_text_off
+                for j in range(c.n_refs):
+                    if off[j] != off[j + 1] or c.ref_key[j] == cntpack.NO_KEY:
+                        self.by_norm.setdefault(c.ref_norm(j), []).append(j)
+            found = self.by_norm.get(target, [])
+        hits = []
+        for j in found:
+            if c.ref_type(j) in ["SIGLA_ONLY", "OTHER"] and not self.include_all:
                 continue
-            if ref["ref_norm"] == target:
-                cnt_idx = ref["cnt_idx"]
-                row = rows.get(cnt_idx)
-                lemma = row["lemma"] if row else "<?>"
-                lemma_key = row["lemma_key"] if row else "<?>"
-                hits.append((lemma_key, lemma, cnt_idx, ref))
+            i = c.ref_row(j)
+            hits.append((c.lemma_key(i), c.lemma(i), c.cnt_idx(i), c.ref(j, i)))
+        return sort_hits(hits)
+
+    def close(self) -> None:
+        self.corpus.close()
+
+class DbRefs:
+    # Lookups on index.sqlite: the (tab, entry) index for numeric queries,
+    # ref_norm for the rest.
+    def __init__(self, root: Path = volumes.ROOT):
+        self.conn = sqlitedb.connect(root / sqlitedb.DB.name)
+
+    def find(self, target: str, include_all: bool):
+        span = key_span(target)
+        if span is None:
+            cur = self.conn.execute(f"SELECT {sqlitedb.REF_COLS} FROM refs WHERE ref_norm = ? ORDER BY rowid",
+                                    (target,))
+            refs = [sqlitedb.as_text(r) for r in cur]
+        else:
+            cur = self.conn.execute(f"SELECT {sqlitedb.REF_COLS}, tab, entry FROM refs"
+                                    " WHERE tab BETWEEN ? AND ? ORDER BY rowid", (span[0] >> 32, span[1] >> 32))
+            refs = [sqlitedb.as_text(r) for r in cur
+                    if span[0] <= pack(r["tab"], r["entry"]) <= span[1]]
+            for ref in refs:
+                del ref["tab"], ref["entry"]
+        refs = [ref for ref in refs if keep_ref(ref, include_all)]
+
+        # cnt_idx -> row, last one wins like load_rows
+        rows = {}
+        want = sorted({ref["cnt_idx"] for ref in refs})
+        for i in range(0, len(want), 500):
+            chunk = want[i:i + 500]
+            cur = self.conn.execute(f"SELECT {sqlitedb.ROW_COLS} FROM rows WHERE cnt_idx IN"
+                                    f" ({','.join('?' * len(chunk))}) ORDER BY rowid", chunk)
+            for r in cur:
+                rows[r["cnt_idx"]] = sqlitedb.as_text(r)
+        return sort_hits([make_hit(rows, ref) for ref in refs])
+
+    def close(self) -> None:
+        self.conn.close()
+
+class VolumeRefs:
+    # Every query kind on one data root: index.sqlite with db, else the
+    # inverted index for numeric queries when it is current and, for the
+    # rest, the packed corpus when it is current or the TSVs, either opened
+    # on first use.
+    def __init__(self, include_all: bool, db: bool = False, root: Path = volumes.ROOT):
+        self.include_all = include_all
+        self.root = root
+        self.dbr = DbRefs(root) if db else None
+        idx = binidx.load(root / IDX.name, IDX_KIND) if not db else None
+        self.fast = IndexRefs(idx, root) if idx is not None else None
+        self.mem = None
+
+    def find(self, target: str):
+        if self.dbr is not None:
+            return self.dbr.find(target, self.include_all)
+        span = key_span(target)
+        if self.fast is not None and span is not None:
+            return self.fast.find(span, self.include_all)
+        if self.mem is None:
+            corpus = cntpack.load(self.root)
+            self.mem = PackRefs(corpus, self.include_all) if corpus is not None else MemRefs(self.include_all, self.root)
+        return self.mem.find(target)
+
+    def close(self) -> None:
+        if self.dbr is not None:
+            self.dbr.close()
+        if self.fast is not None:
+            self.fast.close()
+        if isinstance(self.mem, PackRefs):
+            self.mem.close()
+
+class FederatedRefs:
+    # VolumeRefs over several volumes (volumes.py), each opened on first
+    # use and searched at once; hits are merged in sort_hits() order, with
+    # source_column as "<volume>/<column>".
+    def __init__(self, vols, include_all: bool, db: bool = False):
+        self.fed = volumes.Federation(vols)
+        self.open = lambda root: VolumeRefs(include_all, db, root)
+
+    def find(self, target: str):
+        def one(v):
+            return [(k, lemma, cnt_idx, dict(ref, source_column=f"{v.name}/{ref['source_column']}"))
+                    for k, lemma, cnt_idx, ref in v.get("reverse", self.open).find(target)]
+
+        return list(merge(*self.fed.map(one), key=hit_order))
+
+    def close(self) -> None:
+        self.fed.close()
+
+def run_batch(path: str, include_all: bool, jsonl: bool, db: bool = False, vols=None) -> int:
+    refs = FederatedRefs(vols, include_all, db) if vols else VolumeRefs(include_all, db)
+    n = missed = 0
+    try:
+        for q in cnt_batch.iter_queries(path):
+            n += 1
+            hits = refs.find(q)
+            if not hits:
+                missed += 1
+            emit_hits(q, hits, jsonl)
+    finally:
+        refs.close()
+    cnt_batch.report(n, missed)
+    return 0
+
+def emit_hits(q: str, hits, jsonl: bool) -> None:
+    if jsonl:
+        cnt_batch.emit_jsonl({
+            "query": q,
+            "hits": [dict(ref, lemma_key=k, lemma=lemma) for k, lemma, _, ref in hits],
+        })
+    else:
+        for h in hits:
+            cnt_batch.emit_tsv([q, fmt_hit(h)])
+
+def main() -> int:
+    batch, args = cnt_batch.batch_args(sys.argv[1:])
+    vols, args = volumes.volume_args(args)
+    include_all = "--all" in args
+    jsonl = "--jsonl" in args
+    db = "--db" in args
+    args = [a for a in args if a not in ("--all", "--jsonl", "--db")]
+
+    if batch is None and not args:
+        print("Usage: ./cnt_reverse.py 121,98", file=sys.stderr)
+        print("   or: ./cnt_reverse.py 121,98 --all (include OTHER/SIGLA_ONLY)", file=sys.stderr)
+        print("   or: ./cnt_reverse.py 121,*            (every entry in tab 121)", file=sys.stderr)
+        print("   or: ./cnt_reverse.py 121,90-121,110   (numeric range)", file=sys.stderr)
+        print("   or: ./cnt_reverse.py --batch [FILE] [--all] [--jsonl]", file=sys.stderr)
+        print("   add --db to query index.sqlite instead of the TSVs", file=sys.stderr)
+        print("   add --volumes ROOT[,ROOT...] to search several data roots at once", file=sys.stderr)
+        return 2
+
+    for root in ([v.root for v in vols] if vols else [volumes.ROOT]):
+        if not db and (not (root / ROWS.name).exists() or not (root / REFS.name).exists()):
+            print(f"Missing required TSVs in {root}. Need index_rows_id.tsv and index_refs_norm.tsv", file=sys.stderr)
+            return 2
+
+    if batch is not None:
+        return run_batch(batch, include_all, jsonl, db, vols)
+
+    target = args[0].strip()
+    span = key_span(target)
 
-    hits.sort(key=lambda x: (x[0], x[2], int(x[3]["ref_no"])))
+    idx = binidx.load(IDX, IDX_KIND) if span is not None and not db and not vols else None
+    if vols:
+        refs = FederatedRefs(vols, include_all, db)
+        try:
+            hits = refs.find(target)
+        finally:
+            refs.close()
+    elif db:
+        dbr = DbRefs()
+        try:
+            hits = dbr.find(target, include_all)
+        finally:
+            dbr.close()
+    elif idx is not None:
+        fast = IndexRefs(idx)
+        try:
+            hits = fast.find(span, include_all)
+        finally:
+            fast.close()
+    else:
+        corpus = cntpack.load()
+        if corpus is None:
+            hits = scan(target, include_all)
+        else:
+            packed = PackRefs(corpus, include_all)
+            try:
+                hits = packed.find(target)
+            finally:
+                packed.close()
 
     if not hits:
         print(f"No hits for ref_norm={target}", file=sys.stderr)
         return 1
 
     print(f"ref_norm={target}  hits={len(hits)}")
-    for lemma_key, lemma, cnt_idx, ref in hits:
-        sig = (ref.get("sigla_prefix") or "").strip()
-        marks = (ref.get("marks") or "").strip()
-        extra = ""
-        if sig: extra += f" sigla={sig}"
-        if marks: extra += f" marks={marks}"
-        print(f"{lemma_key}\t{lemma}\t{cnt_idx}\t({ref['source_column']}:{ref['line_no']} g{ref['group_no']} r{ref['ref_no']}){extra}")
+    for h in hits:
+        print(fmt_hit(h))
 
     return 0
 
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+# Local JSON query server: loads the TSVs once and answers the cnt_*.py
+# queries over HTTP.
+#
+#   ./cnt_server.py [--host 127.0.0.1] [--port 8765] [--poll 2] [--backlog 128]
+#
+#   GET /lookup?q=ab%20angelis[&prefix=1][&limit=N]
+#   GET /refs?cnt_idx=CNT-IDX-0000123
+#   GET /reverse?ref=121,98[&all=1][&limit=N] (also 121,* and 121,90-121,110)
+#   GET /snippet?cnt_idx=CNT-IDX-0000123     (or ?source_column=p010-c03&line_no=30)
+#   GET /health
+#
+# limit is 1..MAX_LIMIT (500, the default); anything else is a 400.
+#
+# /snippet is the PNG of the scanned lines behind a row, cropped from its
+# columns/ image with index_line_geometry.tsv (tools_make_line_geometry.py):
+# the row's first line through its last continuation line. Crops are kept in
+# .snippet_cache/ under the column's columns.sha256 digest, so they outlive
+# restarts and are never served stale; making one needs Pillow.
+#
+# The data is reloaded when index_rows_id.sha256 / index_refs_norm.sha256 /
+# index_line_geometry.sha256 change on disk.
+from bisect import bisect_left, bisect_right
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+import csv
+import io
+import json
+import os
+import sys
+import threading
+import time
+
+import volumes
+from cnt_batch import arg
+from manifests import read_manifest
+from cnt_lookup import key_bound, norm_key
+from cnt_refs import fmt_ref
+from cnt_reverse import key_span, keep_ref, ref_key, sort_hits
+
+ROWS = volumes.path("index_rows_id.tsv")
+REFS = volumes.path("index_refs_norm.tsv")
+GEOMETRY = volumes.path("index_line_geometry.tsv")
+COLS_DIR = volumes.path("columns")
+COLS_MANIFEST = volumes.path("columns.sha256")
+SNIPPET_DIR = volumes.path(".snippet_cache")
+MANIFESTS = [volumes.path("index_rows_id.sha256"), volumes.path("index_refs_norm.sha256"),
+             volumes.path("index_line_geometry.sha256")]
+
+SNIPPET_PAD = 6        # pixels above and below the lines
+SNIPPET_MAX_LINES = 4  # a row's continuation lines shown, at most
+MAX_LIMIT = 500        # hits per /lookup or /reverse answer, at most
+
+def read_manifests():
+    out = {}
+    for p in MANIFESTS:
+        try:
+            out[str(p)] = p.read_text(encoding="utf-8")
+        except OSError:
+            out[str(p)] = None
+    return out
+
+class Corpus:
+    def __init__(self):
+        self.manifests = read_manifests()
+        self.loaded_at = time.time()
+
+        self.rows = []
+        self.by_cnt = {}
+        self.row_no = {}
+        with ROWS.open("r", encoding="utf-8") as f:
+            for row in csv.DictReader(f, delimiter="\t"):
+                row["line_no"] = int(row["line_no"])
+                self.row_no[row["cnt_idx"]] = len(self.rows)
+                self.rows.append(row)
+                self.by_cnt[row["cnt_idx"]] = row
+
+        # source_column -> ([line_no], [y0], [y1]), by line_no
+        self.geometry = {}
+        if GEOMETRY.exists():
+            with GEOMETRY.open("r", encoding="utf-8") as f:
+                for g in csv.DictReader(f, delimiter="\t"):
+                    lns, y0s, y1s = self.geometry.setdefault(g["source_column"], ([], [], []))
+                    lns.append(int(g["line_no"]))
+                    y0s.append(int(g["y0"]))
+                    y1s.append(int(g["y1"]))
+        self.column_sha = {Path(name).stem: digest for name, digest in read_manifest(COLS_MANIFEST).items()}
+
+        order = sorted(range(len(self.rows)), key=lambda i: (self.rows[i]["lemma_key"], i))
+        self.key_order = order
+        self.keys = [self.rows[i]["lemma_key"] for i in order]
+
+        self.refs_by_cnt = {}
+        self.refs_by_norm = {}
+        numeric = []
+        n = 0
+        with REFS.open("r", encoding="utf-8") as f:
+            for ref in csv.DictReader(f, delimiter="\t"):
+                n += 1
+                self.refs_by_cnt.setdefault(ref["cnt_idx"], []).append(ref)
+                self.refs_by_norm.setdefault(ref["ref_norm"], []).append(ref)
+                k = ref_key(ref["ref_norm"])
+                if k is not None:
+                    numeric.append((k, len(numeric), ref))
+        for lst in self.refs_by_cnt.values():
+            lst.sort(key=lambda x: int(x["ref_no"]))
+        numeric.sort(key=lambda x: (x[0], x[1]))
+        self.num_keys = [x[0] for x in numeric]
+        self.num_refs = [x[2] for x in numeric]
+        self.n_refs = n
+
+    def lookup(self, q: str, prefix_mode: bool, limit: int):
+        key = norm_key(q)
+        hits = []
+        if key:
+            lo = bisect_left(self.keys, key)
+            hi = bisect_left(self.keys, key_bound(key, prefix_mode), lo)
+            hits = sorted(self.key_order[lo:hi])
+        return {"query": q, "key": key, "total": len(hits), "hits": [self.rows[i] for i in hits[:limit]]}
+
+    def refs(self, cnt_idx: str):
+        row = self.by_cnt.get(cnt_idx)
+        if row is None:
+            return None
+        refs = [dict(r, text=fmt_ref(r)) for r in self.refs_by_cnt.get(cnt_idx, [])]
+        return {"cnt_idx": cnt_idx, "row": row, "refs": refs}
+
+    def row_lines(self, cnt_idx: str):
+        # (source_column, first line_no, last line_no) of a row: its own line
+        # up to the line before the next row of the same column
+        i = self.row_no.get(cnt_idx)
+        if i is None:
+            return None
+        row = self.rows[i]
+        src, first = row["source_column"], row["line_no"]
+        last = first + SNIPPET_MAX_LINES - 1
+        if i + 1 < len(self.rows) and self.rows[i + 1]["source_column"] == src:
+            last = min(last, max(first, self.rows[i + 1]["line_no"] - 1))
+        else:
+            lns = self.geometry.get(src, ([],))[0]
+            last = min(last, max(first, lns[-1] if lns else first))
+        return src, first, last
+
+    def line_box(self, src: str, first: int, last: int):
+        # (y0, y1) covering lines first..last of src. Lines the geometry
+        # could not place fall back to the gap between their placed
+        # neighbours. None when the column has no geometry.
+        geo = self.geometry.get(src)
+        if geo is None:
+            return None
+        lns, y0s, y1s = geo
+        lo, hi = bisect_left(lns, first), bisect_right(lns, last)
+        if lo < hi:
+            return min(y0s[lo:hi]), max(y1s[lo:hi])
+        y0 = y1s[lo - 1] if lo > 0 else 0
+        y1 = y0s[hi] if hi < len(lns) else y1s[-1]
+        return (y0, y1) if y1 > y0 else None
+
+    def reverse(self, target: str, include_all: bool, limit: int):
+        span = key_span(target)
+        if span is None:
+            refs = self.refs_by_norm.get(target, [])
+        else:
+            refs = self.num_refs[bisect_left(self.num_keys, span[0]):bisect_right(self.num_keys, span[1])]
+        hits = []
+        for ref in refs:
+            if not keep_ref(ref, include_all):
+                continue
+            row = self.by_cnt.get(ref["cnt_idx"])
+            hits.append((row["lemma_key"] if row else "<?>", row["lemma"] if row else "<?>", ref["cnt_idx"], ref))
+        sort_hits(hits)
+        return {
+            "query": target,
+            "total": len(hits),
+            "hits": [dict(ref, lemma_key=k, lemma=lemma) for k, lemma, _, ref in hits[:limit]],
+        }
+
+def snippet_png(src: str, digest: str, y0: int, y1: int) -> bytes:
+    # The crop of columns/<src>.png, from .snippet_cache/ when it is there
+    cached = SNIPPET_DIR / f"{src}-{digest[:16]}-{y0}-{y1}.png"
+    try:
+        return cached.read_bytes()
+    except OSError:
+        pass
+    from PIL import Image
+    with Image.open(COLS_DIR / f"{src}.png") as im:
+        crop = im.crop((0, max(0, y0 - SNIPPET_PAD), im.width, min(im.height, y1 + SNIPPET_PAD)))
+    buf = io.BytesIO()
+    crop.save(buf, format="PNG", optimize=True)
+    body = buf.getvalue()
+    SNIPPET_DIR.mkdir(exist_ok=True)
+    tmp = cached.with_suffix(f".{threading.get_ident()}.tmp")
+    tmp.write_bytes(body)
+    os.replace(tmp, cached)
+    return body
+
+class State:
+    def __init__(self):
+        self.corpus = Corpus()
+
+    def maybe_reload(self) -> bool:
+        if read_manifests() == self.corpus.manifests:
+            return False
+        # build the new corpus aside; requests keep using the old one until
+        # the reference is swapped
+        fresh = Corpus()
+        self.corpus = fresh
+        print(f"reloaded: {len(fresh.rows)} rows, {fresh.n_refs} refs", file=sys.stderr)
+        return True
+
+def watch(state: State, interval: float) -> None:
+    while True:
+        time.sleep(interval)
+        try:
+            state.maybe_reload()
+        except Exception as e:  # keep serving the old data
+            print(f"reload failed: {e}", file=sys.stderr)
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    state = None
+    quiet = True
+
+    def send_json(self, code: int, obj) -> None:
+        body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_png(self, body: bytes) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "max-age=86400")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def snippet(self, corpus, qs):
+        if qs.get("cnt_idx"):
+            span = corpus.row_lines(qs["cnt_idx"].strip())
+            if span is None:
+                return self.send_json(404, {"error": f"not found: {qs['cnt_idx']}"})
+        elif qs.get("source_column") and qs.get("line_no", "").isdigit():
+            ln = int(qs["line_no"])
+            span = (qs["source_column"].strip(), ln, ln)
+        else:
+            return self.send_json(400, {"error": "missing cnt_idx (or source_column and line_no)"})
+        src = span[0]
+        digest = corpus.column_sha.get(src)
+        box = corpus.line_box(*span)
+        if digest is None or box is None or not (COLS_DIR / f"{src}.png").exists():
+            return self.send_json(404, {"error": f"no line geometry for {src}:{span[1]}"})
+        try:
+            body = snippet_png(src, digest, *box)
+        except ImportError:
+            return self.send_json(501, {"error": "cropping snippets needs Pillow"})
+        return self.send_png(body)
+
+    def do_GET(self):
+        u = urlparse(self.path)
+        qs = {k: v[-1] for k, v in parse_qs(u.query).items()}
+        corpus = self.state.corpus
+        try:
+            limit = int(qs.get("limit", MAX_LIMIT))
+        except ValueError:
+            limit = 0
+        if not 1 <= limit <= MAX_LIMIT:
+            return self.send_json(400, {"error": f"bad limit: must be 1..{MAX_LIMIT}"})
+        flag = lambda k: qs.get(k, "") in ("1", "true", "yes")
+
+        if u.path == "/lookup":
+            if not qs.get("q"):
+                return self.send_json(400, {"error": "missing q"})
+            return self.send_json(200, corpus.lookup(qs["q"], flag("prefix"), limit))
+        if u.path == "/refs":
+            if not qs.get("cnt_idx"):
+                return self.send_json(400, {"error": "missing cnt_idx"})
+            out = corpus.refs(qs["cnt_idx"].strip())
+            if out is None:
+                return self.send_json(404, {"error": f"not found: {qs['cnt_idx']}"})
+            return self.send_json(200, out)
+        if u.path == "/reverse":
+            if not qs.get("ref"):
+                return self.send_json(400, {"error": "missing ref"})
+            return self.send_json(200, corpus.reverse(qs["ref"].strip(), flag("all"), limit))
+        if u.path == "/snippet":
+            return self.snippet(corpus, qs)
+        if u.path == "/health":
+            return self.send_json(200, {
+                "rows": len(corpus.rows),
+                "refs": corpus.n_refs,
+                "geometry_columns": len(corpus.geometry),
+                "loaded_at": corpus.loaded_at,
+            })
+        return self.send_json(404, {"error": f"unknown endpoint: {u.path}"})
+
+    def log_message(self, fmt, *args):
+        if not self.quiet:
+            super().log_message(fmt, *args)
+
+class Server(ThreadingHTTPServer):
+    # socketserver listens with a backlog of 5, which a burst of concurrent
+    # clients overflows into SYN retransmits (~1 s each)
+    daemon_threads = True
+    request_queue_size = 128
+
+def main() -> int:
+    argv = sys.argv[1:]
+    host = arg(argv, "--host", "127.0.0.1")
+    port = int(arg(argv, "--port", "8765"))
+    poll = float(arg(argv, "--poll", "2"))
+
+    if not ROWS.exists() or not REFS.exists():
+        print("Missing required TSVs. Need index_rows_id.tsv and index_refs_norm.tsv", file=sys.stderr)
+        return 2
+
+    Handler.state = State()
+    Handler.quiet = "--verbose" not in argv
+    threading.Thread(target=watch, args=(Handler.state, poll), daemon=True).start()
+
+    Server.request_queue_size = int(arg(argv, "--backlog", str(Server.request_queue_size)))
+    httpd = Server((host, port), Handler)
+    c = Handler.state.corpus
+    print(f"OK: serving {len(c.rows)} rows / {c.n_refs} refs on http://{host}:{port}/", file=sys.stderr)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
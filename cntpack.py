@@ -0,0 +1,181 @@
+# Reader for the packed corpus, index_corpus.idx (tools_pack_corpus.py).
+#
+# One binidx file holding index_rows_id.tsv and index_refs_norm.tsv:
+#   rows  row_cnt (the number of CNT-IDX-..., prefix and width in the meta),
+#         row_col (index into the col_* dictionary of source_column values),
+#         row_line, lemma_* / key_* / raw_* string heaps, row_ref_off (the
+#         row's refs are ref positions row_ref_off[i] .. row_ref_off[i + 1])
+#         and key_order (rows in (lemma_key, row) order, for key lookups)
+#   refs  ref_key (cnt_reverse.ref_key() of ref_norm, NO_KEY when it has
+#         none), ref_text_* (ref_norm where unpack(ref_key) does not spell
+#         it, empty for the rest), ref_no, ref_group, ref_flags (REF_TYPES
+#         index | attach_prev << 4), ref_sigla / ref_marks (indexes into
+#         small dictionaries) and ref_order (refs in (ref_key, ref) order,
+#         for numeric lookups)
+# A ref's source_column and line_no are its row's. meta["keyed"] says the
+# rows are also those of index_rows_keyed.tsv as stamped in
+# meta["keyed_source"]; keyed() checks both.
+#
+# Corpus exposes the sections as memoryviews over the mmap, so opening the
+# file decodes nothing and walking a column is plain int indexing; strings
+# are decoded only for the rows and refs that are asked for. row() and ref()
+# give the TSV dicts for callers written against the TSVs.
+from bisect import bisect_left, bisect_right
+from pathlib import Path
+
+import binidx
+import cnt_reverse
+import volumes
+
+PACK = volumes.path("index_corpus.idx")
+PACK_KIND = "corpus-v1"
+
+NO_KEY = (1 << 64) - 1
+
+def strings(idx, name: str):
+    # a small dictionary section, decoded once
+    offs, heap = idx[name + "_off"], idx[name + "_heap"]
+    return [binidx.heap_get(offs, heap, i).decode("utf-8") for i in range(len(offs) - 1)]
+
+class Corpus:
+    def __init__(self, idx):
+        self.idx = idx
+        self.prefix = idx.meta["cnt_prefix"]
+        self.width = idx.meta["cnt_width"]
+        self.row_cnt = idx["row_cnt"]
+        self.row_col = idx["row_col"]
+        self.row_line = idx["row_line"]
+        self.row_ref_off = idx["row_ref_off"]
+        self.key_order = idx["key_order"]
+        self.ref_key = idx["ref_key"]
+        self.ref_order = idx["ref_order"]
+        self.ref_text_off = idx["ref_text_off"]
+        self.ref_no = idx["ref_no"]
+        self.ref_group = idx["ref_group"]
+        self.ref_flags = idx["ref_flags"]
+        self.ref_sigla = idx["ref_sigla"]
+        self.ref_marks = idx["ref_marks"]
+        self.heaps = {name: (idx[name + "_off"], idx[name + "_heap"]) for name in ("lemma", "key", "raw", "ref_text")}
+        self.columns = strings(idx, "col")
+        self.sigla = strings(idx, "sigla")
+        self.marks = strings(idx, "marks")
+        self.n_rows = len(self.row_cnt)
+        self.n_refs = len(self.ref_key)
+
+    def _text(self, name: str, i: int) -> str:
+        offs, heap = self.heaps[name]
+        return str(heap[offs[i]:offs[i + 1]], "utf-8")
+
+    # rows
+
+    def cnt_idx(self, i: int) -> str:
+        return f"{self.prefix}{self.row_cnt[i]:0{self.width}d}"
+
+    def find(self, cnt_idx: str) -> int:
+        # row of cnt_idx, -1 if there is none (row_cnt is ascending)
+        digits = cnt_idx[len(self.prefix):]
+        if not cnt_idx.startswith(self.prefix) or len(digits) != self.width \
+                or not (digits.isascii() and digits.isdigit()):
+            return -1
+        n = int(digits)
+        i = bisect_left(self.row_cnt, n)
+        return i if i < self.n_rows and self.row_cnt[i] == n else -1
+
+    def lemma(self, i: int) -> str:
+        return self._text("lemma", i)
+
+    def lemma_key(self, i: int) -> str:
+        return self._text("key", i)
+
+    def refs_raw(self, i: int) -> str:
+        return self._text("raw", i)
+
+    def source_column(self, i: int) -> str:
+        return self.columns[self.row_col[i]]
+
+    def refs_of(self, i: int) -> range:
+        return range(self.row_ref_off[i], self.row_ref_off[i + 1])
+
+    def row(self, i: int) -> dict:
+        return {
+            "cnt_idx": self.cnt_idx(i),
+            "lemma_key": self.lemma_key(i),
+            "lemma": self.lemma(i),
+            "refs_raw": self.refs_raw(i),
+            "source_column": self.source_column(i),
+            "line_no": str(self.row_line[i]),
+        }
+
+    def key_range(self, key: str, prefix_mode: bool):
+        # key_order positions lo..hi of the rows whose lemma_key is key (or
+        # starts with it)
+        order, (offs, heap) = self.key_order, self.heaps["key"]
+        want = key.encode("utf-8")
+
+        def bound(upper: bool) -> int:
+            lo, hi = 0, len(order)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                i = order[mid]
+                k = heap[offs[i]:offs[i + 1]].tobytes()
+                if upper and prefix_mode:
+                    k = k[:len(want)]
+                if k < want or (upper and k == want):
+                    lo = mid + 1
+                else:
+                    hi = mid
+            return lo
+
+        return bound(False), bound(True)
+
+    # refs
+
+    def ref_row(self, j: int) -> int:
+        return bisect_left(self.row_ref_off, j + 1) - 1
+
+    def ref_norm(self, j: int) -> str:
+        k = self.ref_key[j]
+        if k == NO_KEY or self.ref_text_off[j] != self.ref_text_off[j + 1]:
+            return self._text("ref_text", j)
+        return cnt_reverse.unpack(k)
+
+    def key_refs(self, lo: int, hi: int):
+        # refs whose ref_key is in lo..hi (inclusive), in file order
+        get = self.ref_key.__getitem__
+        a = bisect_left(self.ref_order, lo, key=get)
+        b = bisect_right(self.ref_order, hi, a, key=get)
+        return sorted(self.ref_order[a:b])
+
+    def ref_type(self, j: int) -> str:
+        return cnt_reverse.REF_TYPES[self.ref_flags[j] & 0x0F]
+
+    def ref(self, j: int, i: int = None) -> dict:
+        # ref j as read from index_refs_norm.tsv; i is its row when known
+        if i is None:
+            i = self.ref_row(j)
+        return {
+            "cnt_idx": self.cnt_idx(i),
+            "ref_no": str(self.ref_no[j]),
+            "ref_norm": self.ref_norm(j),
+            "ref_type": self.ref_type(j),
+            "sigla_prefix": self.sigla[self.ref_sigla[j]],
+            "marks": self.marks[self.ref_marks[j]],
+            "attach_prev": str(self.ref_flags[j] >> 4),
+            "source_column": self.source_column(i),
+            "line_no": str(self.row_line[i]),
+            "group_no": str(self.ref_group[j]),
+        }
+
+    def keyed(self) -> bool:
+        # the rows are those of index_rows_keyed.tsv, as it is now
+        stamp = self.idx.meta.get("keyed_source")
+        return bool(self.idx.meta.get("keyed") and stamp
+                    and binidx.sources_fresh(stamp, self.idx.path.parent))
+
+    def close(self) -> None:
+        self.idx.close()
+
+def load(root: Path = volumes.ROOT):
+    # Corpus over root's index_corpus.idx, None when it is missing or stale
+    idx = binidx.load(Path(root) / PACK.name, PACK_KIND)
+    return Corpus(idx) if idx is not None else None
@@ -0,0 +1,282 @@
+# OCR-tolerant lemma_key matching for cnt_lookup.py --fuzzy.
+#
+# Candidates come from a symmetric-deletion dictionary over the distinct
+# lemma_keys: every string reachable by deleting up to MAX_DIST characters
+# from a key points back to it, so a query only has to look up its own
+# deletions. The query is also tried with known OCR confusions undone
+# (rn<->m, li<->h, ...), and the candidates are re-ranked with a weighted
+# distance where those confusions are cheap. tools_make_fuzzy_index.py
+# stores the dictionary and the confusion costs (seeded below, refined from
+# parse_rejects_stitched.tsv) in index_lemma_fuzzy.idx.
+from pathlib import Path
+import math
+import re
+
+import binidx
+import volumes
+
+IDX = volumes.path("index_lemma_fuzzy.idx")
+IDX_KIND = "fuzzy-symdel-v1"
+
+MAX_DIST = 2
+# keys shorter than this only get single deletions
+LONG_KEY = 5
+MAX_VARIANTS = 24
+# cap on candidates verified per query, over all variants
+BUDGET = 4000
+
+# (seen, meant, cost): pairs the OCR is known to mix up. Costs are for
+# either direction; learned ones replace these when lower.
+SEED_CONFUSIONS = [
+    ("rn", "m", 0.3),
+    ("in", "m", 0.4),
+    ("ni", "m", 0.4),
+    ("ri", "n", 0.4),
+    ("li", "h", 0.3),
+    ("ll", "h", 0.5),
+    ("cl", "d", 0.3),
+    ("ii", "u", 0.3),
+    ("ii", "n", 0.4),
+    ("vv", "w", 0.3),
+    ("c", "e", 0.4),
+    ("e", "o", 0.6),
+    ("l", "i", 0.4),
+    ("i", "t", 0.6),
+    ("u", "n", 0.5),
+    ("f", "s", 0.5),
+    ("h", "b", 0.5),
+    ("1", "l", 0.3),
+    ("1", "i", 0.4),
+    ("0", "o", 0.3),
+    ("5", "s", 0.5),
+    ("8", "s", 0.6),
+]
+
+def levenshtein(a: str, b: str) -> int:
+    if len(a) < len(b):
+        a, b = b, a
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        prev = cur
+    return prev[-1]
+
+def confusion_table(pairs) -> dict:
+    # (x, y, cost) -> {x: {y: cost}}, symmetric, cheapest wins
+    table = {}
+    for x, y, cost in pairs:
+        for s, t in ((x, y), (y, x)):
+            d = table.setdefault(s, {})
+            if cost < d.get(t, 9.0):
+                d[t] = cost
+    return table
+
+def weighted_distance(a: str, b: str, table: dict) -> float:
+    # Levenshtein where a confusion x->y (x ending at a[i], y at b[j]) may
+    # replace the chunk at its table cost.
+    n, m = len(a), len(b)
+    maxlen = max((len(x) for x in table), default=1)
+    d = [[0.0] * (m + 1) for _ in range(n + 1)]
+    for i in range(1, n + 1):
+        d[i][0] = float(i)
+    for j in range(1, m + 1):
+        d[0][j] = float(j)
+    for i in range(1, n + 1):
+        for j in range(1, m + 1):
+            best = min(d[i - 1][j] + 1, d[i][j - 1] + 1,
+                       d[i - 1][j - 1] + (0.0 if a[i - 1] == b[j - 1] else 1.0))
+            for k in range(1, min(maxlen, i) + 1):
+                ys = table.get(a[i - k:i])
+                if not ys:
+                    continue
+                for y, cost in ys.items():
+                    if len(y) <= j and b[j - len(y):j] == y:
+                        best = min(best, d[i - k][j - len(y)] + cost)
+            d[i][j] = best
+    return d[n][m]
+
+def variants(q: str, table: dict, limit: int = MAX_VARIANTS):
+    # The query plus rewrites of one or two confusable chunks, cheapest first.
+    singles = []
+    for x, ys in table.items():
+        for m in re.finditer(re.escape(x), q):
+            for y, cost in ys.items():
+                singles.append((cost, m.start(), m.end(), y))
+    singles.sort()
+    out = {q: 0.0}
+    for cost, s, e, y in singles:
+        out.setdefault(q[:s] + y + q[e:], cost)
+    for i, (c1, s1, e1, y1) in enumerate(singles[:limit]):
+        for c2, s2, e2, y2 in singles[i + 1:limit]:
+            if e1 <= s2:
+                v = q[:s1] + y1 + q[e1:s2] + y2 + q[e2:]
+            elif e2 <= s1:
+                v = q[:s2] + y2 + q[e2:s1] + y1 + q[e1:]
+            else:
+                continue
+            out.setdefault(v, c1 + c2)
+    return [v for v, _ in sorted(out.items(), key=lambda x: (x[1], x[0]))][:limit]
+
+def deletions(w: str, n: int):
+    out = {w}
+    frontier = {w}
+    for _ in range(n):
+        frontier = {x[:i] + x[i + 1:] for x in frontier for i in range(len(x))}
+        out |= frontier
+    return out
+
+def key_depth(key: str) -> int:
+    return MAX_DIST if len(key) >= LONG_KEY else 1
+
+def build_deletes(keys):
+    # keys: sorted distinct strings. Returns {deletion: [key ids]}.
+    table = {}
+    for i, k in enumerate(keys):
+        for d in deletions(k, key_depth(k)):
+            table.setdefault(d, []).append(i)
+    return table
+
+class SymDel:
+    # Lookup over the deletion dictionary, mmapped or built in memory.
+    def __init__(self, key_at, lookup, table):
+        self.key_at = key_at
+        self.lookup = lookup
+        self.table = table
+
+    def near(self, q: str, radius: int, budget: list):
+        # keys within plain edit distance `radius` of q
+        out = {}
+        seen = set()
+        for d in sorted(deletions(q, radius), key=len, reverse=True):
+            for i in self.lookup(d):
+                if i in seen:
+                    continue
+                seen.add(i)
+                budget[0] -= 1
+                key = self.key_at(i)
+                dist = levenshtein(q, key)
+                if dist <= radius:
+                    out[key] = dist
+            if budget[0] <= 0:
+                break
+        return out
+
+    def search(self, q: str, k: int = 10, radius: int = MAX_DIST):
+        # top-k (key, weighted distance) pairs, closest first
+        budget = [BUDGET]
+        cands = set()
+        for v in variants(q, self.table):
+            cands.update(self.near(v, radius, budget))
+            if budget[0] <= 0:
+                break
+        scored = [(weighted_distance(q, c, self.table), c) for c in cands]
+        scored.sort()
+        return [(c, round(d, 2)) for d, c in scored[:k]]
+
+def symdel_from_index(idx) -> SymDel:
+    key_off, key_heap = idx["key_off"], idx["key_heap"]
+    del_off, del_heap = idx["del_off"], idx["del_heap"]
+    post_off, post_key = idx["post_off"], idx["post_key"]
+
+    def key_at(i):
+        return bytes(key_heap[key_off[i]:key_off[i + 1]]).decode("utf-8")
+
+    def lookup(d):
+        b = d.encode("utf-8")
+        i = binidx.lower_bound(del_off, del_heap, b)
+        if i < len(del_off) - 1 and binidx.heap_get(del_off, del_heap, i) == b:
+            return post_key[post_off[i]:post_off[i + 1]]
+        return ()
+
+    return SymDel(key_at, lookup, confusion_table(idx.meta["confusions"]))
+
+def symdel_from_keys(keys, pairs=SEED_CONFUSIONS) -> SymDel:
+    keys = sorted(set(keys))
+    dels = build_deletes(keys)
+    return SymDel(keys.__getitem__, lambda d: dels.get(d, ()), confusion_table(pairs))
+
+def edit_chunks(a: str, b: str):
+    # Runs of non-matching positions along one optimal alignment, as
+    # (chunk of a, chunk of b) pairs.
+    n, m = len(a), len(b)
+    d = [[0] * (m + 1) for _ in range(n + 1)]
+    for i in range(n + 1):
+        d[i][0] = i
+    for j in range(m + 1):
+        d[0][j] = j
+    for i in range(1, n + 1):
+        for j in range(1, m + 1):
+            d[i][j] = min(d[i - 1][j] + 1, d[i][j - 1] + 1, d[i - 1][j - 1] + (a[i - 1] != b[j - 1]))
+    chunks, xa, xb = [], "", ""
+    i, j = n, m
+    while i or j:
+        if i and j and a[i - 1] == b[j - 1] and d[i][j] == d[i - 1][j - 1]:
+            if xa or xb:
+                chunks.append((xa, xb))
+                xa = xb = ""
+            i -= 1
+            j -= 1
+        elif i and j and d[i][j] == d[i - 1][j - 1] + 1:
+            xa, xb = a[i - 1] + xa, b[j - 1] + xb
+            i -= 1
+            j -= 1
+        elif i and d[i][j] == d[i - 1][j] + 1:
+            xa = a[i - 1] + xa
+            i -= 1
+        else:
+            xb = b[j - 1] + xb
+            j -= 1
+    if xa or xb:
+        chunks.append((xa, xb))
+    return chunks
+
+def learn_confusions(words, index: SymDel, min_count: int = 2):
+    # Align reject words with their single nearest lemma_key and count the
+    # chunks that differ; frequent chunk pairs get cheaper. Returns
+    # (seen, meant, cost) triples merged over SEED_CONFUSIONS.
+    counts = {}
+    for w in words:
+        near = index.near(w, 1 if len(w) < 7 else 2, [BUDGET])
+        near.pop(w, None)
+        if not near:
+            continue
+        best = min(near.values())
+        hits = [k for k, d in near.items() if d == best]
+        if len(hits) != 1:
+            continue
+        for xa, xb in edit_chunks(w, hits[0]):
+            if xa and xb and len(xa) <= 2 and len(xb) <= 2:
+                counts[(xa, xb)] = counts.get((xa, xb), 0) + 1
+
+    costs = {(x, y): c for x, y, c in SEED_CONFUSIONS}
+    top = max(counts.values(), default=1)
+    for (x, y), n in counts.items():
+        if n < min_count:
+            continue
+        # 0.8 at min_count down to 0.25 for the most frequent pair
+        cost = round(0.8 - 0.55 * math.log(n / min_count + 1) / math.log(top / min_count + 1), 2)
+        key = (x, y) if (x, y) in costs or (y, x) not in costs else (y, x)
+        costs[key] = min(costs.get(key, 1.0), cost)
+    return [[x, y, c] for (x, y), c in sorted(costs.items())]
+
+def reject_words(lines):
+    # lemma-like words from the rejected lines of parse_rejects_stitched.tsv
+    lines = iter(lines)
+    next(lines, None)
+    for line in lines:
+        parts = line.rstrip("\n").split("\t")
+        if len(parts) < 4:
+            continue
+        for w in re.findall(r"[a-z]+", parts[3].lower()):
+            if len(w) >= 5:
+                yield w
+
+def open_index(keys_fn, path: Path = IDX):
+    # (SymDel, open BinIndex or None): the index when current, else a
+    # dictionary built from keys_fn() in memory.
+    idx = binidx.load(path, IDX_KIND)
+    if idx is not None:
+        return symdel_from_index(idx), idx
+    return symdel_from_keys(keys_fn()), None
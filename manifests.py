@@ -0,0 +1,94 @@
+# Read/write the *.sha256 manifests (sha256sum format: "<hex>  <name>").
+#
+# The per-directory manifests list bare file names relative to their
+# directory; the index_*.sha256 ones list paths relative to the repo root.
+from pathlib import Path
+import hashlib
+import os
+
+DIR_MANIFESTS = {
+    "pages.sha256": "pages",
+    "columns.sha256": "columns",
+    "ocr_raw.sha256": "ocr_raw",
+    "ocr_clean.sha256": "ocr_clean",
+}
+
+def file_sha256(p: Path) -> str:
+    h = hashlib.sha256()
+    with p.open("rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def read_hash_cache(path: Path) -> dict:
+    # name -> (size, mtime_ns, sha256), as kept by write_hash_cache()
+    out = {}
+    if not path.exists():
+        return out
+    with path.open("r", encoding="utf-8") as f:
+        for line in f:
+            parts = line.rstrip("\n").split("\t")
+            if len(parts) != 4:
+                continue
+            try:
+                out[parts[0]] = (int(parts[1]), int(parts[2]), parts[3])
+            except ValueError:
+                continue    # a line cut short; its file is just hashed again
+    return out
+
+def write_hash_cache(path: Path, cache: dict) -> None:
+    # through a per-process temporary, so concurrent writers (query processes
+    # opening the same index) each replace the file whole
+    tmp = path.with_name(path.name + f".{os.getpid()}.tmp")
+    try:
+        with tmp.open("w", encoding="utf-8") as g:
+            for name, (size, mtime, digest) in sorted(cache.items()):
+                g.write(f"{name}\t{size}\t{mtime}\t{digest}\n")
+        os.replace(tmp, path)
+    except OSError:
+        tmp.unlink(missing_ok=True)
+        raise
+
+def manifest_base(manifest: Path) -> Path:
+    return manifest.parent / DIR_MANIFESTS.get(manifest.name, ".")
+
+def read_manifest(manifest: Path) -> dict:
+    # name -> hex digest, in file order
+    out = {}
+    if not manifest.exists():
+        return out
+    with manifest.open("r", encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if not line:
+                continue
+            digest, _, name = line.partition("  ")
+            out[name.lstrip("*")] = digest
+    return out
+
+def write_manifest(manifest: Path, entries: dict) -> None:
+    with manifest.open("w", encoding="utf-8") as g:
+        for name, digest in entries.items():
+            g.write(f"{digest}  {name}\n")
+
+def index_manifests(root: Path = Path(".")):
+    # root-relative manifests (index_*.sha256), i.e. not one of DIR_MANIFESTS
+    return [p for p in sorted(root.glob("*.sha256")) if p.name not in DIR_MANIFESTS]
+
+def refresh_manifests(changed, root: Path = Path(".")):
+    # Rehash the entries for the given root-relative paths in every index
+    # manifest that lists them; returns the manifests that were rewritten.
+    changed = {str(Path(p)) for p in changed}
+    rewritten = []
+    for m in index_manifests(root):
+        entries = read_manifest(m)
+        hit = [name for name in entries if str(Path(name)) in changed]
+        if not hit:
+            continue
+        new = dict(entries)
+        for name in hit:
+            new[name] = file_sha256(root / name)
+        if new != entries:
+            write_manifest(m, new)
+            rewritten.append(m)
+    return rewritten
@@ -0,0 +1,52 @@
+# Single-pass scanner for refs_raw strings, shared by tools_tokenize_refs.py
+# (tokens) and tools_normalize_refs.py (token kinds).
+#
+# scan() does what normalize_refs() + split_tokens() + kind() used to do with
+# five str.replace passes, a re.sub and up to four re.match calls per token:
+# one findall over the string, one fullmatch per token.
+import re
+
+# ";" and the marks are tokens of their own; anything else runs up to the
+# next whitespace, ";" or mark
+RE_TOKEN = re.compile(r"[;\^°\*]|[^\s;\^°\*]+")
+
+# first alternative that matches the whole token wins, in the order the
+# old per-kind patterns were tried
+RE_KIND = re.compile(
+    r"(?P<NUMPAIR>\d+,\d+)"      # 121,98
+    r"|(?P<NUM>\d+)"             # 121
+    r"|(?P<MARK>[\^°\*]+)"       # ^  °  **
+    r"|(?P<SIGLA>[A-Za-z]\.?)"   # v.  J  K.
+    r"|(?P<RANGE_START>\d+-)"    # 5-
+)
+
+# kinds written to index_refs.tsv (RANGE_START is only told apart when
+# normalizing)
+TSV_KIND = {"RANGE_START": "OTHER"}
+
+# noise tokens dropped before the trailing-comma strip
+DROP = frozenset([",", ".", ":"])
+
+def kind(tok: str) -> str:
+    m = RE_KIND.fullmatch(tok)
+    return m.lastgroup if m else "OTHER"
+
+def tsv_kind(k: str) -> str:
+    return TSV_KIND.get(k, k)
+
+def scan(refs_raw: str):
+    # [(token, kind)] for one refs_raw string; ";" comes back as SEP
+    out = []
+    for t in RE_TOKEN.findall(refs_raw):
+        if t == ";":
+            out.append((";", "SEP"))
+            continue
+        if t in DROP:
+            continue
+        # strip trailing commas that OCR sometimes leaves dangling
+        t = t.rstrip(",")
+        if not t:
+            continue
+        m = RE_KIND.fullmatch(t)
+        out.append((t, m.lastgroup if m else "OTHER"))
+    return out
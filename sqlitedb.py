@@ -0,0 +1,81 @@
+# index.sqlite: rows, refs and groups from the TSVs in one embedded
+# database (written by tools_make_sqlite.py), for the cnt_*.py --db mode.
+from pathlib import Path
+import json
+import sqlite3
+import sys
+
+import binidx
+import volumes
+
+DB = volumes.path("index.sqlite")
+
+ROWS = volumes.path("index_rows_id.tsv")
+REFS = volumes.path("index_refs_norm.tsv")
+GROUPS = volumes.path("index_refs_grouped.tsv")
+SOURCES = [ROWS, REFS, GROUPS]
+
+SCHEMA = """
+CREATE TABLE meta (name TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE rows (
+    cnt_idx TEXT NOT NULL,
+    lemma_key TEXT NOT NULL,
+    lemma TEXT NOT NULL,
+    refs_raw TEXT NOT NULL,
+    source_column TEXT NOT NULL,
+    line_no INTEGER NOT NULL
+);
+CREATE TABLE refs (
+    cnt_idx TEXT NOT NULL,
+    ref_no INTEGER NOT NULL,
+    ref_norm TEXT NOT NULL,
+    ref_type TEXT NOT NULL,
+    sigla_prefix TEXT NOT NULL,
+    marks TEXT NOT NULL,
+    attach_prev INTEGER NOT NULL,
+    source_column TEXT NOT NULL,
+    line_no INTEGER NOT NULL,
+    group_no INTEGER NOT NULL,
+    tab INTEGER,
+    entry INTEGER
+);
+CREATE TABLE groups (
+    cnt_idx TEXT NOT NULL,
+    group_no INTEGER NOT NULL,
+    group_tokens TEXT NOT NULL,
+    source_column TEXT NOT NULL,
+    line_no INTEGER NOT NULL
+);
+"""
+
+# column lists in TSV header order, so as_text() rows match csv.DictReader's
+ROW_COLS = "cnt_idx, lemma_key, lemma, refs_raw, source_column, line_no"
+REF_COLS = ("cnt_idx, ref_no, ref_norm, ref_type, sigla_prefix, marks, attach_prev,"
+            " source_column, line_no, group_no")
+
+# created after the bulk load
+INDEXES = """
+CREATE INDEX rows_lemma_key ON rows (lemma_key);
+CREATE INDEX rows_cnt_idx ON rows (cnt_idx);
+CREATE INDEX refs_cnt_idx ON refs (cnt_idx, ref_no);
+CREATE INDEX refs_tab_entry ON refs (tab, entry);
+CREATE INDEX refs_ref_norm ON refs (ref_norm);
+CREATE INDEX groups_cnt_idx ON groups (cnt_idx, group_no);
+"""
+
+def connect(path: Path = DB):
+    # Read-only connection with rows as sqlite3.Row; exits when the file is
+    # missing and warns when the TSVs changed since it was built.
+    if not path.exists():
+        raise SystemExit(f"Missing {path}. Run tools_make_sqlite.py first.")
+    # one thread at a time, but not always the opening one (volumes.Federation)
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    row = conn.execute("SELECT value FROM meta WHERE name = 'sources'").fetchone()
+    if row is None or not binidx.sources_fresh(json.loads(row[0]), path.parent):
+        print(f"warning: {path} is older than its TSVs; rerun tools_make_sqlite.py", file=sys.stderr)
+    return conn
+
+def as_text(row) -> dict:
+    # sqlite3.Row -> dict of strings, the shape csv.DictReader gives
+    return {k: "" if row[k] is None else str(row[k]) for k in row.keys()}
@@ -0,0 +1,163 @@
+# Content-addressed cache of the tools_*.py stage outputs.
+#
+# A stage's key is the sha256 of its script and every repo module it has
+# imported, the arguments that change its output, and the sha256 of each of
+# its input files (every file under an input directory). The entry for a key,
+# .build_cache/<stage>/<key>/, holds copies of the outputs under their
+# data-root-relative names, inputs.sha256 and outputs.sha256 (the manifest
+# format of the repo's *.sha256 files) and the stage's "OK: ..." lines.
+#
+# On a hit the outputs are restored from the entry (files that already match
+# are left alone, an output directory is made to hold exactly the entry's
+# files) and the stage's lines are printed again; the stage does not run.
+# Editing tools_normalize_refs.py therefore re-runs normalization and then
+# only the stages whose inputs it actually changed.
+#
+#   --no-cache (or CNT_BUILD_CACHE=0) runs the stage without the cache, as
+#   does a profiled run (--profile, --cprofile or CNT_PROFILE, stageprof.py).
+#   CNT_BUILD_CACHE_DIR moves the cache; CNT_BUILD_CACHE_KEEP (default 4)
+#   entries are kept per stage, least recently used dropped first.
+from pathlib import Path
+import hashlib
+import os
+import shutil
+import sys
+
+import stageprof
+import volumes
+from manifests import file_sha256, read_manifest, write_manifest
+
+DIR = Path(os.environ.get("CNT_BUILD_CACHE_DIR", volumes.path(".build_cache")))
+KEEP = int(os.environ.get("CNT_BUILD_CACHE_KEEP", "4"))
+CODE_DIR = Path(__file__).resolve().parent
+
+INPUTS = "inputs.sha256"
+OUTPUTS = "outputs.sha256"
+MESSAGES = "messages.txt"
+DATA = "data"
+
+def rel(p) -> str:
+    return os.path.relpath(p, volumes.ROOT)
+
+def files_under(p: Path):
+    # p itself, or every file below a directory, sorted
+    if p.is_dir():
+        return sorted(q for q in p.rglob("*") if q.is_file())
+    return [p]
+
+def code_hashes() -> dict:
+    # module name -> sha256 for the running script and every module loaded
+    # from the scripts' directory
+    out = {}
+    for name, mod in list(sys.modules.items()):
+        f = getattr(mod, "__file__", None)
+        if not f or not f.endswith(".py"):
+            continue
+        p = Path(f).resolve()
+        if p.parent == CODE_DIR:
+            out[p.stem if name == "__main__" else name] = file_sha256(p)
+    return dict(sorted(out.items()))
+
+def input_hashes(inputs) -> dict:
+    out = {}
+    for p in inputs:
+        p = Path(p)
+        if not p.exists():
+            out[rel(p)] = "-"
+            continue
+        for q in files_under(p):
+            out[rel(q)] = file_sha256(q)
+    return out
+
+class Entry:
+    def __init__(self, stage: str, inputs, outputs, args=()):
+        self.stage = stage
+        self.outputs = [Path(p) for p in outputs if p is not None]
+        self.inputs = input_hashes(inputs)
+        h = hashlib.sha256()
+        h.update(f"stage {stage}\n".encode("utf-8"))
+        for name, digest in code_hashes().items():
+            h.update(f"code {name} {digest}\n".encode("utf-8"))
+        for a in args:
+            h.update(f"arg {a}\n".encode("utf-8"))
+        for p in self.outputs:
+            h.update(f"out {rel(p)}\n".encode("utf-8"))
+        for name, digest in self.inputs.items():
+            h.update(f"in {name} {digest}\n".encode("utf-8"))
+        self.key = h.hexdigest()
+        self.dir = DIR / stage / self.key
+
+    def hit(self) -> bool:
+        # Restore the outputs and print the stored lines if the entry exists
+        files = read_manifest(self.dir / OUTPUTS)
+        if not files or not (self.dir / MESSAGES).exists():
+            return False
+        data = self.dir / DATA
+        for out in self.outputs:
+            stored = data / rel(out)
+            if stored.is_dir():
+                keep = {rel(q) for q in files_under(stored)}
+                for q in files_under(out) if out.is_dir() else []:
+                    if rel(q) not in keep:
+                        q.unlink()
+        for name, digest in files.items():
+            dst = volumes.ROOT / name
+            if dst.exists() and dst.stat().st_size == (data / name).stat().st_size and file_sha256(dst) == digest:
+                continue
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            tmp = dst.with_name(dst.name + ".tmp")
+            shutil.copy2(data / name, tmp)
+            os.replace(tmp, dst)
+        os.utime(self.dir)
+        print((self.dir / MESSAGES).read_text(encoding="utf-8"), end="")
+        print(f"CACHE: restored {self.stage} outputs from {self.dir}", file=sys.stderr)
+        return True
+
+    def done(self, *lines: str) -> None:
+        # Print the stage's lines and store its outputs under the key
+        for line in lines:
+            print(line)
+        tmp = self.dir.with_name(self.key + f".{os.getpid()}.tmp")
+        if tmp.exists():
+            shutil.rmtree(tmp)
+        files = {}
+        for out in self.outputs:
+            for q in files_under(out) if out.exists() else []:
+                dst = tmp / DATA / rel(q)
+                dst.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copy2(q, dst)
+                files[rel(q)] = file_sha256(dst)
+        tmp.mkdir(parents=True, exist_ok=True)
+        write_manifest(tmp / INPUTS, self.inputs)
+        write_manifest(tmp / OUTPUTS, files)
+        (tmp / MESSAGES).write_text("".join(line + "\n" for line in lines), encoding="utf-8")
+        if self.dir.exists():
+            shutil.rmtree(self.dir)
+        os.replace(tmp, self.dir)
+        prune(self.dir.parent)
+
+class NullEntry:
+    # stands in for Entry when the cache is off
+    def hit(self) -> bool:
+        return False
+
+    def done(self, *lines: str) -> None:
+        for line in lines:
+            print(line)
+
+def prune(stage_dir: Path) -> None:
+    entries = sorted((p for p in stage_dir.iterdir() if p.is_dir() and not p.name.endswith(".tmp")),
+                     key=lambda p: p.stat().st_mtime, reverse=True)
+    for p in entries[KEEP:]:
+        shutil.rmtree(p, ignore_errors=True)
+
+def lookup(stage: str, inputs, outputs, args=(), argv=None):
+    # Entry for this run of a stage, NULL when the cache is off or the run
+    # is profiled
+    argv = sys.argv[1:] if argv is None else argv
+    if "--no-cache" in argv or os.environ.get("CNT_BUILD_CACHE", "1") in ("0", "") \
+            or stageprof.requested(argv):
+        return NULL
+    return Entry(stage, inputs, outputs, args)
+
+NULL = NullEntry()
@@ -0,0 +1,287 @@
+# Opt-in per-stage metrics for the tools_*.py build scripts.
+#
+#   ./tools_<stage>.py ... --profile      (or CNT_PROFILE=1)
+#   ./tools_<stage>.py ... --cprofile     (or CNT_PROFILE=cprofile)
+#
+# Writes profile/<script>.json (CNT_PROFILE_DIR moves it): per stage the wall
+# and CPU seconds, rows in/out, bytes of its declared input and output files,
+# peak RSS and the CNT_PROFILE_TOP (default 10) slowest items, i.e. columns
+# or rows. --cprofile also dumps profile/<stage>.prof for every stage run as
+# a `with` block. Without either, start() returns NULL, whose stages hand
+# their arguments back untouched. A profiled run skips the stage cache
+# (stagecache.lookup() misses), since a restored stage has nothing to time.
+#
+# Stage times are exclusive: time spent pulling items through another
+# stage's items() is charged to that stage, which is how the fused chain in
+# tools_build_all.py gets split by stage.
+from itertools import count
+from pathlib import Path
+import cProfile
+import heapq
+import json
+import os
+import sys
+import time
+
+DIR = Path(os.environ.get("CNT_PROFILE_DIR", "profile"))
+TOP = int(os.environ.get("CNT_PROFILE_TOP", "10"))
+
+_END = object()
+
+def cpu_time() -> float:
+    # includes pool workers once they have been reaped
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+def peak_rss_kb() -> int:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def reset_peak_rss() -> None:
+    # Linux only: "5" drops VmHWM back to the current RSS. Elsewhere a
+    # stage's peak is the process peak so far.
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+def io_counters() -> dict:
+    # bytes that went through read()/write() calls, cache hits included
+    out = {}
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                k, v = line.split(":")
+                if k in ("rchar", "wchar"):
+                    out["read_bytes" if k == "rchar" else "write_bytes"] = int(v)
+    except OSError:
+        pass
+    return out
+
+def size_of(p: Path) -> int:
+    p = Path(p)
+    if p.is_dir():
+        return sum(q.stat().st_size for q in p.rglob("*") if q.is_file())
+    return p.stat().st_size if p.exists() else 0
+
+def tsv_label(*fields):
+    # slowest-item label for a TSV line: the given fields joined with ":"
+    def label(line: str) -> str:
+        parts = line.rstrip("\n").split("\t")
+        return ":".join(parts[i] for i in fields if i < len(parts))
+    return label
+
+class Stage:
+    def __init__(self, prof, name, inputs, outputs):
+        self.prof = prof
+        self.name = name
+        # None entries (outputs a run skips) are ignored
+        self.inputs = [Path(p) for p in inputs if p is not None]
+        self.outputs = [Path(p) for p in outputs if p is not None]
+        self.bytes_in = sum(size_of(p) for p in self.inputs)
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.rows_in = 0
+        self.rows_out = 0
+        self.peak_rss_kb = None
+        self.cprofile = None
+        self.slowest = []  # min-heap of (seconds, seq, item)
+
+    def note(self, item, seconds: float) -> None:
+        entry = (seconds, next(self.prof.seq), str(item))
+        if len(self.slowest) < TOP:
+            heapq.heappush(self.slowest, entry)
+        elif seconds > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, entry)
+
+    def count_in(self, it, header=False):
+        # pass `it` through, counting its items (less a header) as rows_in
+        for x in it:
+            if header:
+                header = False
+            else:
+                self.rows_in += 1
+            yield x
+
+    def items(self, it, key=None, header=False):
+        # Pass `it` through, timing each next() on it. key(item) names the
+        # item for the slowest list (a header item is not listed).
+        prof = self.prof
+        clock, pclock = time.perf_counter, time.process_time
+        it = iter(it)
+        while True:
+            outer_wall, outer_cpu = prof.inner_wall, prof.inner_cpu
+            prof.inner_wall = prof.inner_cpu = 0.0
+            t0, c0 = clock(), pclock()
+            try:
+                x = next(it)
+            except StopIteration:
+                x = _END
+            dt, dc = clock() - t0, pclock() - c0
+            own = dt - prof.inner_wall
+            self.wall += own
+            self.cpu += dc - prof.inner_cpu
+            prof.inner_wall, prof.inner_cpu = outer_wall + dt, outer_cpu + dc
+            if x is _END:
+                return
+            if header:
+                header = False
+            elif key is not None:
+                self.note(key(x), own)
+            yield x
+
+    def __enter__(self):
+        prof = self.prof
+        self._outer = (prof.inner_wall, prof.inner_cpu)
+        prof.inner_wall = prof.inner_cpu = 0.0
+        prof.open_block(self)
+        if prof.cprofile and prof.active_cprofile is None:
+            self.cprofile = prof.active_cprofile = cProfile.Profile()
+            self.cprofile.enable()
+        self._t0, self._c0 = time.perf_counter(), cpu_time()
+        return self
+
+    def __exit__(self, *exc):
+        prof = self.prof
+        dt, dc = time.perf_counter() - self._t0, cpu_time() - self._c0
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            prof.active_cprofile = None
+            DIR.mkdir(parents=True, exist_ok=True)
+            self.cprofile.dump_stats(str(DIR / f"{self.name}.prof"))
+        self.wall += dt - prof.inner_wall
+        self.cpu += dc - prof.inner_cpu
+        prof.inner_wall, prof.inner_cpu = self._outer[0] + dt, self._outer[1] + dc
+        prof.close_block(self)
+        return False
+
+    def report(self) -> dict:
+        return {
+            "name": self.name,
+            "wall_s": round(self.wall, 4),
+            "cpu_s": round(self.cpu, 4),
+            "rows_in": self.rows_in,
+            "rows_out": self.rows_out,
+            "rows_per_s": round(self.rows_out / self.wall, 1) if self.wall > 0 else 0.0,
+            "bytes_in": self.bytes_in,
+            "bytes_out": sum(size_of(p) for p in self.outputs),
+            "peak_rss_kb": self.peak_rss_kb,
+            "slowest": [{"item": item, "seconds": round(s, 6)}
+                        for s, _, item in sorted(self.slowest, reverse=True)],
+            "cprofile": str(DIR / f"{self.name}.prof") if self.cprofile is not None else None,
+        }
+
+class Profile:
+    enabled = True
+
+    def __init__(self, script: str, cprofile: bool):
+        self.script = script
+        self.cprofile = cprofile
+        self.active_cprofile = None
+        self.stages = []
+        self.blocks = []
+        self.seq = count()
+        self.inner_wall = 0.0
+        self.inner_cpu = 0.0
+        self.peak = 0
+        self.started = time.strftime("%Y-%m-%dT%H:%M:%S")
+        self.io0 = io_counters()
+        self.t0, self.c0 = time.perf_counter(), cpu_time()
+
+    def stage(self, name, inputs=(), outputs=()) -> Stage:
+        st = Stage(self, name, inputs, outputs)
+        self.stages.append(st)
+        return st
+
+    def _seen(self, hwm: int) -> None:
+        self.peak = max(self.peak, hwm)
+        for b in self.blocks:
+            b.peak_rss_kb = max(b.peak_rss_kb or 0, hwm)
+
+    def open_block(self, st: Stage) -> None:
+        # the reset below would hide the enclosing blocks' peak so far
+        self._seen(peak_rss_kb())
+        reset_peak_rss()
+        self.blocks.append(st)
+
+    def close_block(self, st: Stage) -> None:
+        self._seen(peak_rss_kb())
+        self.blocks.remove(st)
+
+    def finish(self) -> None:
+        self._seen(peak_rss_kb())
+        io = io_counters()
+        stages = [st.report() for st in self.stages]
+        report = {
+            "script": self.script,
+            "argv": sys.argv[1:],
+            "started": self.started,
+            "wall_s": round(time.perf_counter() - self.t0, 4),
+            "cpu_s": round(cpu_time() - self.c0, 4),
+            "peak_rss_kb": self.peak,
+            "io": {k: v - self.io0.get(k, 0) for k, v in io.items()},
+            "slowest_stages": [s["name"] for s in sorted(stages, key=lambda s: -s["wall_s"])],
+            "stages": stages,
+        }
+        DIR.mkdir(parents=True, exist_ok=True)
+        out = DIR / f"{self.script}.json"
+        out.write_text(json.dumps(report, indent=2, ensure_ascii=False) + "\n", encoding="utf-8")
+        print(f"PROFILE: wrote {out} with {len(stages)} stages", file=sys.stderr)
+
+class NullStage:
+    # stands in for Stage when profiling is off
+    rows_in = rows_out = 0
+
+    def note(self, item, seconds: float) -> None:
+        pass
+
+    def count_in(self, it, header=False):
+        return it
+
+    def items(self, it, key=None, header=False):
+        return it
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+class NullProfile:
+    enabled = False
+
+    def stage(self, name, inputs=(), outputs=()) -> NullStage:
+        return NullStage()
+
+    def finish(self) -> None:
+        pass
+
+NULL = NullProfile()
+
+def requested(argv=None) -> str:
+    # "cprofile" or "report" if --profile/--cprofile or CNT_PROFILE asks for
+    # a profile, else ""
+    argv = sys.argv[1:] if argv is None else argv
+    mode = os.environ.get("CNT_PROFILE", "")
+    if mode in ("", "0"):
+        mode = ""
+    if "--cprofile" in argv:
+        mode = "cprofile"
+    elif "--profile" in argv and not mode:
+        mode = "report"
+    return mode
+
+def start(argv=None, script=None):
+    # Profile for this run if one is requested(), else NULL
+    mode = requested(argv)
+    if not mode:
+        return NULL
+    return Profile(script or Path(sys.argv[0]).stem, mode == "cprofile")
@@ -1,33 +1,53 @@
 #!/usr/bin/env python3
-from pathlib import Path
+import stagecache
+import stageprof
+import volumes
 
-INP = Path("index_rows_keyed.tsv")
-OUT = Path("index_rows_id.tsv")
+INP = volumes.path("index_rows_keyed.tsv")
+OUT = volumes.path("index_rows_id.tsv")
+
+# "CNT-IDX-", or "CNT-IDX-<id>-" in a named volume (see volumes.py)
+PREFIX = volumes.cnt_prefix()
+
+def id_lines(lines, stats):
+    lines = iter(lines)
+    header = next(lines, "").rstrip("\n").split("\t")
+    if header[:5] != ["lemma_key", "lemma", "refs_raw", "source_column", "line_no"]:
+        raise SystemExit("Unexpected header in index_rows_keyed.tsv")
+
+    yield "cnt_idx\tlemma_key\tlemma\trefs_raw\tsource_column\tline_no\n"
+
+    n = 0
+    for line in lines:
+        line = line.rstrip("\n")
+        if not line:
+            continue
+        parts = line.split("\t")
+        if len(parts) < 5:
+            continue
+        n += 1
+        stats["rows"] = n
+        cnt_idx = f"{PREFIX}{n:07d}"
+        yield cnt_idx + "\t" + "\t".join(parts[:5]) + "\n"
 
 def main() -> int:
     if not INP.exists():
         raise SystemExit(f"Missing input: {INP}")
 
-    with INP.open("r", encoding="utf-8") as f, OUT.open("w", encoding="utf-8") as g:
-        header = f.readline().rstrip("\n").split("\t")
-        if header[:5] != ["lemma_key", "lemma", "refs_raw", "source_column", "line_no"]:
-            raise SystemExit("Unexpected header in index_rows_keyed.tsv")
-
-        g.write("cnt_idx\tlemma_key\tlemma\trefs_raw\tsource_column\tline_no\n")
-
-        n = 0
-        for line in f:
-            line = line.rstrip("\n")
-            if not line:
-                continue
-            parts = line.split("\t")
-            if len(parts) < 5:
-                continue
-            n += 1
-            cnt_idx = f"CNT-IDX-{n:07d}"
-            g.write(cnt_idx + "\t" + "\t".join(parts[:5]) + "\n")
-
-    print(f"OK: wrote {OUT} with {n} rows")
+    cache = stagecache.lookup("cnt_idx", [INP, volumes.path(volumes.VOLUME_FILE)], [OUT])
+    if cache.hit():
+        return 0
+
+    prof = stageprof.start()
+    stats = {"rows": 0}
+    with prof.stage("cnt_idx", inputs=[INP], outputs=[OUT]) as st, \
+         INP.open("r", encoding="utf-8") as f, OUT.open("w", encoding="utf-8") as g:
+        lines = id_lines(st.count_in(f, header=True), stats)
+        g.writelines(st.items(lines, key=stageprof.tsv_label(4, 5), header=True))
+        st.rows_out = stats["rows"]
+    prof.finish()
+
+    cache.done(f"OK: wrote {OUT} with {stats['rows']} rows")
     return 0
 
 if __name__ == "__main__":
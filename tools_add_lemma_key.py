@@ -1,9 +1,12 @@
 #!/usr/bin/env python3
-from pathlib import Path
 import re
 
-INP = Path("index_rows_stitched.tsv")
-OUT = Path("index_rows_keyed.tsv")
+import stagecache
+import stageprof
+import volumes
+
+INP = volumes.path("index_rows_stitched.tsv")
+OUT = volumes.path("index_rows_keyed.tsv")
 
 def lemma_key(s: str) -> str:
     s = s.strip().lower()
@@ -16,38 +19,51 @@ def lemma_key(s: str) -> str:
     s = re.sub(r"\s+", " ", s).strip()
     return s
 
+def keyed_lines(lines, stats):
+    lines = iter(lines)
+    header = next(lines, "").rstrip("\n")
+    cols = header.split("\t")
+    # Expect: lemma, refs_raw, source_column, line_no
+    if cols[:4] != ["lemma", "refs_raw", "source_column", "line_no"]:
+        raise SystemExit(f"Unexpected header in {INP}: {header}")
+
+    yield "lemma_key\tlemma\trefs_raw\tsource_column\tline_no\n"
+
+    stats["rows"] = stats["empty"] = 0
+    for line in lines:
+        line = line.rstrip("\n")
+        if not line:
+            continue
+        parts = line.split("\t")
+        if len(parts) < 4:
+            continue
+        lemma, refs, src, ln = parts[0], parts[1], parts[2], parts[3]
+        key = lemma_key(lemma)
+        if not key:
+            stats["empty"] += 1
+            # still emit for auditability
+            key = "__EMPTY__"
+        yield f"{key}\t{lemma}\t{refs}\t{src}\t{ln}\n"
+        stats["rows"] += 1
+
 def main() -> int:
     if not INP.exists():
         raise SystemExit(f"Missing input: {INP}")
 
-    with INP.open("r", encoding="utf-8") as f, OUT.open("w", encoding="utf-8") as g:
-        header = f.readline().rstrip("\n")
-        cols = header.split("\t")
-        # Expect: lemma, refs_raw, source_column, line_no
-        if cols[:4] != ["lemma", "refs_raw", "source_column", "line_no"]:
-            raise SystemExit(f"Unexpected header in {INP}: {header}")
-
-        g.write("lemma_key\tlemma\trefs_raw\tsource_column\tline_no\n")
-
-        n = 0
-        empty = 0
-        for line in f:
-            line = line.rstrip("\n")
-            if not line:
-                continue
-            parts = line.split("\t")
-            if len(parts) < 4:
-                continue
-            lemma, refs, src, ln = parts[0], parts[1], parts[2], parts[3]
-            key = lemma_key(lemma)
-            if not key:
-                empty += 1
-                # still emit for auditability
-                key = "__EMPTY__"
-            g.write(f"{key}\t{lemma}\t{refs}\t{src}\t{ln}\n")
-            n += 1
-
-    print(f"OK: wrote {OUT} with {n} rows ({empty} empty keys)")
+    cache = stagecache.lookup("lemma_key", [INP], [OUT])
+    if cache.hit():
+        return 0
+
+    prof = stageprof.start()
+    stats = {}
+    with prof.stage("lemma_key", inputs=[INP], outputs=[OUT]) as st, \
+         INP.open("r", encoding="utf-8") as f, OUT.open("w", encoding="utf-8") as g:
+        lines = keyed_lines(st.count_in(f, header=True), stats)
+        g.writelines(st.items(lines, key=stageprof.tsv_label(3, 4), header=True))
+        st.rows_out = stats["rows"]
+    prof.finish()
+
+    cache.done(f"OK: wrote {OUT} with {stats['rows']} rows ({stats['empty']} empty keys)")
     return 0
 
 if __name__ == "__main__":
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# Benchmarks for every build stage and query CLI, on the shipped corpus and
+# on synthetically scaled copies of it.
+#
+#   ./tools_bench.py [--scales 1,10,100] [--queries 200] [--repeat 5]
+#                    [--out bench_results.json] [--keep DIR]
+#                    [--baseline FILE] [--threshold 0.25] [--save-baseline FILE]
+#
+# Each scale runs in its own scratch copy of the scripts. Scale N replicates
+# every ocr_clean/ column N times (copy k is prefixed "sKKK-" and has k*1000
+# added to every tab number) so the stitched order and the tab space grow
+# with it. Every stage and query batch runs as a child process; wall time,
+# peak RSS (the child's VmHWM) and rows/sec go to --out as JSON, each the
+# median of --repeat runs. With --baseline, runs slower (or bigger) than the
+# baseline by more than --threshold are reported and the exit status is 1;
+# a slowdown also has to exceed MIN_WALL_DELTA and the spread of the
+# baseline's samples, so a run compared with itself comes out clean.
+from pathlib import Path
+import csv
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from cnt_batch import arg
+
+ROOT = Path(__file__).resolve().parent
+SRC_DIR = Path("ocr_clean")
+TAB_STRIDE = 1000
+
+# (name, script) in pipeline order; each prints "OK: wrote X with N ...",
+# which is where the row counts come from
+STAGES = [
+    ("parse_stitch", "tools_parse_index_stitch.py"),
+    ("lemma_key", "tools_add_lemma_key.py"),
+    ("cnt_idx", "tools_add_cnt_idx.py"),
+    ("tokenize", "tools_tokenize_refs.py"),
+    ("group", "tools_group_refs.py"),
+    ("normalize", "tools_normalize_refs.py"),
+    ("web_json", "tools_make_web_json.py"),
+    ("build_all", "tools_build_all.py"),
+    ("lookup_index", "tools_make_lookup_index.py"),
+    ("ref_index", "tools_make_ref_index.py"),
+    ("pack_corpus", "tools_pack_corpus.py"),
+    ("sqlite", "tools_make_sqlite.py"),
+    ("fuzzy_index", "tools_make_fuzzy_index.py"),
+]
+
+# (name, script, query set, extra args), each run as one --batch
+QUERIES = [
+    ("lookup", "cnt_lookup.py", "keys", []),
+    ("lookup_prefix", "cnt_lookup.py", "prefixes", ["--prefix"]),
+    ("lookup_fuzzy", "cnt_lookup.py", "typos", ["--fuzzy"]),
+    ("lookup_db", "cnt_lookup.py", "keys", ["--db"]),
+    ("refs", "cnt_refs.py", "cnt", []),
+    ("refs_db", "cnt_refs.py", "cnt", ["--db"]),
+    ("reverse", "cnt_reverse.py", "refs", []),
+    ("reverse_db", "cnt_reverse.py", "refs", ["--db"]),
+]
+
+# differences below these are noise, whatever the ratio: every run is a
+# fresh interpreter, so ~100 ms of a stage is startup and imports
+MIN_WALL_DELTA = 0.15
+MIN_RSS_DELTA_KB = 4096
+
+RE_TAB = re.compile(r"(\d+)(?=\s*,)")
+
+def make_workdir(work: Path, scale: int) -> None:
+    for p in ROOT.glob("*.py"):
+        shutil.copy2(p, work / p.name)
+    dst = work / SRC_DIR
+    dst.mkdir()
+    files = sorted((ROOT / SRC_DIR).glob("*.txt"))
+    if scale == 1:
+        for p in files:
+            shutil.copy2(p, dst / p.name)
+        return
+    for k in range(scale):
+        shift = lambda m: str(int(m.group(1)) + k * TAB_STRIDE)
+        for p in files:
+            text = p.read_text(encoding="utf-8", errors="replace")
+            (dst / f"s{k:03d}-{p.name}").write_text(RE_TAB.sub(shift, text) if k else text, encoding="utf-8")
+
+# Children start through this so they report their own high-water RSS:
+# ru_maxrss from wait4() would include the parent's RSS, which a forked
+# child inherits and exec does not reset.
+BOOT = """
+import atexit, os, runpy, sys
+def _hwm():
+    kb = 0
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    kb = int(line.split()[1])
+    except OSError:
+        import resource
+        kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with open(os.environ["CNT_BENCH_RSS"], "w") as g:
+        g.write(str(kb))
+atexit.register(_hwm)
+sys.argv = sys.argv[1:]
+runpy.run_path(sys.argv[0], run_name="__main__")
+"""
+
+def run(argv, cwd: Path):
+    # (wall seconds, peak RSS KiB, exit code, stdout+stderr text)
+    rss_file = cwd / ".bench_rss"
+    # the stage cache would turn every repeat after the first into a restore
+    env = dict(os.environ, CNT_BENCH_RSS=str(rss_file), CNT_BUILD_CACHE="0")
+    t0 = time.perf_counter()
+    p = subprocess.run([sys.executable, "-c", BOOT] + argv, cwd=cwd, stdin=subprocess.DEVNULL, env=env,
+                       stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    wall = time.perf_counter() - t0
+    try:
+        rss = int(rss_file.read_text())
+        rss_file.unlink()
+    except (OSError, ValueError):
+        rss = 0
+    return wall, rss, p.returncode, p.stdout.decode("utf-8", errors="replace")
+
+def median(xs):
+    xs = sorted(xs)
+    return xs[len(xs) // 2] if len(xs) % 2 else (xs[len(xs) // 2 - 1] + xs[len(xs) // 2]) / 2
+
+def timed(argv, cwd: Path, repeat: int):
+    # (median wall, median peak RSS, output of the last run, wall samples)
+    runs = []
+    for _ in range(repeat):
+        r = run(argv, cwd)
+        if r[2] != 0:
+            raise SystemExit(f"{' '.join(argv)} failed in {cwd}:\n{r[3]}")
+        runs.append(r)
+    walls = [r[0] for r in runs]
+    return median(walls), int(median([r[1] for r in runs])), runs[-1][3], walls
+
+def make_queries(work: Path, n: int, seed: int = 1) -> dict:
+    rnd = random.Random(seed)
+    with (work / "index_rows_id.tsv").open("r", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f, delimiter="\t"))
+    with (work / "index_refs_norm.tsv").open("r", encoding="utf-8") as f:
+        norms = [r["ref_norm"] for r in csv.DictReader(f, delimiter="\t") if r["ref_type"] == "REF"]
+
+    def typo(k: str) -> str:
+        i = rnd.randrange(len(k))
+        return k[:i] + rnd.choice("abcdefghilmnoprstu") + k[i + 1:]
+
+    keys = [rnd.choice(rows)["lemma_key"] for _ in range(n)]
+    sets = {
+        "keys": keys,
+        "prefixes": [k[:3] for k in keys],
+        "typos": [typo(k) for k in keys],
+        "cnt": [rnd.choice(rows)["cnt_idx"] for _ in range(n)],
+        "refs": [rnd.choice(norms) for _ in range(n)],
+    }
+    paths = {}
+    for name, qs in sets.items():
+        paths[name] = work / f"bench_q_{name}.txt"
+        paths[name].write_text("".join(q + "\n" for q in qs), encoding="utf-8")
+    return paths
+
+def bench_scale(scale: int, n_queries: int, repeat: int, keep):
+    if keep:
+        work = Path(keep) / f"scale{scale}"
+        if work.exists():
+            shutil.rmtree(work)
+        work.mkdir(parents=True)
+    else:
+        tmp = tempfile.TemporaryDirectory(prefix=f"cnt-bench-{scale}x-")
+        work = Path(tmp.name)
+
+    results = []
+    try:
+        make_workdir(work, scale)
+        for name, script in STAGES:
+            wall, rss, out, walls = timed([script], work, repeat)
+            m = re.search(r"(\d+) rows", out) or re.search(r"with (\d+)", out)
+            rows = int(m.group(1)) if m else 0
+            results.append({"scale": scale, "kind": "stage", "name": name, "wall_s": round(wall, 4),
+                            "wall_samples": [round(w, 4) for w in walls], "peak_rss_kb": rss, "rows": rows,
+                            "rows_per_s": round(rows / wall, 1) if wall else 0.0})
+            print(f"{scale}x\tstage\t{name}\t{wall:.3f}s\t{rss} KiB\t{rows} rows", file=sys.stderr)
+
+        qpaths = make_queries(work, n_queries)
+        for name, script, qset, extra in QUERIES:
+            wall, rss, _, walls = timed([script, "--batch", str(qpaths[qset])] + extra, work, repeat)
+            results.append({"scale": scale, "kind": "query", "name": name, "wall_s": round(wall, 4),
+                            "wall_samples": [round(w, 4) for w in walls], "peak_rss_kb": rss, "rows": n_queries,
+                            "rows_per_s": round(n_queries / wall, 1) if wall else 0.0})
+            print(f"{scale}x\tquery\t{name}\t{wall:.3f}s\t{rss} KiB\t{n_queries} queries", file=sys.stderr)
+    finally:
+        if not keep:
+            tmp.cleanup()
+    return results
+
+def compare(results, baseline, threshold: float):
+    # Returns the regressed entries and prints one line per shared entry.
+    base = {(b["scale"], b["kind"], b["name"]): b for b in baseline.get("runs", [])}
+    regressions = []
+    print("scale\tkind\tname\twall_s\tbase_wall_s\twall_ratio\trss_ratio\tstatus")
+    for r in results:
+        b = base.get((r["scale"], r["kind"], r["name"]))
+        if b is None:
+            continue
+        wr = r["wall_s"] / b["wall_s"] if b["wall_s"] else 1.0
+        mr = r["peak_rss_kb"] / b["peak_rss_kb"] if b["peak_rss_kb"] else 1.0
+        # a slowdown must also exceed the spread of the baseline's own samples
+        spread = max(b.get("wall_samples") or [0]) - min(b.get("wall_samples") or [0])
+        slow = wr > 1 + threshold and r["wall_s"] - b["wall_s"] > max(MIN_WALL_DELTA, spread)
+        big = mr > 1 + threshold and r["peak_rss_kb"] - b["peak_rss_kb"] > MIN_RSS_DELTA_KB
+        status = "REGRESSION" if slow or big else "ok"
+        if slow or big:
+            regressions.append(r)
+        print(f"{r['scale']}x\t{r['kind']}\t{r['name']}\t{r['wall_s']:.3f}\t{b['wall_s']:.3f}\t{wr:.2f}\t{mr:.2f}\t{status}")
+    return regressions
+
+def main() -> int:
+    argv = sys.argv[1:]
+    scales = [int(x) for x in arg(argv, "--scales", "1,10").split(",") if x]
+    n_queries = int(arg(argv, "--queries", "200"))
+    repeat = int(arg(argv, "--repeat", "5"))
+    out = Path(arg(argv, "--out", "bench_results.json"))
+    keep = arg(argv, "--keep", None)
+    baseline = arg(argv, "--baseline", None)
+    threshold = float(arg(argv, "--threshold", "0.25"))
+    save = arg(argv, "--save-baseline", None)
+
+    if not (ROOT / SRC_DIR).is_dir():
+        raise SystemExit(f"Missing {ROOT / SRC_DIR}/")
+
+    runs = []
+    for s in scales:
+        runs.extend(bench_scale(s, n_queries, repeat, keep))
+
+    doc = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "queries": n_queries,
+            "repeat": repeat,
+        },
+        "runs": runs,
+    }
+    out.write_text(json.dumps(doc, indent=2) + "\n", encoding="utf-8")
+    print(f"OK: wrote {out} with {len(runs)} runs", file=sys.stderr)
+    if save:
+        Path(save).write_text(json.dumps(doc, indent=2) + "\n", encoding="utf-8")
+        print(f"OK: wrote baseline {save}", file=sys.stderr)
+
+    if baseline:
+        with open(baseline, "r", encoding="utf-8") as f:
+            regressions = compare(runs, json.load(f), threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) over {threshold:.0%}", file=sys.stderr)
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# Microbenchmark: refs tokenizing/classifying before and after refscan.py.
+#
+#   ./tools_bench_refscan.py [--repeat 5]
+#
+# Corpus is the refs_raw column of index_rows_id.tsv (the 32k tokens of
+# index_refs.tsv). Reports the best of --repeat runs as tokens/sec:
+#   scan      legacy normalize_refs/split_tokens/kind vs refscan.scan
+#   classify  legacy 4-regex kind() vs refscan.kind over index_refs.tsv tokens
+#   chain     tokenize -> group -> normalize through TSV text (what the
+#             single-stage scripts do) vs typed records (tools_build_all.py)
+import re
+import sys
+import time
+
+import refscan
+import tools_group_refs
+import tools_normalize_refs
+import tools_tokenize_refs
+import volumes
+from tsvio import drain
+
+ROWS = volumes.path("index_rows_id.tsv")
+TOKENS = volumes.path("index_refs.tsv")
+
+# the tokenizer as it was before refscan.py, kept for comparison
+RE_NUMPAIR = re.compile(r"^\d+,\d+$")
+RE_NUM     = re.compile(r"^\d+$")
+RE_SIGLA   = re.compile(r"^[A-Za-z]\.?$")
+RE_MARK    = re.compile(r"^[\^°\*]+$")
+
+def legacy_kind(tok: str) -> str:
+    if RE_NUMPAIR.match(tok): return "NUMPAIR"
+    if RE_NUM.match(tok):     return "NUM"
+    if RE_MARK.match(tok):    return "MARK"
+    if RE_SIGLA.match(tok):   return "SIGLA"
+    return "OTHER"
+
+def legacy_normalize_refs(s: str) -> str:
+    s = s.strip()
+    s = s.replace(";", " ; ")
+    s = s.replace(",", ",")
+    s = s.replace("^", " ^ ")
+    s = s.replace("°", " ° ")
+    s = s.replace("*", " * ")
+    s = re.sub(r"\s+", " ", s).strip()
+    return s
+
+def legacy_scan(refs_raw: str):
+    out = []
+    for p in legacy_normalize_refs(refs_raw).split(" "):
+        p = p.strip()
+        if not p or p in [",", ".", ":"]:
+            continue
+        if p == ";":
+            out.append((";", "SEP"))
+            continue
+        t = p.rstrip(",")
+        if t:
+            out.append((t, legacy_kind(t)))
+    return out
+
+def best(fn, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+def main() -> int:
+    repeat = 5
+    if "--repeat" in sys.argv:
+        repeat = int(sys.argv[sys.argv.index("--repeat") + 1])
+
+    for p in (ROWS, TOKENS):
+        if not p.exists():
+            raise SystemExit(f"Missing {p}")
+
+    with ROWS.open("r", encoding="utf-8") as f:
+        id_lines = f.readlines()
+    raws = [line.rstrip("\n").split("\t")[3] for line in id_lines[1:] if line.count("\t") >= 5]
+    with TOKENS.open("r", encoding="utf-8") as f:
+        toks = [line.split("\t")[1] for line in f.readlines()[1:]]
+
+    n_tokens = sum(len(refscan.scan(s)) for s in raws)
+    if [legacy_scan(s) for s in raws] != [[(t, refscan.tsv_kind(k)) for t, k in refscan.scan(s)] for s in raws]:
+        raise SystemExit("refscan.scan disagrees with the legacy tokenizer")
+
+    def text_chain():
+        lines = tools_tokenize_refs.token_lines(id_lines, {})
+        lines = tools_group_refs.group_lines(lines, {})
+        drain(tools_normalize_refs.norm_lines(lines, {}))
+
+    def typed_chain():
+        recs = tools_tokenize_refs.token_records(id_lines, {})
+        groups = tools_group_refs.group_records(tools_group_refs.from_tokens(recs), {})
+        drain(tools_normalize_refs.norm_records(groups, {}))
+
+    cases = [
+        ("scan", n_tokens,
+         lambda: [legacy_scan(s) for s in raws],
+         lambda: [refscan.scan(s) for s in raws]),
+        ("classify", len(toks),
+         lambda: [legacy_kind(t) for t in toks],
+         lambda: [refscan.kind(t) for t in toks]),
+        ("chain", n_tokens, text_chain, typed_chain),
+    ]
+
+    print("bench\ttokens\tbefore_tok_s\tafter_tok_s\tspeedup")
+    for name, n, before, after in cases:
+        tb, ta = best(before, repeat), best(after, repeat)
+        print(f"{name}\t{n}\t{n / tb:.0f}\t{n / ta:.0f}\t{tb / ta:.2f}x")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
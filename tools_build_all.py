@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# Fused rebuild: runs the stitched parse -> lemma_key -> cnt_idx -> tokenize
+# -> group -> normalize -> web json chain in one process. Each stage is a
+# generator over the previous stage's output (TSV lines up to
+# index_rows_id.tsv, typed token/group/ref records after that), so
+# ocr_clean/ is read once and nothing is re-read from disk. Every TSV is
+# still written as a side output, byte-identical to running the tools_*.py
+# scripts one by one.
+#
+#   ./tools_build_all.py [--skip FILE[,FILE...]] [--minimal] [--jobs N]
+#                        [--profile|--cprofile]
+#
+# --minimal skips the intermediates no query tool reads
+# (index_rows_stitched.tsv, index_refs.tsv, index_refs_grouped.tsv).
+# --profile reports each stage's share of the fused run (see stageprof.py).
+import glob
+import sys
+
+import cnt_batch
+import stageprof
+import tools_add_cnt_idx
+import tools_add_lemma_key
+import tools_group_refs
+import tools_make_web_json
+import tools_normalize_refs
+import tools_parse_index_stitch
+import tools_tokenize_refs
+from tsvio import drain, tee, tee_if_changed, tee_records
+
+INTERMEDIATE = [
+    tools_parse_index_stitch.OUT_ROWS,
+    tools_tokenize_refs.OUT,
+    tools_group_refs.OUT,
+]
+
+USAGE = "Usage: ./tools_build_all.py [--skip FILE[,FILE...]] [--minimal] [--jobs N] [--profile|--cprofile]"
+FLAGS = {"--minimal", "--profile", "--cprofile"}
+VALUE_FLAGS = {"--skip", "--jobs"}
+
+def bad_args(argv) -> bool:
+    # anything but the flags above (and one value after each VALUE_FLAGS one)
+    i = 0
+    while i < len(argv):
+        if argv[i] in VALUE_FLAGS:
+            i += 1
+        elif argv[i] not in FLAGS:
+            return True
+        i += 1
+    return False
+
+def skip_set(argv):
+    skip = set()
+    if "--minimal" in argv:
+        skip.update(str(p) for p in INTERMEDIATE)
+    if "--skip" in argv:
+        i = argv.index("--skip")
+        if i + 1 >= len(argv):
+            raise SystemExit("--skip needs a comma-separated list of files")
+        skip.update(x.strip() for x in argv[i + 1].split(",") if x.strip())
+    return skip
+
+def collect(buf, lines):
+    for line in lines:
+        buf.append(line)
+        yield line
+
+def build(rows, rejects, skip=(), changed=None, prof=stageprof.NULL):
+    # Runs everything downstream of the stitched parse. With `changed` (a
+    # set), outputs whose bytes did not change are left alone and the
+    # rewritten paths are recorded there.
+    out = lambda p: None if str(p) in skip else p
+    if changed is None:
+        write = tee
+    else:
+        write = lambda p, lines: tee_if_changed(p, lines, changed)
+
+    with prof.stage("parse_stitch.rejects", outputs=[tools_parse_index_stitch.OUT_REJ]) as p:
+        drain(write(tools_parse_index_stitch.OUT_REJ, tools_parse_index_stitch.reject_lines(rejects)))
+        p.rows_in = p.rows_out = len(rejects)
+
+    st_key, st_id, st_tok, st_grp, st_norm = {}, {"rows": 0}, {"tokens": 0}, {}, {}
+    id_buf = []
+
+    # each stage's items() wraps its output after the tee, so writing its
+    # TSV is charged to it
+    p_rows = prof.stage("parse_stitch.write", outputs=[out(tools_parse_index_stitch.OUT_ROWS)])
+    p_key = prof.stage("lemma_key", outputs=[out(tools_add_lemma_key.OUT)])
+    p_id = prof.stage("cnt_idx", outputs=[out(tools_add_cnt_idx.OUT)])
+    p_tok = prof.stage("tokenize", outputs=[out(tools_tokenize_refs.OUT)])
+    p_grp = prof.stage("group", outputs=[out(tools_group_refs.OUT)])
+    p_norm = prof.stage("normalize", outputs=[out(tools_normalize_refs.OUT)])
+
+    lines = tools_parse_index_stitch.row_lines(rows)
+    lines = p_rows.items(write(out(tools_parse_index_stitch.OUT_ROWS), lines))
+    lines = write(out(tools_add_lemma_key.OUT), tools_add_lemma_key.keyed_lines(p_key.count_in(lines, header=True), st_key))
+    lines = p_key.items(lines, key=stageprof.tsv_label(3, 4), header=True)
+    lines = write(out(tools_add_cnt_idx.OUT), tools_add_cnt_idx.id_lines(p_id.count_in(lines, header=True), st_id))
+    lines = p_id.items(lines, key=stageprof.tsv_label(4, 5), header=True)
+    lines = collect(id_buf, lines)
+
+    # from here on typed records are handed over directly; the TSVs are
+    # side outputs
+    toks = tee_records(write, out(tools_tokenize_refs.OUT), tools_tokenize_refs.HEADER,
+                       tools_tokenize_refs.token_records(p_tok.count_in(lines, header=True), st_tok),
+                       tools_tokenize_refs.token_line)
+    toks = p_tok.items(toks, key=lambda t: t[0])
+    groups = tee_records(write, out(tools_group_refs.OUT), tools_group_refs.HEADER,
+                         tools_group_refs.group_records(tools_group_refs.from_tokens(p_grp.count_in(toks)), st_grp),
+                         tools_group_refs.group_line)
+    groups = p_grp.items(groups, key=lambda g: f"{g[0]}:{g[1]}")
+    norms = tee_records(write, out(tools_normalize_refs.OUT), tools_normalize_refs.HEADER,
+                        tools_normalize_refs.norm_records(p_norm.count_in(groups), st_norm),
+                        tools_normalize_refs.norm_line)
+    norms = p_norm.items(norms, key=lambda r: f"{r['cnt_idx']}:{r['ref_no']}")
+
+    with prof.stage("web_json", outputs=[tools_make_web_json.DATADIR]) as p_web:
+        # pulling the refs side drives the whole chain
+        refs = tools_make_web_json.web_ref_rows(norms)
+        web = tools_make_web_json.web_rows(id_buf)
+        shards = tools_make_web_json.write_web(web, refs)
+        p_web.rows_in = len(web) + len(refs)
+        p_web.rows_out = len(web)
+
+    p_rows.rows_in = p_rows.rows_out = len(rows)
+    p_key.rows_out = st_key["rows"]
+    p_id.rows_out = st_id["rows"]
+    p_tok.rows_out = st_tok["tokens"]
+    p_grp.rows_out = st_grp["groups"]
+    p_norm.rows_out = st_norm["refs"]
+
+    def report(p, msg):
+        if not out(p):
+            print(f"OK: skipped {p} ({msg})")
+        elif changed is not None and str(p) not in changed:
+            print(f"OK: unchanged {p} ({msg})")
+        else:
+            print(f"OK: wrote {p} with {msg}")
+
+    report(tools_parse_index_stitch.OUT_ROWS, f"{len(rows)} rows")
+    report(tools_parse_index_stitch.OUT_REJ, f"{len(rejects)} rejects")
+    report(tools_add_lemma_key.OUT, f"{st_key['rows']} rows ({st_key['empty']} empty keys)")
+    report(tools_add_cnt_idx.OUT, f"{st_id['rows']} rows")
+    report(tools_tokenize_refs.OUT, f"{st_tok['tokens']} tokens")
+    report(tools_group_refs.OUT, f"{st_grp['groups']} groups")
+    report(tools_normalize_refs.OUT, f"{st_norm['refs']} normalized refs")
+    print(f"OK: wrote {tools_make_web_json.MANIFEST} with {shards} shards")
+
+def main() -> int:
+    if bad_args(sys.argv[1:]):
+        print(USAGE, file=sys.stderr)
+        return 2
+    skip = skip_set(sys.argv[1:])
+
+    files = sorted(glob.glob(str(tools_parse_index_stitch.SRC_DIR / "*.txt")))
+    if not files:
+        raise SystemExit(f"No files found in {tools_parse_index_stitch.SRC_DIR}/")
+
+    jobs = cnt_batch.jobs_arg(sys.argv[1:])
+    prof = stageprof.start()
+    with prof.stage("parse_stitch", inputs=files) as p:
+        rows, rejects = tools_parse_index_stitch.parse_files(
+            files, jobs, lambda rows: p.items(rows, key=tools_parse_index_stitch.row_label))
+        p.rows_in = len(files)
+        p.rows_out = len(rows)
+    build(rows, rejects, skip, prof=prof)
+    prof.finish()
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
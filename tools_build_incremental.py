@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# Incremental rebuild driven by ocr_clean.sha256.
+#
+#   ./tools_build_incremental.py [--dry-run]
+#
+# Columns whose hash differs from the manifest (or that were added/removed)
+# are re-parsed together with the neighbours their stitching depends on:
+# back to the previous column that owns a row, and forward through columns
+# whose head lines stitch onto the re-parsed rows. Those rows and rejects are
+# spliced into index_rows_stitched.tsv / parse_rejects_stitched.tsv, the
+# downstream stages are re-streamed from the spliced rows, and only outputs
+# whose bytes changed are rewritten and re-hashed in their manifests.
+from pathlib import Path
+import sys
+
+import stageprof
+import tools_build_all
+import tools_parse_index_stitch as stitch
+import volumes
+from manifests import file_sha256, read_manifest, refresh_manifests, write_manifest
+
+OCR_MANIFEST = volumes.path("ocr_clean.sha256")
+
+def load_grouped(path: Path, parse):
+    out = {}
+    with path.open("r", encoding="utf-8") as f:
+        f.readline()
+        for line in f:
+            line = line.rstrip("\n")
+            if line:
+                item = parse(line)
+                out.setdefault(item[0], []).append(item[1])
+    return out
+
+def parse_row(line: str):
+    lemma, refs, src, ln = line.split("\t", 3)
+    return src, stitch.Row(lemma, refs, src, int(ln))
+
+def parse_reject(line: str):
+    src, ln, reason, s = line.split("\t", 3)
+    return src, (src, int(ln), reason, s)
+
+def plan_windows(columns, dirty, parsed):
+    windows = []
+    for i, c in enumerate(columns):
+        if c not in dirty:
+            continue
+        # back to an unchanged column that owns a row: its last row may have
+        # taken (old) head lines of column i
+        lo = i - 1
+        while lo >= 0 and (columns[lo] in dirty or not parsed(lo)[2]):
+            lo -= 1
+        lo = max(lo, 0)
+        # forward while the next column's head stitches onto our rows
+        hi = i
+        while hi + 1 < len(columns):
+            _, head, rows, _ = parsed(hi + 1)
+            if columns[hi + 1] in dirty or head or not rows:
+                hi += 1
+            else:
+                break
+        windows.append([lo, hi])
+
+    merged = []
+    for lo, hi in sorted(windows):
+        if merged and lo <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], hi)
+        else:
+            merged.append([lo, hi])
+    return merged
+
+def main() -> int:
+    dry_run = "--dry-run" in sys.argv[1:]
+
+    src_dir = stitch.SRC_DIR
+    current = {p.name: p for p in sorted(src_dir.glob("*.txt"))}
+    if not current:
+        raise SystemExit(f"No files found in {src_dir}/")
+
+    pinned = read_manifest(OCR_MANIFEST)
+    if not pinned or not stitch.OUT_ROWS.exists() or not stitch.OUT_REJ.exists():
+        print("No manifest or stitched output yet; running a full build")
+        if not dry_run:
+            tools_build_all.main()
+            write_manifest(OCR_MANIFEST, {n: file_sha256(p) for n, p in current.items()})
+        return 0
+
+    hashes = {n: file_sha256(p) for n, p in current.items()}
+    dirty_names = {n for n in current if pinned.get(n) != hashes[n]} | (set(pinned) - set(current))
+    if not dirty_names:
+        print("OK: ocr_clean/ matches ocr_clean.sha256; nothing to rebuild")
+        return 0
+
+    stem = lambda n: Path(n).stem
+    columns = sorted({stem(n) for n in set(current) | set(pinned)})
+    dirty = {stem(n) for n in dirty_names}
+
+    cache = {}
+    def parsed(j):
+        if j not in cache:
+            c = columns[j]
+            p = src_dir / f"{c}.txt"
+            if p.exists():
+                with p.open("r", encoding="utf-8", errors="replace") as f:
+                    cache[j] = stitch.parse_column(c, f)
+            else:
+                cache[j] = (c, [], [], [])
+        return cache[j]
+
+    prof = stageprof.start()
+    with prof.stage("plan", inputs=[src_dir]) as st:
+        windows = plan_windows(columns, dirty, parsed)
+        st.rows_in = len(columns)
+        st.rows_out = len(cache)
+    print(f"changed columns: {', '.join(sorted(dirty))}")
+    print(f"re-parsing: {', '.join(columns[lo] + '..' + columns[hi] for lo, hi in windows)}")
+    if dry_run:
+        return 0
+
+    old_rows = load_grouped(stitch.OUT_ROWS, parse_row)
+    old_rejects = load_grouped(stitch.OUT_REJ, parse_reject)
+
+    rows, rejects = [], []
+    starts = {lo: hi for lo, hi in windows}
+    i = 0
+    while i < len(columns):
+        if i in starts:
+            hi = starts[i]
+            # the first column's head already sits on the row before the
+            # window; stitch it onto a throwaway row instead
+            last = rows[-1].copy() if rows else None
+            w_rows, w_rejects = stitch.merge_columns((parsed(j) for j in range(i, hi + 1)), last)
+            rows.extend(w_rows)
+            rejects.extend(w_rejects)
+            i = hi + 1
+            continue
+        rows.extend(old_rows.get(columns[i], []))
+        rejects.extend(old_rejects.get(columns[i], []))
+        i += 1
+
+    changed = set()
+    tools_build_all.build(rows, rejects, changed=changed, prof=prof)
+    prof.finish()
+
+    # manifests list names relative to the data root
+    changed = {str(Path(p).relative_to(volumes.ROOT)) for p in changed}
+    for m in refresh_manifests(changed, volumes.ROOT):
+        print(f"OK: updated {m}")
+    write_manifest(OCR_MANIFEST, hashes)
+    print(f"OK: updated {OCR_MANIFEST}")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# Structural diff of two builds: which rows and refs a change added, removed
+# or changed.
+#
+#   ./tools_diff_builds.py OLD_ROOT [NEW_ROOT] [--summary] [--jsonl]
+#
+# OLD_ROOT and NEW_ROOT are data roots (NEW_ROOT defaults to CNT_DATA_ROOT,
+# i.e. this checkout); each needs index_rows_id.tsv and index_refs_norm.tsv.
+# Rows are matched on (source_column, line_no, lemma_key), not on cnt_idx,
+# which tools_add_cnt_idx.py renumbers after the first inserted row. A row
+# whose lemma or refs_raw differs is changed. A row's refs are compared as a
+# multiset of (ref_norm, ref_type, sigla_prefix, marks, attach_prev); an added
+# and a removed ref with the same ref_norm count as one changed ref.
+#
+# Hash join: the old build is read once into a dict keyed on the row key, the
+# new one is streamed past it, and whatever is left in the dict was removed.
+# Each side's refs are grouped onto its rows in the same pass, as both TSVs
+# are in cnt_idx order. Time and memory are linear in the size of the builds.
+#
+# Prints one line per difference and a summary (--summary: the summary only),
+# or with --jsonl one JSON object per difference and a final {"summary": ...}.
+# Exits 1 when the builds differ, like diff.
+from collections import Counter
+from itertools import groupby
+from pathlib import Path
+import csv
+import sys
+
+import cnt_batch
+import volumes
+
+ROWS = "index_rows_id.tsv"
+REFS = "index_refs_norm.tsv"
+
+ROW_FIELDS = ("lemma", "refs_raw")
+REF_FIELDS = ("ref_norm", "ref_type", "sigla_prefix", "marks", "attach_prev")
+
+def read_build(root: Path, stats):
+    # (key, cnt_idx, row fields, refs) per row of root, in file order; key is
+    # (source_column, line_no, lemma_key, n), n counting earlier rows with
+    # the same first three
+    with (root / ROWS).open("r", encoding="utf-8", newline="") as f, \
+         (root / REFS).open("r", encoding="utf-8", newline="") as g:
+        rows = csv.reader(f, delimiter="\t")
+        rh = {name: i for i, name in enumerate(next(rows))}
+        refs = csv.reader(g, delimiter="\t")
+        fh = {name: i for i, name in enumerate(next(refs))}
+        rc = [rh[n] for n in ROW_FIELDS]
+        fc = [fh[n] for n in REF_FIELDS]
+        c_idx, c_src, c_ln, c_key = rh["cnt_idx"], rh["source_column"], rh["line_no"], rh["lemma_key"]
+        f_idx = fh["cnt_idx"]
+
+        groups = ((k, list(grp)) for k, grp in groupby(refs, key=lambda r: r[f_idx]))
+        pending = next(groups, None)
+        seen = Counter()
+        for r in rows:
+            cnt_idx = r[c_idx]
+            while pending is not None and pending[0] < cnt_idx:
+                # refs of a cnt_idx that has no row
+                stats["orphan_refs"] += len(pending[1])
+                pending = next(groups, None)
+            own = []
+            if pending is not None and pending[0] == cnt_idx:
+                own = [tuple(x[i] for i in fc) for x in pending[1]]
+                pending = next(groups, None)
+            base = (r[c_src], r[c_ln], r[c_key])
+            n = seen[base]
+            seen[base] += 1
+            yield base + (n,), cnt_idx, tuple(r[i] for i in rc), own
+        while pending is not None:
+            stats["orphan_refs"] += len(pending[1])
+            pending = next(groups, None)
+
+def ref_changes(old, new):
+    # (removed, added, [(old, new)] changed) between two ref lists
+    o, n = Counter(old), Counter(new)
+    removed = list((o - n).elements())
+    added = list((n - o).elements())
+    by_norm = {}
+    for ref in added:
+        by_norm.setdefault(ref[0], []).append(ref)
+    changed = []
+    still_removed = []
+    for ref in removed:
+        cand = by_norm.get(ref[0])
+        if cand:
+            changed.append((ref, cand.pop()))
+        else:
+            still_removed.append(ref)
+    paired = Counter(b for _, b in changed)
+    still_added = []
+    for ref in added:
+        if paired[ref]:
+            paired[ref] -= 1
+        else:
+            still_added.append(ref)
+    return still_removed, still_added, changed
+
+def fmt_ref(ref) -> str:
+    ref_norm, ref_type, sigla, marks, attach_prev = ref
+    parts = [ref_norm, ref_type, f"sigla={sigla}" if sigla else "", f"marks={marks}" if marks else "",
+             "attach_prev" if attach_prev == "1" else ""]
+    return " ".join(p for p in parts if p)
+
+class Report:
+    def __init__(self, mode: str):
+        self.mode = mode      # "text", "jsonl" or "summary"
+        self.counts = Counter()
+
+    def emit(self, op: str, kind: str, key, old_idx, new_idx, old=None, new=None) -> None:
+        self.counts[f"{kind}s_{op}"] += 1
+        if self.mode == "summary":
+            return
+        fields = ROW_FIELDS if kind == "row" else REF_FIELDS
+        if self.mode == "jsonl":
+            cnt_batch.emit_jsonl({
+                "op": op, "kind": kind,
+                "source_column": key[0], "line_no": int(key[1]), "lemma_key": key[2],
+                "old_cnt_idx": old_idx, "new_cnt_idx": new_idx,
+                "old": dict(zip(fields, old)) if old is not None else None,
+                "new": dict(zip(fields, new)) if new is not None else None,
+            })
+            return
+        sign = {"added": "+", "removed": "-", "changed": "~"}[op]
+        where = f"{key[0]}:{key[1]}\t{key[2]}"
+        if kind == "ref":
+            text = fmt_ref(old or new) if op != "changed" else f"{fmt_ref(old)} -> {fmt_ref(new)}"
+        elif op == "changed":
+            text = "\t".join(f"{name}: {a!r} -> {b!r}" for name, a, b in zip(fields, old, new) if a != b)
+        else:
+            text = "\t".join(f"{name}={v}" for name, v in zip(fields, old or new))
+        sys.stdout.write(f"{sign} {kind}\t{where}\t{text}\n")
+
+def diff(old_root: Path, new_root: Path, report: Report, stats):
+    old_stats, new_stats = Counter(), Counter()
+    old = {key: (cnt_idx, fields, refs) for key, cnt_idx, fields, refs in read_build(old_root, old_stats)}
+    for key, cnt_idx, fields, refs in read_build(new_root, new_stats):
+        stats["new_rows"] += 1
+        stats["new_refs"] += len(refs)
+        prev = old.pop(key, None)
+        if prev is None:
+            report.emit("added", "row", key, None, cnt_idx, new=fields)
+            for ref in refs:
+                report.emit("added", "ref", key, None, cnt_idx, new=ref)
+            continue
+        old_idx, old_fields, old_refs = prev
+        if old_fields != fields:
+            report.emit("changed", "row", key, old_idx, cnt_idx, old_fields, fields)
+        else:
+            stats["rows_same"] += 1
+        removed, added, changed = ref_changes(old_refs, refs)
+        for ref in removed:
+            report.emit("removed", "ref", key, old_idx, cnt_idx, old=ref)
+        for ref in added:
+            report.emit("added", "ref", key, old_idx, cnt_idx, new=ref)
+        for a, b in changed:
+            report.emit("changed", "ref", key, old_idx, cnt_idx, a, b)
+    for key, (old_idx, fields, refs) in old.items():
+        report.emit("removed", "row", key, old_idx, None, old=fields)
+        for ref in refs:
+            report.emit("removed", "ref", key, old_idx, None, old=ref)
+    stats["orphan_refs_old"] = old_stats["orphan_refs"]
+    stats["orphan_refs_new"] = new_stats["orphan_refs"]
+
+def main() -> int:
+    args = sys.argv[1:]
+    mode = "jsonl" if "--jsonl" in args else "summary" if "--summary" in args else "text"
+    args = [a for a in args if a not in ("--jsonl", "--summary")]
+    if not 1 <= len(args) <= 2:
+        print("Usage: ./tools_diff_builds.py OLD_ROOT [NEW_ROOT] [--summary] [--jsonl]", file=sys.stderr)
+        return 2
+    old_root = Path(args[0])
+    new_root = Path(args[1]) if len(args) > 1 else volumes.ROOT
+    for root in (old_root, new_root):
+        for name in (ROWS, REFS):
+            if not (root / name).exists():
+                print(f"Missing {root / name}", file=sys.stderr)
+                return 2
+
+    report = Report(mode)
+    stats = Counter()
+    diff(old_root, new_root, report, stats)
+
+    c = report.counts
+    summary = {k: c[k] for k in ("rows_added", "rows_removed", "rows_changed",
+                                 "refs_added", "refs_removed", "refs_changed")}
+    summary.update(rows_unchanged=stats["rows_same"], new_rows=stats["new_rows"], new_refs=stats["new_refs"],
+                   orphan_refs_old=stats["orphan_refs_old"], orphan_refs_new=stats["orphan_refs_new"])
+    if mode == "jsonl":
+        cnt_batch.emit_jsonl({"summary": summary})
+    else:
+        print(f"rows: +{c['rows_added']} -{c['rows_removed']} ~{c['rows_changed']} "
+              f"({stats['rows_same']} unchanged of {stats['new_rows']})  "
+              f"refs: +{c['refs_added']} -{c['refs_removed']} ~{c['refs_changed']}",
+              file=sys.stderr if mode == "text" else sys.stdout)
+        if stats["orphan_refs_old"] or stats["orphan_refs_new"]:
+            print(f"WARN: refs without a row: {stats['orphan_refs_old']} old, {stats['orphan_refs_new']} new",
+                  file=sys.stderr)
+    return 1 if sum(summary[k] for k in list(summary)[:6]) else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,68 +1,126 @@
 #!/usr/bin/env python3
-from pathlib import Path
 import csv
 
-INP = Path("index_refs.tsv")
-OUT = Path("index_refs_grouped.tsv")
+import stagecache
+import stageprof
+import volumes
+from tools_tokenize_refs import token_line
+from tsvio import LineSink
 
-def main() -> int:
-    if not INP.exists():
-        raise SystemExit(f"Missing {INP}")
+INP = volumes.path("index_refs.tsv")
+OUT = volumes.path("index_refs_grouped.tsv")
+
+FIELDS = ["cnt_idx","group_no","group_tokens","source_column","line_no"]
+HEADER = "\t".join(FIELDS) + "\n"
+
+_sink = LineSink()
+_w = csv.writer(_sink, delimiter="\t", lineterminator="\n")
+
+def from_tokens(records):
+    # Token records as csv.DictReader reads them back from index_refs.tsv,
+    # which is written unquoted: a field opening with '"' starts a quoted
+    # field that swallows the following lines up to the next quote. Those
+    # stretches go through csv.reader itself; their kind comes back as None.
+    it = iter(records)
+    for rec in it:
+        if not any(f[:1] == '"' for f in rec):
+            yield rec
+            continue
+
+        def lines():
+            yield token_line(rec)
+            for r in it:
+                yield token_line(r)
+
+        row = next(csv.reader(lines(), delimiter="\t"))
+        row += [None] * (5 - len(row))
+        yield (row[0], row[1], None, row[3], row[4])
+
+def read_tokens(lines):
+    for row in csv.DictReader(lines, delimiter="\t"):
+        yield (row["cnt_idx"], row["ref_token"], None, row["source_column"], row["line_no"])
+
+def group_records(records, stats):
+    # (cnt_idx, group_no, group_tokens, source_column, line_no, kinds) per
+    # ";"-separated group; kinds lines up with group_tokens.split() when
+    # every token's kind is known, else None. Values are as they read back
+    # from index_refs_grouped.tsv (None -> "").
+    stats["groups"] = 0
+    cur_idx = None
+    cur_src = None
+    cur_ln = None
+    group_no = 0
+    buf = []
+    kinds = []
 
-    rows_out = 0
-    with INP.open("r", encoding="utf-8") as f, OUT.open("w", encoding="utf-8") as g:
-        r = csv.DictReader(f, delimiter="\t")
-        fieldnames = ["cnt_idx","group_no","group_tokens","source_column","line_no"]
-        w = csv.DictWriter(g, delimiter="\t", fieldnames=fieldnames, lineterminator="\n")
-        w.writeheader()
-
-        cur_idx = None
-        cur_src = None
-        cur_ln = None
-        group_no = 0
+    def flush():
+        nonlocal buf, kinds, group_no
+        if cur_idx is None:
+            return None
+        if not buf:
+            return None
+        group_no += 1
+        g = (cur_idx, str(group_no), " ".join(buf),
+             "" if cur_src is None else cur_src, "" if cur_ln is None else cur_ln,
+             None if None in kinds else kinds)
+        stats["groups"] += 1
         buf = []
+        kinds = []
+        return g
 
-        def flush():
-            nonlocal rows_out, buf, group_no
-            if cur_idx is None:
-                return
-            if not buf:
-                return
-            group_no += 1
-            w.writerow({
-                "cnt_idx": cur_idx,
-                "group_no": str(group_no),
-                "group_tokens": " ".join(buf),
-                "source_column": cur_src,
-                "line_no": cur_ln,
-            })
-            rows_out += 1
+    for idx, tok, k, src, ln in records:
+        if cur_idx != idx:
+            # new entry: flush previous
+            g = flush()
+            if g:
+                yield g
+            cur_idx = idx
+            cur_src = src
+            cur_ln = ln
+            group_no = 0
             buf = []
+            kinds = []
 
-        for row in r:
-            idx = row["cnt_idx"]
-            tok = row["ref_token"]
-            src = row["source_column"]
-            ln  = row["line_no"]
-
-            if cur_idx != idx:
-                # new entry: flush previous
-                flush()
-                cur_idx = idx
-                cur_src = src
-                cur_ln = ln
-                group_no = 0
-                buf = []
-
-            if tok == ";":
-                flush()
-                continue
-
+        if tok == ";":
+            g = flush()
+            if g:
+                yield g
+        else:
             buf.append(tok)
+            kinds.append(k)
+
+    g = flush()
+    if g:
+        yield g
+
+def group_line(g) -> str:
+    _w.writerow(g[:5])
+    return _sink.take()
+
+def group_lines(lines, stats):
+    # lines go through csv.DictReader, exactly as when reading INP from disk
+    yield HEADER
+    for g in group_records(read_tokens(lines), stats):
+        yield group_line(g)
+
+def main() -> int:
+    if not INP.exists():
+        raise SystemExit(f"Missing {INP}")
+
+    cache = stagecache.lookup("group", [INP], [OUT])
+    if cache.hit():
+        return 0
 
-        flush()
+    prof = stageprof.start()
+    stats = {}
+    with prof.stage("group", inputs=[INP], outputs=[OUT]) as st, \
+         INP.open("r", encoding="utf-8") as f, OUT.open("w", encoding="utf-8") as g:
+        lines = group_lines(st.count_in(f, header=True), stats)
+        g.writelines(st.items(lines, key=stageprof.tsv_label(0, 1), header=True))
+        st.rows_out = stats["groups"]
+    prof.finish()
 
-    print(f"OK: wrote {OUT} with {rows_out} groups")
+    cache.done(f"OK: wrote {OUT} with {stats['groups']} groups")
     return 0
 
 if __name__ == "__main__":
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# Co-citation graph: which rows cite the same tab/entry as each row.
+#
+#   ./tools_make_cocite_index.py
+#
+# Writes index_cocite.idx (binidx, kind cnt_cocite.IDX_KIND) for
+# cnt_cocite.py: the rows in cnt_idx order with their lemma_key/lemma and
+# sorted REF / RANGE_START keys, and a CSR adjacency (nbr_off into
+# nbr/nbr_shared) holding each row's neighbours already ranked by shared-ref
+# count.
+from array import array
+
+import binidx
+import stagecache
+import stageprof
+from cnt_cocite import IDX, IDX_KIND, REFS, ROWS, load_nodes, neighbours
+
+OUT = IDX
+
+def main() -> int:
+    for p in (ROWS, REFS):
+        if not p.exists():
+            raise SystemExit(f"Missing {p}")
+
+    cache = stagecache.lookup("cocite_index", [ROWS, REFS], [OUT])
+    if cache.hit():
+        return 0
+
+    prof = stageprof.start()
+
+    with prof.stage("cocite_index.load", inputs=[ROWS, REFS]) as st:
+        rows, keys = load_nodes(ROWS, REFS)
+        st.rows_out = len(keys)
+
+    with prof.stage("cocite_index.graph") as st:
+        nbrs = neighbours(rows, keys)
+        st.rows_in = len(keys)
+        st.rows_out = sum(len(v) for v in nbrs.values())
+
+    with prof.stage("cocite_index.write", outputs=[OUT]) as st:
+        nodes = sorted(rows)
+        node_no = {c: i for i, c in enumerate(nodes)}
+
+        cnt_off = array("I", [0])
+        cnt_heap = bytearray()
+        lemma_off = array("I", [0])
+        lemma_heap = bytearray()
+        key_off = array("I", [0])
+        node_keys = array("Q")
+        nbr_off = array("I", [0])
+        nbr = array("I")
+        nbr_shared = array("I")
+        for c in nodes:
+            cnt_heap += c.encode("utf-8")
+            cnt_off.append(len(cnt_heap))
+            lemma_heap += "\x1f".join(rows[c]).encode("utf-8")
+            lemma_off.append(len(lemma_heap))
+            node_keys.extend(keys.get(c, []))
+            key_off.append(len(node_keys))
+            for n, o in nbrs.get(c, []):
+                nbr.append(node_no[o])
+                nbr_shared.append(n)
+            nbr_off.append(len(nbr))
+        lk_order = array("I", sorted(range(len(nodes)), key=lambda i: (rows[nodes[i]][0].encode("utf-8"), i)))
+
+        binidx.write(OUT, IDX_KIND, {
+            "cnt_off": cnt_off,
+            "cnt_heap": cnt_heap,
+            "lemma_off": lemma_off,
+            "lemma_heap": lemma_heap,
+            "lk_order": lk_order,
+            "key_off": key_off,
+            "keys": node_keys,
+            "nbr_off": nbr_off,
+            "nbr": nbr,
+            "nbr_shared": nbr_shared,
+        }, sources=[ROWS, REFS])
+        st.rows_in = len(nodes)
+        st.rows_out = len(nbr)
+    prof.finish()
+
+    cache.done(f"OK: wrote {OUT} with {len(keys)} citing rows / {len(nbr) // 2} co-citation edges")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
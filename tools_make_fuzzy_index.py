@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+from array import array
+
+import binidx
+import fuzzy
+import stagecache
+import stageprof
+import volumes
+
+INP = volumes.path("index_rows_keyed.tsv")
+REJECTS = volumes.path("parse_rejects_stitched.tsv")
+
+def read_keys():
+    keys = set()
+    with INP.open("r", encoding="utf-8") as f:
+        header = f.readline()
+        if header.rstrip("\n").split("\t")[:1] != ["lemma_key"]:
+            raise SystemExit(f"Unexpected header in {INP}")
+        for line in f:
+            k = line.split("\t", 1)[0]
+            if k and k != "__EMPTY__":
+                keys.add(k)
+    return sorted(keys)
+
+def main() -> int:
+    if not INP.exists():
+        raise SystemExit(f"Missing input: {INP}")
+
+    cache = stagecache.lookup("fuzzy_index", [INP, REJECTS], [fuzzy.IDX])
+    if cache.hit():
+        return 0
+
+    prof = stageprof.start()
+    with prof.stage("fuzzy.deletes", inputs=[INP]) as st:
+        keys = read_keys()
+        dels = fuzzy.build_deletes(keys)
+        st.rows_in = len(keys)
+        st.rows_out = len(dels)
+
+    # confusion costs from how rejected lines differ from their nearest key
+    confusions = [list(c) for c in fuzzy.SEED_CONFUSIONS]
+    sources = [INP]
+    if REJECTS.exists():
+        with prof.stage("fuzzy.confusions", inputs=[REJECTS]) as st:
+            index = fuzzy.SymDel(keys.__getitem__, lambda d: dels.get(d, ()),
+                                 fuzzy.confusion_table(fuzzy.SEED_CONFUSIONS))
+            with REJECTS.open("r", encoding="utf-8") as f:
+                words = fuzzy.reject_words(st.count_in(f, header=True))
+                confusions = fuzzy.learn_confusions(words, index)
+            st.rows_out = len(confusions)
+        sources.append(REJECTS)
+
+    with prof.stage("fuzzy.write", outputs=[fuzzy.IDX]) as st:
+        key_off = array("I", [0])
+        key_heap = bytearray()
+        for k in keys:
+            key_heap += k.encode("utf-8")
+            key_off.append(len(key_heap))
+
+        del_off = array("I", [0])
+        del_heap = bytearray()
+        post_off = array("I", [0])
+        post_key = array("I")
+        for d in sorted(dels, key=lambda d: d.encode("utf-8")):
+            del_heap += d.encode("utf-8")
+            del_off.append(len(del_heap))
+            post_key.extend(dels[d])
+            post_off.append(len(post_key))
+
+        binidx.write(fuzzy.IDX, fuzzy.IDX_KIND, {
+            "key_off": key_off,
+            "key_heap": key_heap,
+            "del_off": del_off,
+            "del_heap": del_heap,
+            "post_off": post_off,
+            "post_key": post_key,
+        }, sources=sources, meta={"confusions": confusions})
+        st.rows_in = len(dels)
+        st.rows_out = len(keys)
+    prof.finish()
+
+    cache.done(f"OK: wrote {fuzzy.IDX} with {len(keys)} keys, {len(dels)} deletions ({len(confusions)} confusion weights)")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
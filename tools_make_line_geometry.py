@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# Line geometry: where each OCR line of ocr_clean/ sits in its column image.
+#
+#   ./tools_make_line_geometry.py
+#
+# Aligns the non-blank lines of every ocr_clean/<column>.txt with that
+# column's text-line bands from column_lines.tsv (tools_segment_pages.py) and
+# writes index_line_geometry.tsv: source_column, line_no, y0, y1 (pixel rows
+# of columns/<column>.png, y1 exclusive). It joins onto index_rows_id.tsv on
+# (source_column, line_no).
+#
+# Line and band counts mostly agree, but a band can hold two lines whose
+# descenders and ascenders touch, OCR keeps some junk lines (clipped
+# fragments of the neighbouring column) and specks or marginal numbers make
+# extra bands. The alignment is a small edit-distance DP per column: match a
+# line to a band, split a band between two lines, or leave out a band or a
+# line (a line left out gets no geometry). A match is scored on the band's
+# height against the column's median and on its ink width against the line's
+# length in characters, which is what keeps the alignment in step.
+#
+# Standard library only; column_lines.tsv is shipped, and regenerating it
+# with tools_segment_pages.py needs numpy and Pillow.
+from collections import defaultdict
+from pathlib import Path
+import csv
+import glob
+import statistics
+
+import stagecache
+import stageprof
+import volumes
+
+SRC_DIR = volumes.path("ocr_clean")
+INP = volumes.path("column_lines.tsv")
+OUT = volumes.path("index_line_geometry.tsv")
+
+HEADER = "source_column\tline_no\ty0\ty1\n"
+
+# alignment costs, in units of "one band height off the median"
+WIDTH_TOL = 8        # ... or of this many characters of ink width off
+PAIR = 1.0
+SKIP_BAND = 0.6
+SKIP_LINE = 0.8      # lines shorter than SHORT characters cost less
+SHORT = 6
+
+def read_bands(path: Path):
+    bands = defaultdict(list)
+    with path.open("r", encoding="utf-8") as f:
+        for r in csv.DictReader(f, delimiter="\t"):
+            bands[r["source_column"]].append((int(r["y0"]), int(r["y1"]), int(r["x1"]) - int(r["x0"])))
+    return bands
+
+def align(lines, bands):
+    # {line_no: (y0, y1)} for the lines ((line_no, length) in order) that
+    # the cheapest alignment with bands ((y0, y1, ink width)) gives a band,
+    # or half of one
+    n, m = len(lines), len(bands)
+    lens = [k for _, k in lines]
+    heights = [b[1] - b[0] for b in bands]
+    med = statistics.median(heights) if heights else 1
+    # pixels of ink per character
+    cw = statistics.median(b[2] for b in bands) / max(1, statistics.median(lens)) if n and m else 1
+    cw = max(cw, 1)
+    inf = float("inf")
+    cost = [[inf] * (m + 1) for _ in range(n + 1)]
+    back = [[None] * (m + 1) for _ in range(n + 1)]
+    cost[0][0] = 0.0
+
+    def step(i, j, c, op):
+        if c < cost[i][j]:
+            cost[i][j] = c
+            back[i][j] = op
+
+    def width(w, k):
+        return abs(w - cw * k) / (cw * WIDTH_TOL)
+
+    for i in range(n + 1):
+        for j in range(m + 1):
+            c = cost[i][j]
+            if c == inf:
+                continue
+            if j < m:
+                h, w = heights[j] / med, bands[j][2]
+                if i < n:
+                    step(i + 1, j + 1, c + abs(h - 1) + width(w, lens[i]), "match")
+                if i + 1 < n:
+                    step(i + 2, j + 1, c + abs(h / 2 - 1) + width(w, max(lens[i], lens[i + 1])) + PAIR, "pair")
+                step(i, j + 1, c + SKIP_BAND, "band")
+            if i < n:
+                step(i + 1, j, c + SKIP_LINE * min(lens[i], SHORT) / SHORT, "line")
+
+    out = {}
+    i, j = n, m
+    while i or j:
+        op = back[i][j]
+        if op == "match":
+            i, j = i - 1, j - 1
+            out[lines[i][0]] = bands[j][:2]
+        elif op == "pair":
+            i, j = i - 2, j - 1
+            y0, y1 = bands[j][:2]
+            mid = (y0 + y1) // 2
+            out[lines[i][0]] = (y0, mid)
+            out[lines[i + 1][0]] = (mid, y1)
+        elif op == "band":
+            j -= 1
+        else:
+            i -= 1
+    return out
+
+def content_lines(path: Path):
+    # (line_no, length) of the non-blank lines
+    with path.open("r", encoding="utf-8", errors="replace") as f:
+        return [(ln, len(s.strip())) for ln, s in enumerate(f, start=1) if s.strip()]
+
+def geometry_lines(files, bands, stats):
+    yield HEADER
+    stats["lines"] = stats["placed"] = 0
+    for fpath in files:
+        source = Path(fpath).stem
+        lines = content_lines(Path(fpath))
+        placed = align(lines, bands.get(source, []))
+        stats["lines"] += len(lines)
+        stats["placed"] += len(placed)
+        for ln, _ in lines:
+            if ln in placed:
+                y0, y1 = placed[ln]
+                yield f"{source}\t{ln}\t{y0}\t{y1}\n"
+
+def main() -> int:
+    if not INP.exists():
+        raise SystemExit(f"Missing {INP} (run tools_segment_pages.py)")
+    files = sorted(glob.glob(str(SRC_DIR / "*.txt")))
+    if not files:
+        raise SystemExit(f"No .txt files in {SRC_DIR}/")
+
+    cache = stagecache.lookup("line_geometry", files + [INP], [OUT])
+    if cache.hit():
+        return 0
+
+    prof = stageprof.start()
+    stats = {}
+    with prof.stage("line_geometry", inputs=[SRC_DIR, INP], outputs=[OUT]) as st, \
+         OUT.open("w", encoding="utf-8") as g:
+        bands = read_bands(INP)
+        g.writelines(st.items(geometry_lines(files, bands, stats), key=stageprof.tsv_label(0, 1), header=True))
+        st.rows_in = stats["lines"]
+        st.rows_out = stats["placed"]
+    prof.finish()
+
+    cache.done(f"OK: wrote {OUT} with {stats['placed']} of {stats['lines']} lines placed")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+from array import array
+
+import binidx
+import stagecache
+import stageprof
+import volumes
+from cnt_lookup import IDX_KIND
+
+INP = volumes.path("index_rows_keyed.tsv")
+OUT = volumes.path("index_rows_keyed.idx")
+
+def main() -> int:
+    if not INP.exists():
+        raise SystemExit(f"Missing input: {INP}")
+
+    cache = stagecache.lookup("lookup_index", [INP], [OUT])
+    if cache.hit():
+        return 0
+
+    prof = stageprof.start()
+    entries = []
+    with prof.stage("lookup_index.read", inputs=[INP]) as st, INP.open("rb") as f:
+        header = f.readline()
+        if header.rstrip(b"\n").split(b"\t")[:5] != [b"lemma_key", b"lemma", b"refs_raw", b"source_column", b"line_no"]:
+            raise SystemExit(f"Unexpected header in {INP}")
+        pos = len(header)
+        for line in f:
+            parts = line.rstrip(b"\n").split(b"\t")
+            if len(parts) >= 5:
+                entries.append((parts[0], pos))
+            pos += len(line)
+        st.rows_in = st.rows_out = len(entries)
+
+    with prof.stage("lookup_index.write", outputs=[OUT]) as st:
+        # sort by key, keep file order within a key
+        entries.sort()
+
+        key_off = array("I", [0])
+        heap = bytearray()
+        row_off = array("Q")
+        for key, off in entries:
+            heap += key
+            key_off.append(len(heap))
+            row_off.append(off)
+
+        binidx.write(OUT, IDX_KIND, {"key_off": key_off, "key_heap": heap, "row_off": row_off}, sources=[INP])
+        st.rows_in = st.rows_out = len(entries)
+    prof.finish()
+
+    cache.done(f"OK: wrote {OUT} with {len(entries)} keys")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
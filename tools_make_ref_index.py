@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+from array import array
+import csv
+
+import binidx
+import stagecache
+import stageprof
+import volumes
+from cnt_reverse import IDX_KIND, REF_TYPES, ref_key
+
+ROWS = volumes.path("index_rows_id.tsv")
+REFS = volumes.path("index_refs_norm.tsv")
+OUT = volumes.path("index_refs_norm.idx")
+
+MISSING = (1 << 64) - 1
+
+def main() -> int:
+    for p in (ROWS, REFS):
+        if not p.exists():
+            raise SystemExit(f"Missing {p}")
+
+    cache = stagecache.lookup("ref_index", [ROWS, REFS], [OUT])
+    if cache.hit():
+        return 0
+
+    prof = stageprof.start()
+
+    # cnt_idx -> byte offset of its line in index_rows_id.tsv (last one wins,
+    # like cnt_reverse.load_rows)
+    row_off = {}
+    with prof.stage("ref_index.rows", inputs=[ROWS]) as st, ROWS.open("rb") as f:
+        pos = len(f.readline())
+        for line in f:
+            cnt_idx = line.split(b"\t", 1)[0].decode("utf-8")
+            if cnt_idx.strip():
+                row_off[cnt_idx] = pos
+            pos += len(line)
+        st.rows_out = len(row_off)
+
+    cnt_pos = {}
+    postings = []
+    with prof.stage("ref_index.refs", inputs=[REFS]) as st, REFS.open("r", encoding="utf-8") as f:
+        for ref in st.count_in(csv.DictReader(f, delimiter="\t")):
+            k = ref_key(ref["ref_norm"])
+            if k is None:
+                continue
+            c = cnt_pos.setdefault(ref["cnt_idx"], len(cnt_pos))
+            postings.append((k, c, ref))
+        st.rows_out = len(postings)
+
+    with prof.stage("ref_index.write", outputs=[OUT]) as st:
+        postings.sort(key=lambda x: (x[0], x[1], int(x[2]["ref_no"])))
+
+        keys = array("Q")
+        post_off = array("I")
+        post_cnt = array("I")
+        post_ref_no = array("I")
+        post_group_no = array("I")
+        post_line_no = array("I")
+        post_flags = array("B")
+        text_off = array("I", [0])
+        text_heap = bytearray()
+
+        for k, c, ref in postings:
+            if not keys or keys[-1] != k:
+                keys.append(k)
+                post_off.append(len(post_cnt))
+            post_cnt.append(c)
+            post_ref_no.append(int(ref["ref_no"]))
+            post_group_no.append(int(ref["group_no"]))
+            post_line_no.append(int(ref["line_no"]))
+            post_flags.append(REF_TYPES.index(ref["ref_type"]) | (int(ref["attach_prev"] or 0) << 4))
+            text_heap += "\x1f".join([ref["ref_norm"], ref["sigla_prefix"] or "", ref["marks"] or "", ref["source_column"]]).encode("utf-8")
+            text_off.append(len(text_heap))
+        post_off.append(len(post_cnt))
+
+        cnt_off = array("I", [0])
+        cnt_heap = bytearray()
+        cnt_row_off = array("Q")
+        for cnt_idx in cnt_pos:
+            cnt_heap += cnt_idx.encode("utf-8")
+            cnt_off.append(len(cnt_heap))
+            cnt_row_off.append(row_off.get(cnt_idx, MISSING))
+
+        binidx.write(OUT, IDX_KIND, {
+            "keys": keys,
+            "post_off": post_off,
+            "post_cnt": post_cnt,
+            "post_ref_no": post_ref_no,
+            "post_group_no": post_group_no,
+            "post_line_no": post_line_no,
+            "post_flags": post_flags,
+            "text_off": text_off,
+            "text_heap": text_heap,
+            "cnt_off": cnt_off,
+            "cnt_heap": cnt_heap,
+            "cnt_row_off": cnt_row_off,
+        }, sources=[ROWS, REFS])
+        st.rows_in = len(postings)
+        st.rows_out = len(keys)
+    prof.finish()
+
+    cache.done(f"OK: wrote {OUT} with {len(keys)} keys / {len(post_cnt)} postings")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
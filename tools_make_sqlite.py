@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+from pathlib import Path
+import csv
+import json
+import os
+import sqlite3
+
+import binidx
+import sqlitedb
+import stagecache
+import stageprof
+from cnt_reverse import ENT_MASK, ref_key
+
+def read_tsv(p: Path):
+    with p.open("r", encoding="utf-8") as f:
+        yield from csv.DictReader(f, delimiter="\t")
+
+def tab_entry(ref_norm: str):
+    # "121,52" -> (121, 52); bare "121" -> (121, None); else (None, None)
+    k = ref_key(ref_norm)
+    if k is None:
+        return None, None
+    e = k & ENT_MASK
+    return k >> 32, (e - 1 if e else None)
+
+def main() -> int:
+    for p in sqlitedb.SOURCES:
+        if not p.exists():
+            raise SystemExit(f"Missing {p}")
+
+    out = sqlitedb.DB
+    cache = stagecache.lookup("sqlite", sqlitedb.SOURCES, [out])
+    if cache.hit():
+        return 0
+
+    tmp = out.with_name(out.name + ".tmp")
+    if tmp.exists():
+        tmp.unlink()
+
+    prof = stageprof.start()
+    conn = sqlite3.connect(tmp)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.executescript(sqlitedb.SCHEMA)
+
+    # one transaction for the whole load
+    with conn:
+        with prof.stage("sqlite.rows", inputs=[sqlitedb.ROWS]) as st:
+            conn.executemany(
+                "INSERT INTO rows VALUES (?, ?, ?, ?, ?, ?)",
+                ((r["cnt_idx"], r["lemma_key"], r["lemma"], r["refs_raw"], r["source_column"], int(r["line_no"]))
+                 for r in st.count_in(read_tsv(sqlitedb.ROWS))))
+            st.rows_out = st.rows_in
+        with prof.stage("sqlite.refs", inputs=[sqlitedb.REFS]) as st:
+            conn.executemany(
+                "INSERT INTO refs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                ((r["cnt_idx"], int(r["ref_no"]), r["ref_norm"], r["ref_type"], r["sigla_prefix"], r["marks"],
+                  int(r["attach_prev"]), r["source_column"], int(r["line_no"]), int(r["group_no"]))
+                 + tab_entry(r["ref_norm"])
+                 for r in st.count_in(read_tsv(sqlitedb.REFS))))
+            st.rows_out = st.rows_in
+        with prof.stage("sqlite.groups", inputs=[sqlitedb.GROUPS]) as st:
+            conn.executemany(
+                "INSERT INTO groups VALUES (?, ?, ?, ?, ?)",
+                ((r["cnt_idx"], int(r["group_no"]), r["group_tokens"], r["source_column"], int(r["line_no"]))
+                 for r in st.count_in(read_tsv(sqlitedb.GROUPS))))
+            st.rows_out = st.rows_in
+        with prof.stage("sqlite.indexes"):
+            # one statement at a time: executescript() would commit first
+            for stmt in sqlitedb.INDEXES.split(";"):
+                if stmt.strip():
+                    conn.execute(stmt)
+        sources = binidx.source_stamps(sqlitedb.SOURCES, out.parent)
+        conn.execute("INSERT INTO meta VALUES ('sources', ?)", (json.dumps(sources, sort_keys=True),))
+
+    counts = [conn.execute(f"SELECT count(*) FROM {t}").fetchone()[0] for t in ("rows", "refs", "groups")]
+    with prof.stage("sqlite.analyze", outputs=[out]):
+        conn.execute("ANALYZE")
+        conn.close()
+        os.replace(tmp, out)
+    prof.finish()
+
+    cache.done(f"OK: wrote {out} with {counts[0]} rows, {counts[1]} refs, {counts[2]} groups")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# Tile pyramids of the tab scans the ref chips of docs/index.html link to.
+#
+#   ./tools_make_tab_tiles.py [--src docs/tabs_full] [--out docs/tabs_tiles]
+#                             [--jobs N] [--force] [--profile]
+#
+# Needs Pillow.
+#
+# For every <src>/NNN/TabNNN.jpg writes <out>/NNN/:
+#   preview.jpg       the whole tab, at most PREVIEW px a side (chip hover)
+#   <z>/<x>_<y>.jpg   TILE px tiles of level z; the top level is the scan at
+#                     full size, each level below it half the one above, and
+#                     level 0 fits in one tile
+#   tiles.json        {width, height, tile, levels: [[w, h, cols, rows], ...]
+#                     from level 0 up, source_sha256, params}
+# The page shows the preview on hover and the levels in its viewer, so a tile
+# is only fetched once the viewer scrolls to it at that zoom.
+#
+# A tab whose tiles.json records the scan's sha256 and the current params is
+# skipped; the rest are tiled in a process pool, each into a temporary
+# directory that then replaces NNN/ whole. Output directories of scans that
+# are gone are removed.
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import json
+import math
+import os
+import shutil
+import sys
+
+import stageprof
+import volumes
+from cnt_batch import arg, jobs_arg
+from manifests import file_sha256
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+SRC_DIR = volumes.path("docs") / "tabs_full"
+OUT_DIR = volumes.path("docs") / "tabs_tiles"
+META = "tiles.json"
+PREVIEW_NAME = "preview.jpg"
+
+TILE = 256
+PREVIEW = 360
+QUALITY = 82
+
+def params() -> dict:
+    return {"tile": TILE, "preview": PREVIEW, "quality": QUALITY}
+
+def up_to_date(dst: Path, digest: str) -> bool:
+    try:
+        with (dst / META).open("r", encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return meta.get("source_sha256") == digest and meta.get("params") == params()
+
+def save_jpeg(img, path: Path) -> None:
+    img.save(path, "JPEG", quality=QUALITY, optimize=True)
+
+def tile_tab(job):
+    # (tab, tiles written) for one scan
+    src, dst, digest = job
+    img = Image.open(src)
+    img.load()
+    if img.mode not in ("L", "RGB"):
+        img = img.convert("RGB")
+    w, h = img.size
+
+    tmp = dst.with_name(dst.name + ".tmp")
+    if tmp.exists():
+        shutil.rmtree(tmp)
+    tmp.mkdir(parents=True)
+
+    top = max(0, math.ceil(math.log2(max(w, h) / TILE)))
+    levels = []
+    tiles = 0
+    level = img
+    for z in range(top, -1, -1):
+        lw, lh = level.size
+        cols, rows = -(-lw // TILE), -(-lh // TILE)
+        d = tmp / str(z)
+        d.mkdir()
+        for y in range(rows):
+            for x in range(cols):
+                box = (x * TILE, y * TILE, min(lw, (x + 1) * TILE), min(lh, (y + 1) * TILE))
+                save_jpeg(level.crop(box), d / f"{x}_{y}.jpg")
+        tiles += cols * rows
+        levels.append([lw, lh, cols, rows])
+        if z:
+            level = level.reduce(2)
+    levels.reverse()
+
+    preview = img.copy()
+    preview.thumbnail((PREVIEW, PREVIEW), Image.LANCZOS)
+    save_jpeg(preview, tmp / PREVIEW_NAME)
+
+    with (tmp / META).open("w", encoding="utf-8") as g:
+        json.dump({"width": w, "height": h, "tile": TILE, "levels": levels,
+                   "source_sha256": digest, "params": params()}, g)
+    if dst.exists():
+        shutil.rmtree(dst)
+    os.replace(tmp, dst)
+    return dst.name, tiles
+
+def main() -> int:
+    argv = sys.argv[1:]
+    if Image is None:
+        raise SystemExit("tools_make_tab_tiles.py needs Pillow (pip install pillow)")
+    jobs = jobs_arg(argv)
+    src_dir = Path(arg(argv, "--src", str(SRC_DIR)))
+    out_dir = Path(arg(argv, "--out", str(OUT_DIR)))
+    force = "--force" in argv
+
+    scans = sorted(src_dir.glob("*/Tab*.jpg"))
+    if not scans:
+        raise SystemExit(f"No */Tab*.jpg scans in {src_dir}/")
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    prof = stageprof.start()
+    with prof.stage("tab_tiles.hash", inputs=[src_dir]) as st:
+        todo = []
+        for src in st.count_in(scans):
+            dst = out_dir / src.parent.name
+            digest = file_sha256(src)
+            if force or not up_to_date(dst, digest):
+                todo.append((src, dst, digest))
+        st.rows_out = len(todo)
+
+    with prof.stage("tab_tiles", outputs=[out_dir]) as st:
+        if jobs == 1 or len(todo) < 2:
+            results = list(st.items(map(tile_tab, todo), key=lambda r: r[0]))
+        else:
+            with ProcessPoolExecutor(max_workers=jobs) as ex:
+                results = list(st.items(ex.map(tile_tab, todo), key=lambda r: r[0]))
+        st.rows_in = len(todo)
+        st.rows_out = sum(n for _, n in results)
+
+        keep = {src.parent.name for src in scans}
+        removed = 0
+        for d in sorted(out_dir.iterdir()):
+            if d.is_dir() and d.name not in keep and ((d / META).exists() or d.name.endswith(".tmp")):
+                shutil.rmtree(d)
+                removed += 1
+    prof.finish()
+
+    print(f"OK: wrote {out_dir} with {len(scans)} tabs ({len(results)} tiled, "
+          f"{sum(n for _, n in results)} tiles, {removed} removed)")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,50 +1,281 @@
 #!/usr/bin/env python3
-from pathlib import Path
-import csv, json
+# Web data for docs/index.html.
+#
+#   ./tools_make_web_json.py [--legacy]
+#
+# Rows are sorted by (lemma_key, cnt_idx) and cut into shards of contiguous
+# lemma_key ranges under docs/data/, listed in docs/data/manifest.json with
+# their first/last key, so the page only fetches the shards a prefix can hit.
+# Each shard is columnar (parallel arrays); refs are packed per row through
+# ref_off, with tab/entry as integers wherever ref_norm is a plain "tab,ent".
+# Search side files, fetched lazily by the page and addressed by a row's
+# position in the sorted order (shard "start" + index in the shard):
+#   trigrams.json  lemma_key trigram -> delta-encoded row positions
+#   reverse.json   (tab, ent, pos) triples sorted for binary search
+# --legacy also writes the old monolithic docs/data_index.json and
+# docs/data_refs.json. Rows and refs come from index_corpus.idx when it is
+# current (same records, without parsing the TSVs).
+import csv, json, re, sys
 
-ROWS = Path("index_rows_id.tsv")
-REFS = Path("index_refs_norm.tsv")
+import cntpack
+import stagecache
+import stageprof
+import volumes
 
-OUTDIR = Path("docs")
-OUTDIR.mkdir(exist_ok=True)
+ROWS = volumes.path("index_rows_id.tsv")
+REFS = volumes.path("index_refs_norm.tsv")
 
-def main():
-    # index rows
+OUTDIR = volumes.path("docs")
+DATADIR = OUTDIR / "data"
+MANIFEST = DATADIR / "manifest.json"
+TRIGRAMS = DATADIR / "trigrams.json"
+REVERSE = DATADIR / "reverse.json"
+
+SHARD_ROWS = 600
+REF_TYPES = ["REF", "RANGE_START", "SIGLA_ONLY", "OTHER"]
+
+def web_rows(lines):
     rows = []
-    with ROWS.open("r", encoding="utf-8") as f:
-        r = csv.DictReader(f, delimiter="\t")
-        for row in r:
-            rows.append({
-                "cnt_idx": row["cnt_idx"],
-                "lemma_key": row["lemma_key"],
-                "lemma": row["lemma"],
-                "refs_raw": row["refs_raw"],
-                "src": row["source_column"],
-                "line": int(row["line_no"]),
-            })
+    r = csv.DictReader(lines, delimiter="\t")
+    for row in r:
+        rows.append({
+            "cnt_idx": row["cnt_idx"],
+            "lemma_key": row["lemma_key"],
+            "lemma": row["lemma"],
+            "refs_raw": row["refs_raw"],
+            "src": row["source_column"],
+            "line": int(row["line_no"]),
+        })
+    return rows
 
-    # refs
+def web_refs(lines):
+    return web_ref_rows(csv.DictReader(lines, delimiter="\t"))
+
+def web_ref_rows(rows):
+    # rows: dicts as read from index_refs_norm.tsv
     refs = []
-    with REFS.open("r", encoding="utf-8") as f:
-        r = csv.DictReader(f, delimiter="\t")
-        for x in r:
+    for x in rows:
+        refs.append({
+            "cnt_idx": x["cnt_idx"],
+            "ref_no": int(x["ref_no"]),
+            "ref_norm": x["ref_norm"],
+            "ref_type": x["ref_type"],
+            "sigla": x.get("sigla_prefix","").strip(),
+            "marks": x.get("marks","").strip(),
+            "attach_prev": int(x.get("attach_prev","0")),
+            "src": x["source_column"],
+            "line": int(x["line_no"]),
+            "group_no": int(x["group_no"]),
+        })
+    return refs
+
+def web_pack(corpus):
+    # (web_rows, web_refs) of the packed corpus, in TSV order
+    rows, refs = [], []
+    for i in range(corpus.n_rows):
+        cnt_idx, src, line = corpus.cnt_idx(i), corpus.source_column(i), corpus.row_line[i]
+        rows.append({
+            "cnt_idx": cnt_idx,
+            "lemma_key": corpus.lemma_key(i),
+            "lemma": corpus.lemma(i),
+            "refs_raw": corpus.refs_raw(i),
+            "src": src,
+            "line": line,
+        })
+        for j in corpus.refs_of(i):
             refs.append({
-                "cnt_idx": x["cnt_idx"],
-                "ref_no": int(x["ref_no"]),
-                "ref_norm": x["ref_norm"],
-                "ref_type": x["ref_type"],
-                "sigla": x.get("sigla_prefix","").strip(),
-                "marks": x.get("marks","").strip(),
-                "attach_prev": int(x.get("attach_prev","0")),
-                "src": x["source_column"],
-                "line": int(x["line_no"]),
-                "group_no": int(x["group_no"]),
+                "cnt_idx": cnt_idx,
+                "ref_no": corpus.ref_no[j],
+                "ref_norm": corpus.ref_norm(j),
+                "ref_type": corpus.ref_type(j),
+                "sigla": corpus.sigla[corpus.ref_sigla[j]].strip(),
+                "marks": corpus.marks[corpus.ref_marks[j]].strip(),
+                "attach_prev": corpus.ref_flags[j] >> 4,
+                "src": src,
+                "line": line,
+                "group_no": corpus.ref_group[j],
             })
+    return rows, refs
+
+def cnt_no(cnt_idx: str):
+    # "CNT-IDX-0000042" -> 42; anything else is kept as the string
+    m = re.fullmatch(r"CNT-IDX-(\d{7})", cnt_idx)
+    return int(m.group(1)) if m else cnt_idx
+
+def sort_key(row):
+    n = cnt_no(row["cnt_idx"])
+    return (row["lemma_key"], 0, n, "") if isinstance(n, int) else (row["lemma_key"], 1, 0, n)
+
+def split_shards(rows, depth=1):
+    # Group sorted rows by key prefix, splitting groups that are too large on
+    # a longer prefix, then merge neighbouring small groups up to SHARD_ROWS.
+    groups = []
+    i = 0
+    while i < len(rows):
+        p = rows[i]["lemma_key"][:depth]
+        j = i
+        while j < len(rows) and rows[j]["lemma_key"][:depth] == p:
+            j += 1
+        g = rows[i:j]
+        if len(g) > SHARD_ROWS and any(len(r["lemma_key"]) > depth for r in g):
+            groups.extend(split_shards(g, depth + 1))
+        else:
+            groups.append(g)
+        i = j
+
+    merged = []
+    for g in groups:
+        if merged and len(merged[-1]) + len(g) <= SHARD_ROWS:
+            merged[-1] = merged[-1] + g
+        else:
+            merged.append(g)
+    return merged
+
+def pack_ref(x):
+    m = re.fullmatch(r"(\d+),(\d+)", x["ref_norm"])
+    if m and f"{int(m.group(1))},{int(m.group(2))}" == x["ref_norm"]:
+        return int(m.group(1)), int(m.group(2)), ""
+    return -1, -1, x["ref_norm"]
+
+def shard_columns(rows, by_cnt, sources):
+    cols = {k: [] for k in ("cnt", "key", "lemma", "raw", "src", "line", "ref_off")}
+    refc = {k: [] for k in ("tab", "ent", "text", "type", "sigla", "marks", "group")}
+    for row in rows:
+        cols["cnt"].append(cnt_no(row["cnt_idx"]))
+        cols["key"].append(row["lemma_key"])
+        cols["lemma"].append(row["lemma"])
+        cols["raw"].append(row["refs_raw"])
+        cols["src"].append(sources[row["src"]])
+        cols["line"].append(row["line"])
+        cols["ref_off"].append(len(refc["tab"]))
+        for x in by_cnt.get(row["cnt_idx"], []):
+            tab, ent, text = pack_ref(x)
+            refc["tab"].append(tab)
+            refc["ent"].append(ent)
+            refc["text"].append(text)
+            # low bits: index into REF_TYPES; bit 2: attach_prev
+            refc["type"].append(REF_TYPES.index(x["ref_type"]) | (x["attach_prev"] << 2))
+            refc["sigla"].append(x["sigla"])
+            refc["marks"].append(x["marks"])
+            refc["group"].append(x["group_no"])
+    cols["ref_off"].append(len(refc["tab"]))
+    cols.update({"ref_" + k: v for k, v in refc.items()})
+    return cols
+
+def trigram_table(keys):
+    grams = {}
+    for pos, key in enumerate(keys):
+        for g in {key[i:i + 3] for i in range(len(key) - 2)}:
+            grams.setdefault(g, []).append(pos)
+    out = {}
+    for g in sorted(grams):
+        ps = grams[g]
+        out[g] = [ps[0]] + [b - a for a, b in zip(ps, ps[1:])]
+    return out
+
+def reverse_table(rows, by_cnt):
+    triples = set()
+    for pos, row in enumerate(rows):
+        for x in by_cnt.get(row["cnt_idx"], []):
+            m = re.fullmatch(r"(\d+),(\d+)", x["ref_norm"])
+            if m:
+                triples.add((int(m.group(1)), int(m.group(2)), pos))
+    triples = sorted(triples)
+    return {
+        "tab": [t for t, _, _ in triples],
+        "ent": [e for _, e, _ in triples],
+        "pos": [p for _, _, p in triples],
+    }
+
+def dump(obj) -> str:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+def write_shards(rows, refs):
+    by_cnt = {}
+    for x in refs:
+        by_cnt.setdefault(x["cnt_idx"], []).append(x)
+    for xs in by_cnt.values():
+        xs.sort(key=lambda x: x["ref_no"])
+
+    source_list = sorted({r["src"] for r in rows})
+    sources = {s: i for i, s in enumerate(source_list)}
+
+    ordered = sorted(rows, key=sort_key)
+    shards = split_shards(ordered)
+    DATADIR.mkdir(parents=True, exist_ok=True)
+    names = []
+    listing = []
+    start = 0
+    for i, g in enumerate(shards):
+        name = f"shard-{i:03d}.json"
+        (DATADIR / name).write_text(dump(shard_columns(g, by_cnt, sources)), encoding="utf-8")
+        names.append(name)
+        listing.append({"file": name, "lo": g[0]["lemma_key"], "hi": g[-1]["lemma_key"], "start": start, "rows": len(g)})
+        start += len(g)
+
+    TRIGRAMS.write_text(dump(trigram_table([r["lemma_key"] for r in ordered])), encoding="utf-8")
+    REVERSE.write_text(dump(reverse_table(ordered, by_cnt)), encoding="utf-8")
+
+    manifest = {
+        "version": 1,
+        "rows": len(rows),
+        "refs": len(refs),
+        "ref_types": REF_TYPES,
+        "sources": source_list,
+        "shards": listing,
+        "trigrams": TRIGRAMS.name,
+        "reverse": REVERSE.name,
+    }
+    MANIFEST.write_text(dump(manifest), encoding="utf-8")
+
+    # shards left over from a build that cut the rows differently
+    for p in DATADIR.glob("shard-*.json"):
+        if p.name not in names:
+            p.unlink()
+    return len(shards)
+
+def write_web(rows, refs, legacy=False):
+    OUTDIR.mkdir(exist_ok=True)
+    n = write_shards(rows, refs)
+    if legacy:
+        (OUTDIR / "data_index.json").write_text(json.dumps(rows, ensure_ascii=False), encoding="utf-8")
+        (OUTDIR / "data_refs.json").write_text(json.dumps(refs, ensure_ascii=False), encoding="utf-8")
+    return n
+
+def main():
+    legacy = "--legacy" in sys.argv[1:]
+    legacy_out = [OUTDIR / "data_index.json", OUTDIR / "data_refs.json"] if legacy else []
+    cache = stagecache.lookup("web_json", [ROWS, REFS], [DATADIR] + legacy_out, args=[f"legacy={legacy}"])
+    if cache.hit():
+        return
+
+    prof = stageprof.start()
+
+    with prof.stage("web_json", inputs=[ROWS, REFS], outputs=[DATADIR]) as st:
+        corpus = cntpack.load()
+        if corpus is not None:
+            try:
+                rows, refs = web_pack(corpus)
+            finally:
+                corpus.close()
+        else:
+            # index rows
+            with ROWS.open("r", encoding="utf-8") as f:
+                rows = web_rows(f)
+
+            # refs
+            with REFS.open("r", encoding="utf-8") as f:
+                refs = web_refs(f)
 
-    (OUTDIR / "data_index.json").write_text(json.dumps(rows, ensure_ascii=False), encoding="utf-8")
-    (OUTDIR / "data_refs.json").write_text(json.dumps(refs, ensure_ascii=False), encoding="utf-8")
+        n = write_web(rows, refs, legacy)
+        st.rows_in = len(rows) + len(refs)
+        st.rows_out = len(rows)
+    prof.finish()
 
-    print("OK: wrote docs/data_index.json and docs/data_refs.json")
+    lines = [f"OK: wrote {MANIFEST} with {n} shards ({len(rows)} rows, {len(refs)} refs)"]
+    if legacy:
+        lines.append("OK: wrote docs/data_index.json and docs/data_refs.json")
+    cache.done(*lines)
 
 if __name__ == "__main__":
     main()
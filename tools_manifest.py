@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# Verify or regenerate the *.sha256 manifests.
+#
+#   ./tools_manifest.py verify [MANIFEST ...] [--jobs N] [--no-cache]
+#   ./tools_manifest.py update [MANIFEST ...] [--jobs N] [--no-cache]
+#
+# Without MANIFEST names, every *.sha256 of the data root. A per-directory
+# manifest (pages.sha256, columns.sha256, ocr_*.sha256) covers its directory:
+# files there with the same extension as its entries but not listed are
+# reported as EXTRA. The index_*.sha256 manifests only cover what they list.
+#
+# verify prints a MISSING, EXTRA or MISMATCH line per problem and exits 1 if
+# there was any. update rewrites each manifest that differs from the files:
+# digests refreshed, missing entries dropped, extra files added (directory
+# manifests stay sorted by name).
+#
+# Files are hashed in a thread pool (--jobs, default one per CPU; hashlib
+# drops the GIL while it hashes), large ones through an mmap. Digests are
+# cached in .manifest_cache.tsv by path, size and mtime, so a file that was
+# not touched since it was last hashed is not read again; --no-cache hashes
+# everything, which is what catches a file changed behind an unchanged mtime.
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import hashlib
+import mmap
+import os
+import sys
+
+import volumes
+from cnt_batch import jobs_arg
+from manifests import DIR_MANIFESTS, manifest_base, read_hash_cache, read_manifest, write_hash_cache, write_manifest
+
+CACHE = volumes.path(".manifest_cache.tsv")
+MMAP_MIN = 1 << 20
+
+def sha256(p: Path) -> str:
+    with p.open("rb") as f:
+        if os.fstat(f.fileno()).st_size < MMAP_MIN:
+            return hashlib.sha256(f.read()).hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return hashlib.sha256(mm).hexdigest()
+
+class Hasher:
+    # sha256 of many files at once, through the size/mtime cache
+    def __init__(self, jobs: int, use_cache: bool):
+        self.jobs = jobs
+        self.use_cache = use_cache
+        self.cache = read_hash_cache(CACHE) if use_cache else {}
+        self.hashed = self.cached = 0
+
+    def digests(self, paths) -> dict:
+        # path -> sha256 for the paths that exist
+        out = {}
+        todo = []
+        for p in paths:
+            try:
+                st = p.stat()
+            except OSError:
+                continue
+            hit = self.cache.get(str(p))
+            if hit and hit[0] == st.st_size and hit[1] == st.st_mtime_ns:
+                out[p] = hit[2]
+                self.cached += 1
+            else:
+                todo.append((p, st))
+        with ThreadPoolExecutor(max_workers=self.jobs) as ex:
+            for (p, st), digest in zip(todo, ex.map(lambda t: sha256(t[0]), todo)):
+                out[p] = digest
+                self.cache[str(p)] = (st.st_size, st.st_mtime_ns, digest)
+        self.hashed += len(todo)
+        return out
+
+    def save(self) -> None:
+        if self.use_cache:
+            live = {k: v for k, v in self.cache.items() if Path(k).exists()}
+            write_hash_cache(CACHE, live)
+
+def extras(manifest: Path, entries: dict):
+    # names in a directory manifest's directory that it does not list
+    if manifest.name not in DIR_MANIFESTS:
+        return []
+    base = manifest_base(manifest)
+    exts = {Path(name).suffix for name in entries}
+    if not base.is_dir():
+        return []
+    return sorted(p.name for p in base.iterdir()
+                  if p.is_file() and p.suffix in exts and p.name not in entries)
+
+def main() -> int:
+    argv = sys.argv[1:]
+    if not argv or argv[0] not in ("verify", "update"):
+        print("Usage: ./tools_manifest.py verify|update [MANIFEST ...] [--jobs N] [--no-cache]", file=sys.stderr)
+        return 2
+    cmd = argv[0]
+    jobs = jobs_arg(argv) if "--jobs" in argv else (os.cpu_count() or 1)
+    use_cache = "--no-cache" not in argv
+    names = [a for i, a in enumerate(argv[1:], start=1)
+             if not a.startswith("--") and argv[i - 1] != "--jobs"]
+
+    if names:
+        manifests = [Path(n) if Path(n).exists() else volumes.path(n) for n in names]
+        for m in manifests:
+            if not m.exists():
+                raise SystemExit(f"Missing {m}")
+    else:
+        manifests = sorted(volumes.ROOT.glob("*.sha256"))
+    if not manifests:
+        raise SystemExit(f"No *.sha256 manifests in {volumes.ROOT}/")
+
+    hasher = Hasher(jobs, use_cache)
+    plan = []
+    for m in manifests:
+        entries = read_manifest(m)
+        base = manifest_base(m)
+        extra = extras(m, entries)
+        plan.append((m, entries, base, extra))
+    # one pool run over the files of every manifest
+    digests = hasher.digests([base / name for _, entries, base, extra in plan for name in list(entries) + extra])
+    hasher.save()
+
+    missing = extra_n = mismatched = files = rewritten = 0
+    for m, entries, base, extra in plan:
+        files += len(entries)
+        new = {}
+        changed = added = dropped = 0
+        for name, want in entries.items():
+            got = digests.get(base / name)
+            if got is None:
+                missing += 1
+                dropped += 1
+                if cmd == "verify":
+                    print(f"MISSING  {m.name}: {name}")
+                continue
+            if got != want:
+                mismatched += 1
+                changed += 1
+                if cmd == "verify":
+                    print(f"MISMATCH {m.name}: {name}")
+            new[name] = got
+        for name in extra:
+            extra_n += 1
+            added += 1
+            if cmd == "verify":
+                print(f"EXTRA    {m.name}: {name}")
+            new[name] = digests[base / name]
+        if cmd == "update" and new != entries:
+            if m.name in DIR_MANIFESTS:
+                new = dict(sorted(new.items()))
+            write_manifest(m, new)
+            rewritten += 1
+            print(f"UPDATED  {m.name}: {changed} changed, {added} added, {dropped} dropped")
+
+    counts = (f"{missing} missing, {extra_n} extra, {mismatched} mismatched "
+              f"({hasher.hashed} hashed, {hasher.cached} from cache)")
+    if cmd == "update":
+        print(f"OK: {len(manifests)} manifests, {files} entries, {rewritten} rewritten: {counts}")
+        return 0
+    print(f"{'OK' if not (missing or extra_n or mismatched) else 'FAIL'}: "
+          f"{len(manifests)} manifests, {files} entries: {counts}")
+    return 1 if missing or extra_n or mismatched else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
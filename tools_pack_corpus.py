@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# Packs index_rows_id.tsv and index_refs_norm.tsv into index_corpus.idx, the
+# binary corpus cntpack.py reads (layout there).
+#
+#   ./tools_pack_corpus.py
+#
+# The pack holds everything the two TSVs do, so the query tools and
+# tools_make_web_json.py read it instead of parsing them whenever it is
+# current. It needs the TSVs as tools_add_cnt_idx.py / tools_normalize_refs.py
+# write them: cnt_idx ascending and of one prefix and width, each row's refs
+# together in ref_no order and on the row's source_column and line_no; it
+# stops on anything else rather than pack it wrong. index_rows_keyed.tsv is
+# checked against the rows too and the result kept in the meta ("keyed",
+# with the file's stamp in "keyed_source"), so cnt_lookup.py only answers
+# from the pack while the two agree.
+from array import array
+import csv
+import re
+
+import binidx
+import stagecache
+import stageprof
+import volumes
+from cnt_reverse import REF_TYPES, ref_key, unpack
+from cntpack import NO_KEY, PACK, PACK_KIND
+
+ROWS = volumes.path("index_rows_id.tsv")
+REFS = volumes.path("index_refs_norm.tsv")
+KEYED = volumes.path("index_rows_keyed.tsv")
+
+RE_CNT = re.compile(r"^(.*?)(\d+)$")
+
+class Heap:
+    # offsets + bytes of a string section
+    def __init__(self):
+        self.off = array("I", [0])
+        self.heap = bytearray()
+
+    def add(self, s: str) -> None:
+        self.heap += s.encode("utf-8")
+        self.off.append(len(self.heap))
+
+    def get(self, i: int) -> str:
+        return self.heap[self.off[i]:self.off[i + 1]].decode("utf-8")
+
+class Dict:
+    # small dictionary of repeated strings: value -> index, in first-seen order
+    def __init__(self):
+        self.ids = {}
+        self.values = []
+
+    def id(self, s: str) -> int:
+        i = self.ids.get(s)
+        if i is None:
+            i = self.ids[s] = len(self.values)
+            self.values.append(s)
+        return i
+
+    def heap(self) -> Heap:
+        h = Heap()
+        for s in self.values:
+            h.add(s)
+        return h
+
+def main() -> int:
+    for p in (ROWS, REFS, KEYED):
+        if not p.exists():
+            raise SystemExit(f"Missing {p}")
+
+    cache = stagecache.lookup("pack_corpus", [ROWS, REFS, KEYED], [PACK])
+    if cache.hit():
+        return 0
+
+    prof = stageprof.start()
+
+    cols, sigla, marks = Dict(), Dict(), Dict()
+    row_cnt, row_col, row_line = array("I"), array("H"), array("I")
+    lemma, key, raw = Heap(), Heap(), Heap()
+    row_pos = {}
+    prefix = width = None
+    with prof.stage("pack_corpus.rows", inputs=[ROWS]) as st, ROWS.open("r", encoding="utf-8") as f:
+        for r in st.count_in(csv.DictReader(f, delimiter="\t")):
+            m = RE_CNT.match(r["cnt_idx"])
+            if m is None:
+                raise SystemExit(f"{ROWS.name}: cnt_idx {r['cnt_idx']!r} does not end in a number")
+            if prefix is None:
+                prefix, width = m.group(1), len(m.group(2))
+            n = int(m.group(2))
+            if (m.group(1), len(m.group(2))) != (prefix, width) or (row_cnt and n <= row_cnt[-1]):
+                raise SystemExit(f"{ROWS.name}: cnt_idx {r['cnt_idx']} out of order or not {prefix}{'N' * width}")
+            row_pos[r["cnt_idx"]] = len(row_cnt)
+            row_cnt.append(n)
+            row_col.append(cols.id(r["source_column"]))
+            row_line.append(int(r["line_no"]))
+            lemma.add(r["lemma"])
+            key.add(r["lemma_key"])
+            raw.add(r["refs_raw"])
+        st.rows_out = len(row_cnt)
+
+    row_ref_off = array("I")
+    ref_keys, ref_no, ref_group = array("Q"), array("H"), array("H")
+    ref_flags, ref_sigla, ref_marks = array("B"), array("H"), array("H")
+    ref_text = Heap()
+    with prof.stage("pack_corpus.refs", inputs=[REFS]) as st, REFS.open("r", encoding="utf-8") as f:
+        cur = -1
+        for ref in st.count_in(csv.DictReader(f, delimiter="\t")):
+            i = row_pos.get(ref["cnt_idx"])
+            if i is None:
+                raise SystemExit(f"{REFS.name}: ref {ref['cnt_idx']} #{ref['ref_no']} has no row in {ROWS.name}")
+            if i < cur or (i == cur and int(ref["ref_no"]) <= ref_no[-1]):
+                raise SystemExit(f"{REFS.name}: ref {ref['cnt_idx']} #{ref['ref_no']} out of order")
+            if (ref["source_column"], int(ref["line_no"])) != (cols.values[row_col[i]], row_line[i]):
+                raise SystemExit(f"{REFS.name}: ref {ref['cnt_idx']} #{ref['ref_no']} is not on its row's line")
+            while cur < i:
+                row_ref_off.append(len(ref_keys))
+                cur += 1
+            k = ref_key(ref["ref_norm"])
+            ref_text.add(ref["ref_norm"] if k is None or unpack(k) != ref["ref_norm"] else "")
+            ref_keys.append(NO_KEY if k is None else k)
+            ref_no.append(int(ref["ref_no"]))
+            ref_group.append(int(ref["group_no"]))
+            ref_flags.append(REF_TYPES.index(ref["ref_type"]) | (int(ref["attach_prev"] or 0) << 4))
+            ref_sigla.append(sigla.id(ref["sigla_prefix"]))
+            ref_marks.append(marks.id(ref["marks"]))
+        while len(row_ref_off) <= len(row_cnt):
+            row_ref_off.append(len(ref_keys))
+        st.rows_out = len(ref_keys)
+
+    # cnt_lookup.py reads index_rows_keyed.tsv: the pack can answer for it
+    # when its rows are these rows (tools_add_cnt_idx.py only numbers them)
+    keys = [bytes(key.heap[key.off[i]:key.off[i + 1]]) for i in range(len(row_cnt))]
+    with prof.stage("pack_corpus.keyed", inputs=[KEYED]) as st, KEYED.open("r", encoding="utf-8") as f:
+        f.readline()
+        keyed = [parts[:5] for parts in (line.rstrip("\n").split("\t") for line in st.count_in(f))
+                 if len(parts) >= 5]
+        same = len(keyed) == len(row_cnt) and all(
+            parts == [keys[i].decode("utf-8"), lemma.get(i), raw.get(i), cols.values[row_col[i]], str(row_line[i])]
+            for i, parts in enumerate(keyed))
+        st.rows_out = len(keyed)
+
+    with prof.stage("pack_corpus.write", outputs=[PACK]) as st:
+        key_order = array("I", sorted(range(len(row_cnt)), key=lambda i: (keys[i], i)))
+        ref_order = array("I", sorted(range(len(ref_keys)), key=lambda j: (ref_keys[j], j)))
+        sections = {
+            "row_cnt": row_cnt,
+            "row_col": row_col,
+            "row_line": row_line,
+            "lemma_off": lemma.off,
+            "lemma_heap": lemma.heap,
+            "key_off": key.off,
+            "key_heap": key.heap,
+            "raw_off": raw.off,
+            "raw_heap": raw.heap,
+            "row_ref_off": row_ref_off,
+            "key_order": key_order,
+            "ref_key": ref_keys,
+            "ref_order": ref_order,
+            "ref_text_off": ref_text.off,
+            "ref_text_heap": ref_text.heap,
+            "ref_no": ref_no,
+            "ref_group": ref_group,
+            "ref_flags": ref_flags,
+            "ref_sigla": ref_sigla,
+            "ref_marks": ref_marks,
+        }
+        for name, d in (("col", cols), ("sigla", sigla), ("marks", marks)):
+            h = d.heap()
+            sections[name + "_off"] = h.off
+            sections[name + "_heap"] = h.heap
+        # KEYED is stamped apart from the sources: only cnt_lookup.py reads
+        # it, so a change there must not make the pack stale for the rest
+        binidx.write(PACK, PACK_KIND, sections, sources=[ROWS, REFS],
+                     meta={"cnt_prefix": prefix or "", "cnt_width": width or 0, "keyed": same,
+                           "keyed_source": binidx.source_stamps([KEYED], PACK.parent)})
+        st.rows_in = len(row_cnt) + len(ref_keys)
+        st.rows_out = len(row_cnt)
+    prof.finish()
+
+    cache.done(f"OK: wrote {PACK} with {len(row_cnt)} rows / {len(ref_keys)} refs "
+               f"({PACK.stat().st_size // 1024} KiB)")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
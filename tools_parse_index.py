@@ -2,11 +2,18 @@
 import glob
 import os
 import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
-SRC_DIR = Path("ocr_clean")
-OUT_ROWS = Path("index_rows.tsv")
-OUT_REJ = Path("parse_rejects.tsv")
+import stagecache
+import stageprof
+import volumes
+from cnt_batch import jobs_arg
+
+SRC_DIR = volumes.path("ocr_clean")
+OUT_ROWS = volumes.path("index_rows.tsv")
+OUT_REJ = volumes.path("parse_rejects.tsv")
 
 # Match: lemma + whitespace + refs starting with a digit
 # Lemma allows Latin letters incl. ligatures and common punctuation.
@@ -20,45 +27,74 @@ HEADER_RE = re.compile(r"^(?:[A-Z]\.|[IVXLCDM]+\.)$")
 def norm_space(s: str) -> str:
     return re.sub(r"\s+", " ", s.strip())
 
+def parse_file(fpath):
+    # One column -> (row lines, reject lines); columns are independent here.
+    source = Path(fpath).stem  # p001-c01
+    rows = []
+    rejects = []
+    with open(fpath, "r", encoding="utf-8", errors="replace") as f:
+        for i, line in enumerate(f, start=1):
+            raw = line.rstrip("\n")
+            s = raw.strip()
+
+            if not s:
+                continue
+            if HEADER_RE.match(s):
+                continue
+            # Skip obvious non-entry banners if they appear
+            if s.upper().startswith(("INDEX", "ALPHABET", "ALPHABETIC", "TIRON", "TIRONIAN")):
+                continue
+
+            m = ENTRY_RE.match(s)
+            if m:
+                lemma = norm_space(m.group(1))
+                refs = norm_space(m.group(2))
+                rows.append(f"{lemma}\t{refs}\t{source}\t{i}\n")
+            else:
+                rejects.append(f"{source}\t{i}\tNO_MATCH\t{s}\n")
+    return rows, rejects
+
 def main() -> int:
     files = sorted(glob.glob(str(SRC_DIR / "*.txt")))
     if not files:
         raise SystemExit(f"No files found in {SRC_DIR}/")
 
+    jobs = jobs_arg(sys.argv[1:])
+    cache = stagecache.lookup("parse", files, [OUT_ROWS, OUT_REJ])
+    if cache.hit():
+        return 0
+
     rows = 0
     rej = 0
+    prof = stageprof.start()
+    # slowest-item labels, consumed in step with the results
+    names = (Path(p).stem for p in files)
 
-    with OUT_ROWS.open("w", encoding="utf-8") as fw, OUT_REJ.open("w", encoding="utf-8") as fr:
+    with prof.stage("parse", inputs=files, outputs=[OUT_ROWS, OUT_REJ]) as st, \
+         OUT_ROWS.open("w", encoding="utf-8") as fw, OUT_REJ.open("w", encoding="utf-8") as fr:
         fw.write("lemma\trefs_raw\tsource_column\tline_no\n")
         fr.write("source_column\tline_no\treason\tline\n")
 
-        for fpath in files:
-            source = Path(fpath).stem  # p001-c01
-            with open(fpath, "r", encoding="utf-8", errors="replace") as f:
-                for i, line in enumerate(f, start=1):
-                    raw = line.rstrip("\n")
-                    s = raw.strip()
-
-                    if not s:
-                        continue
-                    if HEADER_RE.match(s):
-                        continue
-                    # Skip obvious non-entry banners if they appear
-                    if s.upper().startswith(("INDEX", "ALPHABET", "ALPHABETIC", "TIRON", "TIRONIAN")):
-                        continue
-
-                    m = ENTRY_RE.match(s)
-                    if m:
-                        lemma = norm_space(m.group(1))
-                        refs = norm_space(m.group(2))
-                        fw.write(f"{lemma}\t{refs}\t{source}\t{i}\n")
-                        rows += 1
-                    else:
-                        fr.write(f"{source}\t{i}\tNO_MATCH\t{s}\n")
-                        rej += 1
-
-    print(f"OK: wrote {OUT_ROWS} with {rows} rows")
-    print(f"OK: wrote {OUT_REJ} with {rej} rejects")
+        def write_all(results):
+            nonlocal rows, rej
+            # results come back in file order, so the merge is concatenation
+            for col_rows, col_rejects in st.items(results, key=lambda _: next(names)):
+                fw.writelines(col_rows)
+                fr.writelines(col_rejects)
+                rows += len(col_rows)
+                rej += len(col_rejects)
+
+        if jobs == 1:
+            write_all(map(parse_file, files))
+        else:
+            with ProcessPoolExecutor(max_workers=jobs) as ex:
+                write_all(ex.map(parse_file, files, chunksize=max(1, len(files) // (jobs * 8))))
+        st.rows_in = len(files)
+        st.rows_out = rows
+    prof.finish()
+
+    cache.done(f"OK: wrote {OUT_ROWS} with {rows} rows",
+               f"OK: wrote {OUT_REJ} with {rej} rejects")
     return 0
 
 if __name__ == "__main__":
@@ -1,11 +1,22 @@
 #!/usr/bin/env python3
 import glob
 import re
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
-SRC_DIR = Path("ocr_clean")
-OUT_ROWS = Path("index_rows_stitched.tsv")
-OUT_REJ = Path("parse_rejects_stitched.tsv")
+import stagecache
+import stageprof
+import volumes
+from cnt_batch import jobs_arg
+
+SRC_DIR = volumes.path("ocr_clean")
+OUT_ROWS = volumes.path("index_rows_stitched.tsv")
+OUT_REJ = volumes.path("parse_rejects_stitched.tsv")
+
+ROW_HEADER = "lemma\trefs_raw\tsource_column\tline_no\n"
+REJ_HEADER = "source_column\tline_no\treason\tline\n"
 
 ENTRY_RE = re.compile(r"^([A-Za-zÆŒæœ][A-Za-zÆŒæœ'’\-\.\(\) ]*?)\s+(\d.*)$")
 HEADER_RE = re.compile(r"^(?:[A-Z]\.|[IVXLCDM]+\.)$")
@@ -20,67 +31,200 @@ def is_lemma_tail(line: str) -> bool:
     # Small tail fragments like "bacue" or broken endings. Conservative.
     return bool(re.match(r"^[A-Za-zÆŒæœ]{2,12}$", line))
 
-def main() -> int:
-    files = sorted(glob.glob(str(SRC_DIR / "*.txt")))
-    if not files:
-        raise SystemExit(f"No files found in {SRC_DIR}/")
+class Row:
+    # One index entry. Mutable: lines after it can still stitch onto it
+    # until the next entry starts.
+    __slots__ = ("lemma", "refs", "source", "line_no")
 
-    rows = []
-    rejects = []
+    def __init__(self, lemma: str, refs: str, source: str, line_no: int):
+        self.lemma = lemma
+        self.refs = refs
+        self.source = source
+        self.line_no = line_no
 
-    # Track last accepted row for stitching
-    last = None  # dict with lemma/refs/source/line_no
+    def copy(self) -> "Row":
+        return Row(self.lemma, self.refs, self.source, self.line_no)
 
+def read_columns(files):
     for fpath in files:
-        source = Path(fpath).stem
         with open(fpath, "r", encoding="utf-8", errors="replace") as f:
-            for ln, raw in enumerate(f, start=1):
-                s = raw.strip()
-                if not s:
-                    continue
-                if HEADER_RE.match(s):
-                    continue
-                if s.upper().startswith(("INDEX", "ALPHABET", "ALPHABETIC", "TIRON", "TIRONIAN")):
-                    continue
-
-                # Clean mid-line pipes that survived
-                s = norm_space(s.replace("|", " "))
-
-                m = ENTRY_RE.match(s)
-                if m:
-                    last = {
-                        "lemma": norm_space(m.group(1)),
-                        "refs":  norm_space(m.group(2)),
-                        "source": source,
-                        "line_no": ln,
-                    }
-                    rows.append(last)
-                    continue
-
-                # Stitch refs-only lines onto previous row
-                if last and is_refs_only(s):
-                    last["refs"] = norm_space(last["refs"] + " " + s)
-                    continue
-
-                # Stitch lemma tail fragments (rare, conservative)
-                if last and is_lemma_tail(s):
-                    last["lemma"] = norm_space(last["lemma"] + s)
-                    continue
-
-                rejects.append((source, ln, "NO_MATCH", s))
-
-    with OUT_ROWS.open("w", encoding="utf-8") as fw:
-        fw.write("lemma\trefs_raw\tsource_column\tline_no\n")
-        for r in rows:
-            fw.write(f"{r['lemma']}\t{r['refs']}\t{r['source']}\t{r['line_no']}\n")
-
-    with OUT_REJ.open("w", encoding="utf-8") as fr:
-        fr.write("source_column\tline_no\treason\tline\n")
-        for source, ln, reason, s in rejects:
-            fr.write(f"{source}\t{ln}\t{reason}\t{s}\n")
-
-    print(f"OK: wrote {OUT_ROWS} with {len(rows)} rows")
-    print(f"OK: wrote {OUT_REJ} with {len(rejects)} rejects")
+            yield Path(fpath).stem, f
+
+def content_lines(lines):
+    # (line_no, text) for the lines that are neither blank nor headers/banners
+    for ln, raw in enumerate(lines, start=1):
+        s = raw.strip()
+        if not s:
+            continue
+        if HEADER_RE.match(s):
+            continue
+        if s.upper().startswith(("INDEX", "ALPHABET", "ALPHABETIC", "TIRON", "TIRONIAN")):
+            continue
+
+        # Clean mid-line pipes that survived
+        yield ln, norm_space(s.replace("|", " "))
+
+def stitch_line(last, source, ln, s, reject) -> None:
+    # A line that is not an entry: stitch it onto `last` or reject it
+    if last is not None and is_refs_only(s):
+        # refs-only continuation line
+        last.refs = norm_space(last.refs + " " + s)
+    elif last is not None and is_lemma_tail(s):
+        # lemma tail fragment (rare, conservative)
+        last.lemma = norm_space(last.lemma + s)
+    else:
+        reject((source, ln, "NO_MATCH", s))
+
+def stream_rows(columns, reject):
+    # Single pass over (source, lines) columns in order. A row is yielded as
+    # soon as the next entry starts, since nothing can stitch onto it after
+    # that; rejects go to reject() as they are found. Only that one pending
+    # row is held, so memory does not grow with the corpus.
+    last = None
+    for source, lines in columns:
+        for ln, s in content_lines(lines):
+            m = ENTRY_RE.match(s)
+            if m:
+                if last is not None:
+                    yield last
+                last = Row(norm_space(m.group(1)), norm_space(m.group(2)), source, ln)
+            else:
+                stitch_line(last, source, ln, s, reject)
+    if last is not None:
+        yield last
+
+def parse_column(source, lines):
+    # Column-local pass. Lines before the column's first entry are returned
+    # as `head`: they stitch onto whatever row was last before this column,
+    # which merge_stream() resolves.
+    head = []
+    rows = []
+    rejects = []
+    last = None
+
+    for ln, s in content_lines(lines):
+        m = ENTRY_RE.match(s)
+        if m:
+            last = Row(norm_space(m.group(1)), norm_space(m.group(2)), source, ln)
+            rows.append(last)
+        elif last is None:
+            head.append((ln, s))
+        else:
+            stitch_line(last, source, ln, s, rejects.append)
+
+    return source, head, rows, rejects
+
+def merge_stream(parsed, reject, last=None):
+    # Join parse_column() results in column order, yielding rows once no
+    # later head can stitch onto them. `last` is the row the first column's
+    # head stitches onto (None at the start of the corpus); it is not
+    # yielded.
+    own = False
+    for source, head, col_rows, col_rejects in parsed:
+        for ln, s in head:
+            stitch_line(last, source, ln, s, reject)
+        for r in col_rejects:
+            reject(r)
+        if col_rows:
+            if own:
+                yield last
+            yield from col_rows[:-1]
+            last, own = col_rows[-1], True
+    if own:
+        yield last
+
+def merge_columns(parsed, last=None):
+    rejects = []
+    rows = list(merge_stream(parsed, rejects.append, last))
+    return rows, rejects
+
+def parse_file(fpath):
+    with open(fpath, "r", encoding="utf-8", errors="replace") as f:
+        return parse_column(Path(fpath).stem, f)
+
+def map_ahead(ex, fn, items, ahead: int):
+    # ex.map() in order, but with at most `ahead` results outstanding
+    pending = deque()
+    for x in items:
+        pending.append(ex.submit(fn, x))
+        if len(pending) >= ahead:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def stream_files(files, reject, jobs: int = 1):
+    # Rows of the stitched parse over files, in order. With jobs, columns
+    # parse independently in a pool and merge_stream() resolves the
+    # cross-column stitching in sorted column order, so any job count gives
+    # the serial output; a few columns per worker are in flight at a time.
+    if jobs == 1 or len(files) < 2:
+        yield from stream_rows(read_columns(files), reject)
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as ex:
+        yield from merge_stream(map_ahead(ex, parse_file, files, jobs * 4), reject)
+
+def parse_files(files, jobs: int = 1, each=iter):
+    # stream_files() collected into (rows, rejects); `each` wraps the row
+    # stream (a stageprof hook)
+    rejects = []
+    rows = list(each(stream_files(files, rejects.append, jobs)))
+    return rows, rejects
+
+def row_label(r: Row) -> str:
+    # slowest-item label for a row
+    return f"{r.source}:{r.line_no}"
+
+def row_line(r: Row) -> str:
+    return f"{r.lemma}\t{r.refs}\t{r.source}\t{r.line_no}\n"
+
+def row_lines(rows):
+    yield ROW_HEADER
+    for r in rows:
+        yield row_line(r)
+
+def reject_line(rej) -> str:
+    source, ln, reason, s = rej
+    return f"{source}\t{ln}\t{reason}\t{s}\n"
+
+def reject_lines(rejects):
+    yield REJ_HEADER
+    for rej in rejects:
+        yield reject_line(rej)
+
+def main() -> int:
+    files = sorted(glob.glob(str(SRC_DIR / "*.txt")))
+    if not files:
+        raise SystemExit(f"No files found in {SRC_DIR}/")
+
+    jobs = jobs_arg(sys.argv[1:])
+    cache = stagecache.lookup("parse_stitch", files, [OUT_ROWS, OUT_REJ])
+    if cache.hit():
+        return 0
+
+    prof = stageprof.start()
+    rows = 0
+    rejects = 0
+
+    # rows and rejects are written as the parse produces them
+    with prof.stage("parse_stitch", inputs=files, outputs=[OUT_ROWS, OUT_REJ]) as st, \
+         OUT_ROWS.open("w", encoding="utf-8") as fw, OUT_REJ.open("w", encoding="utf-8") as fr:
+        fw.write(ROW_HEADER)
+        fr.write(REJ_HEADER)
+
+        def reject(rej):
+            nonlocal rejects
+            fr.write(reject_line(rej))
+            rejects += 1
+
+        for r in st.items(stream_files(files, reject, jobs), key=row_label):
+            fw.write(row_line(r))
+            rows += 1
+        st.rows_in = len(files)
+        st.rows_out = rows
+    prof.finish()
+
+    cache.done(f"OK: wrote {OUT_ROWS} with {rows} rows",
+               f"OK: wrote {OUT_REJ} with {rejects} rejects")
     return 0
 
 if __name__ == "__main__":
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# Repair pass over the OTHER refs of index_refs_norm.tsv.
+#
+#   ./tools_repair_refs.py [--rules split_run,punct_noise,...] [--shapes N]
+#
+# Writes index_refs_repaired.tsv: index_refs_norm.tsv with each OTHER ref a
+# rule could read replaced by the refs it holds (ref_no renumbered per row),
+# plus two columns: repair_rule and repair_from (the OTHER ref_norm it came
+# from), both empty on refs left as they were. Everything downstream still
+# reads index_refs_norm.tsv; this stage is where new heuristics are tried.
+#
+# A group's tokens are reduced to a shape signature ("NUM NUM TEXT",
+# "LETTER NUMPAIR MARK") and the rules only ever see signatures: the first
+# rule that reads a signature gives a plan (which tokens make which ref, which
+# are dropped) that is memoized and applied to every group with that shape,
+# so a run costs one rule evaluation per distinct shape. Rules are tried in
+# RULES order; a new rule is a function of the signature returning a plan or
+# None. Prints what each rule recovered and, with --shapes N, the N commonest
+# signatures no rule reads.
+from collections import Counter
+from functools import lru_cache
+import csv
+import re
+import sys
+
+import stagecache
+import stageprof
+import volumes
+from cnt_batch import arg
+from refscan import kind
+from tools_normalize_refs import FIELDS
+from tsvio import LineSink
+
+INP = volumes.path("index_refs_norm.tsv")
+OUT = volumes.path("index_refs_repaired.tsv")
+
+OUT_FIELDS = FIELDS + ["repair_rule", "repair_from"]
+HEADER = "\t".join(OUT_FIELDS) + "\n"
+
+# shapes of the tokens refscan calls OTHER
+RE_NUM_PUNCT = re.compile(r"[\"“‘'(\[]*(\d+)[.,:;?!%\"”’»)\]]*")
+RE_PAIR_PUNCT = re.compile(r"[\"“‘'(\[]*(\d+,\d+)[.,:;?!%\"”’»)\]]*")
+RE_TEXT = re.compile(r".*[^\W\d_].*[^\W\d_].*")   # two letters or more
+RE_DIGIT = re.compile(r"\d")
+
+def shape(tok: str) -> str:
+    k = kind(tok)
+    if k == "SIGLA":
+        return "SIGLA" if tok.endswith(".") else "LETTER"
+    if k != "OTHER":
+        return k
+    if RE_PAIR_PUNCT.fullmatch(tok):
+        return "PAIR_P"     # 12,98"  (12,98
+    if RE_NUM_PUNCT.fullmatch(tok):
+        return "NUM_P"      # 79?  56.  "80
+    if RE_DIGIT.search(tok):
+        return "DIGITS"     # 464s  £9  4A: digits an OCR letter got into
+    if RE_TEXT.fullmatch(tok):
+        return "TEXT"       # ad  arbitran  (ad
+    return "PUNCT"          # —  [  €
+
+def signature(toks) -> tuple:
+    return tuple(shape(t) for t in toks)
+
+# --- rules --------------------------------------------------------------------
+#
+# A plan is a tuple of refs, each (core, sigla, marks) of token positions: a
+# core of one position is a NUMPAIR (or a bare number), of two a NUM NUM pair.
+
+NUMERIC = {"NUM": "NUM", "NUM_P": "NUM", "NUMPAIR": "NUMPAIR", "PAIR_P": "NUMPAIR"}
+PREFIX = ("SIGLA", "LETTER")
+
+def parse_core(sig, pos, punct_ok: bool, bare_ok: bool = False):
+    # plan for the tokens at positions pos, None unless all of them make refs;
+    # bare_ok lets a lone number be a ref, as tools_normalize_refs.py does
+    if not punct_ok and any(sig[i] in ("NUM_P", "PAIR_P") for i in pos):
+        return None
+    if bare_ok and len(pos) == 1 and NUMERIC.get(sig[pos[0]]) == "NUM":
+        return (((pos[0],), (), ()),)
+    refs = []
+    sigla = []
+    i = 0
+    while i < len(pos):
+        s = NUMERIC.get(sig[pos[i]], sig[pos[i]])
+        if s in PREFIX:
+            sigla.append(pos[i])
+            i += 1
+        elif s == "MARK" and refs and not sigla:
+            refs[-1][2].append(pos[i])
+            i += 1
+        elif s == "NUMPAIR":
+            refs.append(((pos[i],), tuple(sigla), []))
+            sigla = []
+            i += 1
+        elif s == "NUM" and i + 1 < len(pos) and NUMERIC.get(sig[pos[i + 1]]) == "NUM":
+            refs.append(((pos[i], pos[i + 1]), tuple(sigla), []))
+            sigla = []
+            i += 2
+        else:
+            return None
+    if sigla or not refs:
+        return None
+    return tuple((core, s, tuple(m)) for core, s, m in refs)
+
+def split_run(sig):
+    # refs run together without the ";" between them: 66 57 66 56, 1,50 33 19
+    return parse_core(sig, range(len(sig)), punct_ok=False)
+
+def punct_noise(sig):
+    # OCR punctuation on a number or on its own: 79 34?  "12,98"  43. 03  12.
+    return parse_core(sig, [i for i, s in enumerate(sig) if s != "PUNCT"], punct_ok=True, bare_ok=True)
+
+def cut(sig, start: int):
+    # positions from start up to the first TEXT (the clipped neighbouring
+    # column: its lemma, then that lemma's own refs) less a trailing initial,
+    # None when there is nothing to cut
+    end = sig.index("TEXT", start) if "TEXT" in sig[start:] else len(sig)
+    while end > start and sig[end - 1] in ("LETTER", "PUNCT"):
+        end -= 1
+    if start == 0 and end == len(sig):
+        return None
+    return [i for i in range(start, end) if sig[i] != "PUNCT"]
+
+def neighbour_text(sig):
+    # refs followed by the neighbouring column: 36 19 ad, 83 82 I,
+    # 69 77 12,88 acetum 69 76
+    pos = cut(sig, 0)
+    return parse_core(sig, pos, punct_ok=True) if pos is not None else None
+
+def leading_text(sig):
+    # lemma text that ended up before the refs: istas 125 88
+    start = 0
+    while start < len(sig) and sig[start] in ("TEXT", "PUNCT"):
+        start += 1
+    if not start:
+        return None
+    return parse_core(sig, cut(sig, start), punct_ok=True)
+
+RULES = [
+    ("split_run", split_run),
+    ("punct_noise", punct_noise),
+    ("neighbour_text", neighbour_text),
+    ("leading_text", leading_text),
+]
+
+def make_planner(rules):
+    @lru_cache(maxsize=None)
+    def plan(sig):
+        # (rule name, plan) of the first rule that reads sig, else None
+        for name, rule in rules:
+            p = rule(sig)
+            if p is not None:
+                return name, p
+        return None
+    return plan
+
+RE_DIGITS = re.compile(r"\d+")
+
+def ref_norm(toks, core) -> str:
+    if len(core) == 1:
+        m = RE_PAIR_PUNCT.fullmatch(toks[core[0]])
+        return m.group(1) if m else RE_DIGITS.search(toks[core[0]]).group(0)
+    return ",".join(RE_DIGITS.search(toks[i]).group(0) for i in core)
+
+# --- stage --------------------------------------------------------------------
+
+def repaired_records(refs, plan, stats):
+    # index_refs_norm records -> OUT_FIELDS records
+    cur_idx = None
+    ref_no = 0
+    for ref in refs:
+        if ref["cnt_idx"] != cur_idx:
+            cur_idx = ref["cnt_idx"]
+            ref_no = 0
+        out = [dict(ref, repair_rule="", repair_from="")]
+        if ref["ref_type"] == "OTHER":
+            stats["other"] += 1
+            toks = ref["ref_norm"].split()
+            sig = signature(toks)
+            found = plan(sig)
+            if found is None:
+                stats["unread"][sig] += 1
+            else:
+                name, p = found
+                stats["groups"][name] += 1
+                stats["refs"][name] += len(p)
+                out = [dict(ref, ref_norm=ref_norm(toks, core), ref_type="REF",
+                            sigla_prefix=" ".join(toks[i] for i in sigla),
+                            marks=" ".join(toks[i] for i in marks), attach_prev="0",
+                            repair_rule=name, repair_from=ref["ref_norm"])
+                       for core, sigla, marks in p]
+        for r in out:
+            ref_no += 1
+            r["ref_no"] = str(ref_no)
+            yield r
+
+def main() -> int:
+    argv = sys.argv[1:]
+    if not INP.exists():
+        raise SystemExit(f"Missing {INP} (run tools_normalize_refs.py)")
+    names = arg(argv, "--rules", ",".join(name for name, _ in RULES)).split(",")
+    unknown = [n for n in names if n not in dict(RULES)]
+    if unknown:
+        raise SystemExit(f"Unknown rule(s): {', '.join(unknown)} (have {', '.join(n for n, _ in RULES)})")
+    rules = [(n, dict(RULES)[n]) for n in names]
+    top = int(arg(argv, "--shapes", "0"))
+
+    cache = stagecache.lookup("repair", [INP], [OUT], args=[f"rules={','.join(names)}", f"shapes={top}"])
+    if cache.hit():
+        return 0
+
+    plan = make_planner(rules)
+    stats = {"other": 0, "groups": Counter(), "refs": Counter(), "unread": Counter()}
+    sink = LineSink()
+    w = csv.DictWriter(sink, delimiter="\t", fieldnames=OUT_FIELDS, lineterminator="\n")
+
+    def lines(refs):
+        yield HEADER
+        for r in repaired_records(refs, plan, stats):
+            w.writerow(r)
+            yield sink.take()
+
+    prof = stageprof.start()
+    with prof.stage("repair", inputs=[INP], outputs=[OUT]) as st, \
+         INP.open("r", encoding="utf-8") as f, OUT.open("w", encoding="utf-8") as g:
+        refs = csv.DictReader(st.count_in(f, header=True), delimiter="\t")
+        g.writelines(st.items(lines(refs), key=stageprof.tsv_label(0, 1), header=True))
+        st.rows_out = st.rows_in - stats["other"] + sum(stats["refs"].values()) + sum(stats["unread"].values())
+    prof.finish()
+
+    info = plan.cache_info()
+    report = [f"OK: wrote {OUT}: {sum(stats['groups'].values())} of {stats['other']} OTHER refs repaired "
+              f"into {sum(stats['refs'].values())} refs ({info.currsize} shapes, rules run {info.misses} times)"]
+    for name in names:
+        report.append(f"  {name}\t{stats['groups'][name]} OTHER refs -> {stats['refs'][name]} refs")
+    for sig, n in stats["unread"].most_common(top):
+        report.append(f"  unread\t{n}\t{' '.join(sig)}")
+    cache.done(*report)
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+# Page segmentation: pages/pNNN.png -> columns/pNNN-cNN.png, plus the text
+# line bands of every column in column_lines.tsv (y0, y1 and the band's ink
+# extent x0, x1, in the column image's pixels; y1 and x1 exclusive).
+#
+#   ./tools_segment_pages.py [--jobs N] [--columns 4] [--cuts grid|gutter]
+#                            [--pages p001,p002,...] [--check] [--profile]
+#
+# Needs numpy and Pillow (Pillow only to decode the page scans).
+#
+# Cuts: "grid" (the default) splits a page into --columns equal strips, which
+# is how the shipped columns/ were extracted. "gutter" cuts at the middle of
+# the gutters found in the page's ink profile instead, so a column no longer
+# carries the clipped edge of its neighbour. Line bands come from the row ink
+# profile of each column's text body (as found from the gutters, either way).
+#
+# Columns are written as 8-bit grayscale PNGs encoded the way the shipped ones
+# were (libpng's adaptive filter choice, zlib level 7, memLevel 9, filtered
+# strategy, 32 KiB IDAT chunks). A column whose pixels did not change keeps
+# its file, timestamps included, so re-running on the shipped pages leaves
+# columns/ and columns.sha256 as they are. --check writes nothing and reports
+# which columns reproduce their columns.sha256 digest.
+#
+# Each page is decoded once into .page_cache/ as a raw grayscale .npy (keyed
+# by the page's sha256); the pool workers memory-map it instead of decoding
+# and copying the scan again.
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import hashlib
+import os
+import struct
+import sys
+import zlib
+
+import stageprof
+import volumes
+from cnt_batch import arg, jobs_arg
+from manifests import file_sha256, read_manifest, write_manifest
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+PAGES_DIR = volumes.path("pages")
+COLS_DIR = volumes.path("columns")
+MANIFEST = volumes.path("columns.sha256")
+OUT_LINES = volumes.path("column_lines.tsv")
+CACHE_DIR = volumes.path(".page_cache")
+
+LINES_HEADER = "source_column\tband_no\ty0\ty1\tx0\tx1\n"
+
+PNG_SIG = b"\x89PNG\r\n\x1a\n"
+IDAT_CHUNK = 1 << 15
+# ancillary chunks of a new column, as in the shipped ones (pHYs comes from
+# the page)
+DEFAULT_CHUNKS = [
+    (b"gAMA", struct.pack(">I", 45455)),
+    (b"cHRM", struct.pack(">8I", 31270, 32900, 64000, 33000, 30000, 60000, 15000, 6000)),
+    (b"bKGD", struct.pack(">H", 255)),
+]
+
+INK = 160            # gray levels below this are ink
+BORDER_FRAC = 0.6    # x positions inked on more of the height are scan borders
+BORDER_GROW = 8      # ... and so are their neighbours this close
+EDGE = 30            # window either side of a candidate column left edge
+GUTTER = 80          # a gutter is looked for this far left of that edge
+SMOOTH = 9           # width of the ink profile's box filter there
+LINE_FRAC = 0.3      # rows with less ink than this share of the median are gaps
+MIN_ROW_INK = 2
+MIN_BAND = 12        # bands lower than this are specks
+
+# --- PNG ---------------------------------------------------------------------
+
+def read_chunks(b: bytes):
+    if b[:8] != PNG_SIG:
+        raise ValueError("not a PNG")
+    out = []
+    i = 8
+    while i < len(b):
+        n, = struct.unpack(">I", b[i:i + 4])
+        out.append((b[i + 4:i + 8], b[i + 8:i + 8 + n]))
+        i += 12 + n
+    return out
+
+def chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+def filter_rows(img):
+    # libpng's adaptive filtering: per row, the filter (None, Sub, Up,
+    # Average, Paeth) whose output bytes, read as signed, have the smallest
+    # sum of magnitudes; ties go to the lower filter type
+    x = img.astype(np.int16)
+    up = np.zeros_like(x)
+    up[1:] = x[:-1]
+    left = np.zeros_like(x)
+    left[:, 1:] = x[:, :-1]
+    ul = np.zeros_like(x)
+    ul[1:, 1:] = x[:-1, :-1]
+    p = left + up - ul
+    pa, pb, pc = np.abs(p - left), np.abs(p - up), np.abs(p - ul)
+    paeth = np.where((pa <= pb) & (pa <= pc), left, np.where(pb <= pc, up, ul))
+    cands = np.stack([x, x - left, x - up, x - ((left + up) >> 1), x - paeth]).astype(np.uint8)
+    mag = cands.astype(np.int32)
+    best = np.minimum(mag, 256 - mag).sum(axis=2).argmin(axis=0)
+    rows = cands[best, np.arange(x.shape[0])]
+    return np.hstack([best.astype(np.uint8)[:, None], rows])
+
+def encode_png(img, pre, post) -> bytes:
+    # 8-bit grayscale PNG; pre/post are the (kind, data) chunks before and
+    # after the image data
+    h, w = img.shape
+    co = zlib.compressobj(7, zlib.DEFLATED, 15, 9, zlib.Z_FILTERED)
+    z = co.compress(filter_rows(img).tobytes()) + co.flush()
+    out = [PNG_SIG, chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, 0, 0, 0, 0))]
+    out += [chunk(k, d) for k, d in pre]
+    out += [chunk(b"IDAT", z[i:i + IDAT_CHUNK]) for i in range(0, len(z), IDAT_CHUNK)]
+    out += [chunk(k, d) for k, d in post]
+    out.append(chunk(b"IEND", b""))
+    return b"".join(out)
+
+def split_ancillary(chunks):
+    # (pre, post) chunks around the image data, IHDR/IDAT/IEND left out
+    pre, post = [], []
+    seen_idat = False
+    for kind, data in chunks:
+        if kind == b"IDAT":
+            seen_idat = True
+        elif kind not in (b"IHDR", b"IEND"):
+            (post if seen_idat else pre).append((kind, data))
+    return pre, post
+
+def column_png(img, old, phys) -> bytes:
+    # The old file's bytes when its pixels are unchanged (it keeps its
+    # timestamp chunks), else a fresh encoding with DEFAULT_CHUNKS
+    if old is not None:
+        pre, post = split_ancillary(read_chunks(old))
+        b = encode_png(img, pre, post)
+        if b == old:
+            return b
+    pre = DEFAULT_CHUNKS + ([(b"pHYs", phys)] if phys else [])
+    return encode_png(img, pre, [])
+
+# --- pages -------------------------------------------------------------------
+
+def gray(a):
+    # Pillow's "L" conversion (ITU-R 601-2 luma), vectorized
+    if a.ndim == 2:
+        return a
+    a = a[..., :3].astype(np.uint32)
+    return ((a[..., 0] * 19595 + a[..., 1] * 38470 + a[..., 2] * 7471 + 0x8000) >> 16).astype(np.uint8)
+
+def load_page(p: Path):
+    # memory-mapped grayscale pixels, decoded into CACHE_DIR on first use
+    cached = CACHE_DIR / f"{p.stem}-{file_sha256(p)[:16]}.npy"
+    if not cached.exists():
+        from PIL import Image
+        with Image.open(p) as im:
+            if im.mode not in ("L", "RGB", "RGBA"):
+                im = im.convert("RGB")
+            a = gray(np.asarray(im))
+        CACHE_DIR.mkdir(exist_ok=True)
+        tmp = cached.with_suffix(f".{os.getpid()}.tmp")
+        m = np.lib.format.open_memmap(tmp, mode="w+", dtype=np.uint8, shape=a.shape)
+        m[:] = a
+        m.flush()
+        del m
+        os.replace(tmp, cached)
+        for stale in CACHE_DIR.glob(f"{p.stem}-*.npy"):
+            if stale != cached:
+                stale.unlink()
+    return np.load(cached, mmap_mode="r")
+
+def page_phys(p: Path):
+    for kind, data in read_chunks(p.read_bytes()):
+        if kind == b"pHYs":
+            return data
+    return None
+
+# --- segmentation ------------------------------------------------------------
+
+def runs(mask):
+    # (start, end) of every run of True in a 1-d mask
+    d = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    return np.flatnonzero(d == 1), np.flatnonzero(d == -1)
+
+def ink_mask(g):
+    # ink pixels, scan borders (the dark binding edge) blanked out
+    ink = g < INK
+    border = np.convolve(ink.mean(axis=0) > BORDER_FRAC, np.ones(2 * BORDER_GROW + 1), mode="same") > 0
+    ink[:, border] = False
+    return ink
+
+def grid_cuts(width: int, n: int):
+    return [i * width // n for i in range(n + 1)]
+
+def gutter_cuts(ink, n: int):
+    # Entries are left-aligned, so a column starts where the ink profile
+    # rises most steeply (more ink in the EDGE pixels right of x than left
+    # of it). Per inner grid cut, that edge is looked for within half a
+    # column, and the cut goes at the emptiest x within GUTTER left of it.
+    width = ink.shape[1]
+    prof = ink.sum(axis=0).astype(np.int64)
+    c = np.concatenate(([0], np.cumsum(prof)))
+    x = np.arange(EDGE, width - EDGE)
+    rise = np.zeros(width, dtype=np.int64)
+    rise[x] = (c[x + EDGE] - c[x]) - (c[x] - c[x - EDGE])
+    smooth = np.convolve(prof, np.ones(SMOOTH, dtype=np.int64), mode="same")
+    half = width // (2 * n)
+    out = [0]
+    for cut in grid_cuts(width, n)[1:-1]:
+        edge = cut - half + int(rise[cut - half:cut + half].argmax())
+        lo = max(out[-1] + 1, edge - GUTTER)
+        out.append(lo + int(smooth[lo:edge].argmin()) if edge > lo else edge)
+    out.append(width)
+    return out
+
+def text_bodies(cuts):
+    # (x0, x1) of each column's text: between its gutters, but the outer
+    # columns no wider than the inner ones, which keeps the page margins out
+    bodies = list(zip(cuts, cuts[1:]))
+    n = len(bodies)
+    if n >= 3:
+        pitch = (cuts[-2] - cuts[1]) // (n - 2)
+        bodies[0] = (max(0, cuts[1] - pitch), cuts[1])
+        bodies[-1] = (cuts[-2], min(cuts[-1], cuts[-2] + pitch))
+    return bodies
+
+def line_bands(ink):
+    # (y0, y1) half-open text-line bands of one column's text body
+    rows = ink.sum(axis=1)
+    inked = rows[rows > 0]
+    if not len(inked):
+        return []
+    starts, ends = runs(rows >= max(MIN_ROW_INK, LINE_FRAC * np.median(inked)))
+    tall = ends - starts >= MIN_BAND
+    return list(zip(starts[tall].tolist(), ends[tall].tolist()))
+
+def band_extents(ink, bands, x0: int, x1: int, body):
+    # (y0, y1, bx0, bx1) per band: its ink within the column image [x0, x1)
+    # and the text body, relative to x0
+    lo, hi = max(x0, body[0]), min(x1, body[1])
+    out = []
+    for y0, y1 in bands:
+        xs = np.flatnonzero(ink[y0:y1, lo:hi].any(axis=0)) if hi > lo else []
+        bx0, bx1 = (int(xs[0]) + lo - x0, int(xs[-1]) + 1 + lo - x0) if len(xs) else (0, 0)
+        out.append((y0, y1, bx0, bx1))
+    return out
+
+def segment_page(job):
+    # One page: writes its changed columns (unless checking) and returns
+    # (page, [(column, sha256, changed, bands)])
+    p, n, cuts_mode, check = job
+    g = load_page(p)
+    ink = ink_mask(g)
+    gutters = gutter_cuts(ink, n)
+    cuts = gutters if cuts_mode == "gutter" else grid_cuts(g.shape[1], n)
+    # bands come from the text body whatever the cuts: y is the same in both
+    bodies = text_bodies(gutters)
+    phys = page_phys(p)
+    out = []
+    for i in range(n):
+        x0, x1 = cuts[i], cuts[i + 1]
+        name = f"{p.stem}-c{i:02d}"
+        dst = COLS_DIR / f"{name}.png"
+        old = dst.read_bytes() if dst.exists() else None
+        b = column_png(np.ascontiguousarray(g[:, x0:x1]), old, phys)
+        changed = b != old
+        if changed and not check:
+            tmp = dst.with_suffix(".png.tmp")
+            tmp.write_bytes(b)
+            os.replace(tmp, dst)
+        bands = line_bands(ink[:, slice(*bodies[i])])
+        out.append((name, hashlib.sha256(b).hexdigest(), changed, band_extents(ink, bands, x0, x1, bodies[i])))
+    return p.stem, out
+
+def main() -> int:
+    argv = sys.argv[1:]
+    if np is None:
+        raise SystemExit("tools_segment_pages.py needs numpy and Pillow (pip install numpy pillow)")
+    jobs = jobs_arg(argv)
+    n = int(arg(argv, "--columns", "4"))
+    cuts_mode = arg(argv, "--cuts", "grid")
+    only = arg(argv, "--pages", None)
+    check = "--check" in argv
+    if cuts_mode not in ("grid", "gutter"):
+        raise SystemExit("--cuts is grid or gutter")
+
+    pages = sorted(PAGES_DIR.glob("*.png"))
+    if only:
+        want = set(only.split(","))
+        pages = [p for p in pages if p.stem in want]
+    if not pages:
+        raise SystemExit(f"No pages in {PAGES_DIR}/")
+    COLS_DIR.mkdir(exist_ok=True)
+
+    prof = stageprof.start()
+    jobs_list = [(p, n, cuts_mode, check) for p in pages]
+    with prof.stage("segment", inputs=[PAGES_DIR], outputs=[None if check else COLS_DIR]) as st:
+        if jobs == 1 or len(pages) < 2:
+            results = list(st.items(map(segment_page, jobs_list), key=lambda r: r[0]))
+        else:
+            with ProcessPoolExecutor(max_workers=jobs) as ex:
+                results = list(st.items(ex.map(segment_page, jobs_list), key=lambda r: r[0]))
+        st.rows_in = len(pages)
+        st.rows_out = sum(len(cols) for _, cols in results)
+    prof.finish()
+
+    cols = [c for _, page_cols in results for c in page_cols]
+    entries = read_manifest(MANIFEST)
+    if check:
+        bad = [name for name, digest, _, _ in cols if entries.get(f"{name}.png") != digest]
+        for name in bad:
+            print(f"DIFF: {name}.png", file=sys.stderr)
+        print(f"{len(cols) - len(bad)} of {len(cols)} columns reproduce {MANIFEST}")
+        return 1 if bad else 0
+
+    new = dict(entries)
+    for name, digest, _, _ in cols:
+        new[f"{name}.png"] = digest
+    if new != entries:
+        write_manifest(MANIFEST, dict(sorted(new.items())))
+    lines = [f"{name}\t{k}\t" + "\t".join(map(str, band)) + "\n"
+             for name, _, _, bands in cols for k, band in enumerate(bands, start=1)]
+    if only and OUT_LINES.exists():
+        # keep the bands of the pages not segmented this time
+        done = {c[0] for c in cols}
+        with OUT_LINES.open("r", encoding="utf-8") as f:
+            next(f, None)
+            lines += [line for line in f if line.split("\t", 1)[0] not in done]
+        lines.sort(key=lambda line: (line.split("\t", 1)[0], int(line.split("\t", 2)[1])))
+    with OUT_LINES.open("w", encoding="utf-8") as g:
+        g.write(LINES_HEADER)
+        g.writelines(lines)
+
+    changed = sum(1 for c in cols if c[2])
+    print(f"OK: wrote {COLS_DIR} with {len(cols)} columns ({changed} changed), "
+          f"{OUT_LINES} with {len(lines)} bands")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,90 +1,64 @@
 #!/usr/bin/env python3
-from pathlib import Path
-import re
+import stagecache
+import stageprof
+import volumes
+from refscan import scan, tsv_kind
 
-INP = Path("index_rows_id.tsv")
-OUT = Path("index_refs.tsv")
+INP = volumes.path("index_rows_id.tsv")
+OUT = volumes.path("index_refs.tsv")
 
-# Token patterns (ordered by "specificity")
-RE_NUMPAIR = re.compile(r"^\d+,\d+$")          # 121,98
-RE_NUM     = re.compile(r"^\d+$")              # 121
-RE_SIGLA   = re.compile(r"^[A-Za-z]\.?$")      # v.  J  K.
-RE_MARK    = re.compile(r"^[\^°\*]+$")         # ^  °  **
+HEADER = "cnt_idx\tref_token\tref_kind\tsource_column\tline_no\n"
 
-def kind(tok: str) -> str:
-    if RE_NUMPAIR.match(tok): return "NUMPAIR"
-    if RE_NUM.match(tok):     return "NUM"
-    if RE_MARK.match(tok):    return "MARK"
-    if RE_SIGLA.match(tok):   return "SIGLA"
-    return "OTHER"
+def token_records(lines, stats):
+    # (cnt_idx, token, kind, source_column, line_no) per token, kind as
+    # refscan.scan() gives it (";" is SEP)
+    lines = iter(lines)
+    hdr = next(lines, "").rstrip("\n").split("\t")
+    if hdr[:6] != ["cnt_idx","lemma_key","lemma","refs_raw","source_column","line_no"]:
+        raise SystemExit("Unexpected header in index_rows_id.tsv")
 
-def normalize_refs(s: str) -> str:
-    s = s.strip()
-    # unify separators
-    s = s.replace(";", " ; ")
-    s = s.replace(",", ",")
-    # detach common marks (keep them as tokens)
-    s = s.replace("^", " ^ ")
-    s = s.replace("°", " ° ")
-    s = s.replace("*", " * ")
-    # collapse whitespace
-    s = re.sub(r"\s+", " ", s).strip()
-    return s
-
-def split_tokens(s: str):
-    # split on spaces, but keep ";" as its own token
-    parts = s.split(" ")
-    toks = []
-    for p in parts:
-        p = p.strip()
-        if not p:
+    n = 0
+    for line in lines:
+        line = line.rstrip("\n")
+        if not line:
             continue
-        # drop empty punctuation-only noise except our explicit separator
-        if p in [",", ".", ":"]:
+        parts = line.split("\t")
+        if len(parts) < 6:
             continue
-        toks.append(p)
-    return toks
-
-def main() -> int:
-    if not INP.exists():
-        raise SystemExit(f"Missing input: {INP} (run v1.7 tools_add_cnt_idx.py first)")
+        cnt_idx, refs_raw, src, ln = parts[0], parts[3], parts[4], parts[5]
 
-    with INP.open("r", encoding="utf-8") as f, OUT.open("w", encoding="utf-8") as g:
-        hdr = f.readline().rstrip("\n").split("\t")
-        if hdr[:6] != ["cnt_idx","lemma_key","lemma","refs_raw","source_column","line_no"]:
-            raise SystemExit("Unexpected header in index_rows_id.tsv")
+        for t, k in scan(refs_raw):
+            yield (cnt_idx, t, k, src, ln)
+            n += 1
+        stats["tokens"] = n
 
-        g.write("cnt_idx\tref_token\tref_kind\tsource_column\tline_no\n")
+def token_line(rec) -> str:
+    cnt_idx, t, k, src, ln = rec
+    return f"{cnt_idx}\t{t}\t{tsv_kind(k)}\t{src}\t{ln}\n"
 
-        n = 0
-        for line in f:
-            line = line.rstrip("\n")
-            if not line:
-                continue
-            parts = line.split("\t")
-            if len(parts) < 6:
-                continue
-            cnt_idx, refs_raw, src, ln = parts[0], parts[3], parts[4], parts[5]
+def token_lines(lines, stats):
+    yield HEADER
+    for rec in token_records(lines, stats):
+        yield token_line(rec)
 
-            refs_norm = normalize_refs(refs_raw)
-            toks = split_tokens(refs_norm)
-
-            for t in toks:
-                # keep ';' as a structural separator token (useful later)
-                if t == ";":
-                    g.write(f"{cnt_idx}\t;\tSEP\t{src}\t{ln}\n")
-                    n += 1
-                    continue
+def main() -> int:
+    if not INP.exists():
+        raise SystemExit(f"Missing input: {INP} (run v1.7 tools_add_cnt_idx.py first)")
 
-                # strip trailing commas that OCR sometimes leaves dangling
-                t2 = t.rstrip(",")
-                if not t2:
-                    continue
+    cache = stagecache.lookup("tokenize", [INP], [OUT])
+    if cache.hit():
+        return 0
 
-                g.write(f"{cnt_idx}\t{t2}\t{kind(t2)}\t{src}\t{ln}\n")
-                n += 1
+    prof = stageprof.start()
+    stats = {"tokens": 0}
+    with prof.stage("tokenize", inputs=[INP], outputs=[OUT]) as st, \
+         INP.open("r", encoding="utf-8") as f, OUT.open("w", encoding="utf-8") as g:
+        lines = token_lines(st.count_in(f, header=True), stats)
+        g.writelines(st.items(lines, key=stageprof.tsv_label(0), header=True))
+        st.rows_out = stats["tokens"]
+    prof.finish()
 
-    print(f"OK: wrote {OUT} with {n} tokens")
+    cache.done(f"OK: wrote {OUT} with {stats['tokens']} tokens")
     return 0
 
 if __name__ == "__main__":
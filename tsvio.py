@@ -0,0 +1,64 @@
+# Line-level helpers shared by the tools_*.py stages so they can be chained
+# as generators (tools_build_all.py) as well as run one file at a time.
+from collections import deque
+import filecmp
+import os
+
+class LineSink:
+    # File-like target for csv writers; collects what one writerow() emits.
+    def __init__(self):
+        self.buf = []
+
+    def write(self, s: str) -> None:
+        self.buf.append(s)
+
+    def take(self) -> str:
+        s = "".join(self.buf)
+        self.buf.clear()
+        return s
+
+def tee(path, lines):
+    # Pass lines through, also writing them to path unless path is None.
+    if path is None:
+        yield from lines
+        return
+    with path.open("w", encoding="utf-8") as g:
+        for line in lines:
+            g.write(line)
+            yield line
+
+def tee_if_changed(path, lines, changed: set):
+    # Like tee(), but leaves path untouched when the new content is identical;
+    # paths that were actually rewritten are added to `changed`.
+    if path is None:
+        yield from lines
+        return
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("w", encoding="utf-8") as g:
+        for line in lines:
+            g.write(line)
+            yield line
+    if path.exists() and filecmp.cmp(tmp, path, shallow=False):
+        tmp.unlink()
+    else:
+        os.replace(tmp, path)
+        changed.add(str(path))
+
+def tee_records(write, path, header: str, records, fmt):
+    # Pass records through, writing header + fmt(record) lines to path with
+    # write (tee or a tee_if_changed wrapper).
+    pending = deque()
+
+    def lines():
+        yield header
+        for rec in records:
+            pending.append(rec)
+            yield fmt(rec)
+
+    for _ in write(path, lines()):
+        while pending:
+            yield pending.popleft()
+
+def drain(lines) -> None:
+    for _ in lines:
+        pass
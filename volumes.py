@@ -0,0 +1,103 @@
+# Data roots and index volumes.
+#
+# A data root holds one index volume: its ocr_clean/ and everything the
+# build writes, under the same names as in a single-volume checkout. The
+# tools_*.py scripts and the cnt_*.py queries use CNT_DATA_ROOT (default:
+# the current directory).
+#
+# A root with a volume.json ({"id": "cnt2"}) is a named volume: its cnt_idx
+# values carry the id (CNT-IDX-cnt2-0000001), so rows from different
+# volumes never collide. Without one, ids stay CNT-IDX-0000001.
+#
+# cnt_lookup.py and cnt_reverse.py query several volumes at once with
+# --volumes ROOT[,ROOT...] (or CNT_VOLUMES). Each volume's tables open on
+# first use; a Federation runs one query on all volumes in parallel.
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import json
+import os
+import re
+
+ROOT = Path(os.environ.get("CNT_DATA_ROOT", "."))
+VOLUME_FILE = "volume.json"
+
+RE_VOLUME_ID = re.compile(r"[A-Za-z0-9_]+")
+
+def path(name: str) -> Path:
+    # a file of the current data root; plain `name` for the default root
+    return ROOT / name
+
+def volume_id(root: Path = ROOT):
+    # id from root/volume.json, None when the root is not a named volume
+    p = Path(root) / VOLUME_FILE
+    if not p.exists():
+        return None
+    with p.open("r", encoding="utf-8") as f:
+        vid = json.load(f).get("id")
+    if not isinstance(vid, str) or not RE_VOLUME_ID.fullmatch(vid):
+        raise SystemExit(f"Bad volume id in {p}: {vid!r} (letters, digits and _ only)")
+    return vid
+
+def cnt_prefix(root: Path = ROOT) -> str:
+    vid = volume_id(root)
+    return f"CNT-IDX-{vid}-" if vid else "CNT-IDX-"
+
+class Volume:
+    def __init__(self, root):
+        self.root = Path(root)
+        self.id = volume_id(self.root)
+        self.name = self.id or self.root.resolve().name
+        self._open = {}
+
+    def get(self, what: str, factory):
+        # factory(root), built on first use and kept until close()
+        obj = self._open.get(what)
+        if obj is None:
+            obj = self._open[what] = factory(self.root)
+        return obj
+
+    def close(self) -> None:
+        for obj in self._open.values():
+            obj.close()
+        self._open.clear()
+
+def volume_args(argv):
+    # Returns (volumes_or_None, remaining_args) for --volumes ROOT[,ROOT...],
+    # falling back to CNT_VOLUMES.
+    argv = list(argv)
+    spec = os.environ.get("CNT_VOLUMES", "")
+    if "--volumes" in argv:
+        i = argv.index("--volumes")
+        if i + 1 >= len(argv):
+            raise SystemExit("--volumes needs a comma-separated list of data roots")
+        spec = argv[i + 1]
+        del argv[i:i + 2]
+    roots = [r.strip() for r in spec.split(",") if r.strip()]
+    if not roots:
+        return None, argv
+    vols = []
+    for r in roots:
+        if not Path(r).is_dir():
+            raise SystemExit(f"Not a data root: {r}")
+        vols.append(Volume(r))
+    names = [v.name for v in vols]
+    if len(set(names)) != len(names):
+        raise SystemExit(f"Volume names must be unique: {', '.join(names)}")
+    return vols, argv
+
+class Federation:
+    # One thread per volume: the lookups are mmap reads, file seeks and
+    # sqlite calls, and each volume's tables stay in the process that
+    # opened them.
+    def __init__(self, vols):
+        self.volumes = vols
+        self.pool = ThreadPoolExecutor(max_workers=len(vols))
+
+    def map(self, fn):
+        # [fn(volume) for each volume], run concurrently, in volume order
+        return list(self.pool.map(fn, self.volumes))
+
+    def close(self) -> None:
+        self.pool.shutdown()
+        for v in self.volumes:
+            v.close()